@@ -0,0 +1,86 @@
+""" Measure the cost of detecting explicitly typed enums on an enum-heavy header
+
+Generates a header with many enums, each referenced by struct fields and
+function arguments. Every enum declaration and every reference to an enum
+needs to know whether the enum's type is explicit. This times answering that
+by tokenizing each time, and by using the cached _explicitly_typed_enum_p.
+
+Usage: python bench/enum_tokens.py [number of enums] [enumerators per enum]
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+import clang.cindex as clang
+from clang.cindex import CursorKind, TypeKind
+
+import cl_bindgen.processfile as processfile
+
+def write_header(path, num_enums, num_values):
+    with open(path, 'w') as f:
+        for i in range(num_enums):
+            fixed_type = ' : short' if i % 2 else ''
+            f.write(f'enum enum_{i}{fixed_type} {{\n')
+            f.writelines(f'  ENUM_{i}_VALUE_{j},\n' for j in range(num_values))
+            f.write('};\n\n')
+        for i in range(num_enums):
+            f.write(f'struct holder_{i} {{ enum enum_{i} a; enum enum_{i} b; }};\n')
+            f.write(f'enum enum_{i} function_{i}(enum enum_{i} a, enum enum_{i} b);\n')
+
+def _enum_decl(type_obj):
+    if type_obj.kind == TypeKind.ELABORATED:
+        type_obj = type_obj.get_named_type()
+    if type_obj.kind == TypeKind.ENUM:
+        return type_obj.get_declaration()
+    return None
+
+def collect_enum_uses(tu):
+    """ Return the enum declaration for every declaration of or reference to an enum """
+    uses = []
+    for cursor in tu.cursor.get_children():
+        if cursor.kind == CursorKind.ENUM_DECL:
+            uses.append(cursor)
+            continue
+        elif cursor.kind == CursorKind.STRUCT_DECL:
+            types = [field.type for field in cursor.type.get_fields()]
+        elif cursor.kind == CursorKind.FUNCTION_DECL:
+            types = [cursor.result_type] + [arg.type for arg in cursor.get_arguments()]
+        else:
+            continue
+        uses.extend(decl for decl in map(_enum_decl, types) if decl is not None)
+    return uses
+
+def time_detection(uses, detect_fn):
+    start = time.perf_counter()
+    results = [detect_fn(decl) for decl in uses]
+    return (time.perf_counter() - start, results)
+
+def main(args):
+    num_enums = int(args[0]) if len(args) > 0 else 500
+    num_values = int(args[1]) if len(args) > 1 else 50
+    with tempfile.TemporaryDirectory() as tmpdir:
+        header = os.path.join(tmpdir, 'enums.h')
+        write_header(header, num_enums, num_values)
+        tu = clang.Index.create().parse(header)
+        uses = collect_enum_uses(tu)
+
+        uncached_time, uncached = time_detection(uses, processfile._tokenize_explicitly_typed_enum_p)
+        processfile._reset_type_caches()
+        cached_time, cached = time_detection(uses, processfile._explicitly_typed_enum_p)
+
+    print(f'{num_enums} enums with {num_values} values each, {len(uses)} uses')
+    print(f'  tokenizing every use: {uncached_time:.3f}s')
+    print(f'  cached:               {cached_time:.3f}s')
+    print(f'  speedup:              {uncached_time / cached_time:.2f}x')
+    if uncached != cached:
+        print('ERROR: the results differ', file=sys.stderr)
+        return False
+    return True
+
+if __name__ == "__main__":
+    if main(sys.argv[1:]):
+        sys.exit(0)
+    else:
+        sys.exit(1)
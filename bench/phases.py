@@ -0,0 +1,147 @@
+""" Time each phase of processfile.process_files on synthetic headers
+
+For each scenario of synthetic.py, a header is generated and processed with
+the default options, and the time spent in each of the phases of
+cl_bindgen.stats is recorded. A phase's time doesn't include the time of the
+phases it calls, so the times add up to the total.
+
+Each scenario is run in a new process, so the scenarios don't share caches or
+memory. The header is then processed again in a child of that process, and
+its peak resident set size, which includes the memory allocated by libclang,
+is recorded.
+
+The results are written to a JSON file. When an earlier results file is given
+with --compare, each phase is printed next to its time in that file.
+
+Usage: python bench/phases.py [-o RESULTS] [--compare OLD_RESULTS] [--no-memory] [SCENARIO ...]
+"""
+
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import clang.cindex as clang
+
+import cl_bindgen.processfile as processfile
+import cl_bindgen.stats as stats
+from cl_bindgen.util import build_default_options
+
+import synthetic
+
+def _options(output):
+    options = build_default_options()
+    options.output = output
+    return options
+
+def run_scenario(scenario, directory, memory=True):
+    header = os.path.join(directory, f'{scenario}.h')
+    synthetic.write_header(scenario, header)
+    options = _options(os.path.join(directory, f'{scenario}.lisp'))
+
+    with stats.Statistics() as statistics:
+        start = time.perf_counter()
+        processfile.process_files([header], options)
+        total = time.perf_counter() - start
+    result = {
+        'header_bytes': os.path.getsize(header),
+        'output_bytes': os.path.getsize(options.output),
+        'total': total,
+        'phases': statistics.phases,
+    }
+
+    if memory:
+        # The header is processed by the only child of this process, so the
+        # peak of its children is the peak of that run:
+        subprocess.run([sys.executable, __file__, '--process-header', header, options.output],
+                       check=True)
+        peak = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+        # ru_maxrss is in bytes on macOS and in kilobytes elsewhere:
+        result['peak_rss'] = peak if sys.platform == 'darwin' else peak * 1024
+    return result
+
+def run_scenario_process(scenario, directory, memory=True):
+    """ Call run_scenario in a new process, returning its result """
+    results = os.path.join(directory, f'{scenario}.json')
+    command = [sys.executable, __file__, '--scenario-process', results, scenario]
+    if not memory:
+        command.append('--no-memory')
+    subprocess.run(command, check=True)
+    with open(results) as f:
+        return json.load(f)
+
+def _print_result(scenario, result, old):
+    def line(name, value, old_value):
+        text = f'  {name:<18} {value:9.3f}s'
+        if old_value:
+            text += f'  {old_value:9.3f}s  {value / old_value:5.2f}x'
+        print(text)
+
+    old = old or {}
+    print(f'{scenario}: {result["header_bytes"]} byte header')
+    for (phase, seconds) in result['phases'].items():
+        line(phase, seconds, old.get('phases', {}).get(phase))
+    line('total', result['total'], old.get('total'))
+    if 'peak_rss' in result:
+        print(f'  {"peak RSS":<18} {result["peak_rss"] / 2**20:9.1f}MiB')
+
+def main(args):
+    parser = argparse.ArgumentParser(description='Time each phase of processing synthetic headers')
+    parser.add_argument('scenarios', nargs='*', metavar='SCENARIO',
+                        help=f'the scenarios to run, out of {", ".join(synthetic.SCENARIOS)}.'
+                        ' All of them are run by default')
+    parser.add_argument('-o', '--output', default='bench-results.json',
+                        help='the file to write the results to')
+    parser.add_argument('--compare', metavar='RESULTS',
+                        help='a results file from an earlier run to compare against')
+    parser.add_argument('--no-memory', dest='memory', action='store_false',
+                        help="don't measure peak memory, which processes each header a second time")
+    # Used by the processes started by run_scenario_process and run_scenario:
+    parser.add_argument('--scenario-process', metavar='RESULTS', help=argparse.SUPPRESS)
+    parser.add_argument('--process-header', nargs=2, metavar=('HEADER', 'OUTPUT'),
+                        help=argparse.SUPPRESS)
+    args = parser.parse_args(args)
+
+    if args.process_header:
+        (header, output) = args.process_header
+        processfile.process_files([header], _options(output))
+        return
+    if args.scenario_process:
+        [scenario] = args.scenarios
+        result = run_scenario(scenario, os.path.dirname(args.scenario_process), args.memory)
+        with open(args.scenario_process, 'w') as f:
+            json.dump(result, f)
+        return
+
+    scenarios = args.scenarios or list(synthetic.SCENARIOS)
+    unknown = [s for s in scenarios if s not in synthetic.SCENARIOS]
+    if unknown:
+        parser.error(f'unknown scenarios: {", ".join(unknown)}')
+
+    old_results = {}
+    if args.compare:
+        with open(args.compare) as f:
+            old_results = json.load(f)['scenarios']
+
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        for scenario in scenarios:
+            results[scenario] = run_scenario_process(scenario, directory, args.memory)
+            _print_result(scenario, results[scenario], old_results.get(scenario))
+
+    with open(args.output, 'w') as f:
+        json.dump({
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'python': platform.python_version(),
+            'libclang': clang.conf.get_filename(),
+            'scenarios': results,
+        }, f, indent=2)
+        f.write('\n')
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
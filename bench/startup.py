@@ -0,0 +1,64 @@
+""" Measure how long it takes cl-bindgen to start up
+
+Runs each command several times in a new interpreter and reports the best
+wall time. With --importtime, the slowest imports of the first command,
+as reported by python -X importtime, are also printed.
+
+Usage: python bench/startup.py [--importtime] [runs]
+"""
+
+import os
+import subprocess
+import sys
+import time
+
+COMMANDS = [
+    ['--version'],
+    ['--help'],
+    ['files', '--help'],
+    ['batch', '--help'],
+]
+
+def _run(args, python_args=()):
+    env = dict(os.environ)
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [root, env.get('PYTHONPATH')]))
+    command = [sys.executable, *python_args, '-m', 'cl_bindgen', *args]
+    return subprocess.run(command, env=env, capture_output=True, text=True, check=False)
+
+def time_command(args, runs):
+    best = None
+    for _ in range(runs):
+        start = time.perf_counter()
+        _run(args)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def slowest_imports(args, count=15):
+    """ Return the `count` imports with the largest cumulative time, in microseconds """
+    result = _run(args, python_args=['-X', 'importtime'])
+    imports = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        (_, cumulative, name) = line[len('import time:'):].split('|')
+        imports.append((int(cumulative), name.rstrip()))
+    imports.sort(reverse=True)
+    return imports[:count]
+
+def main(args):
+    importtime = '--importtime' in args
+    args = [a for a in args if a != '--importtime']
+    runs = int(args[0]) if args else 10
+
+    print(f'best of {runs} runs:')
+    for command in COMMANDS:
+        print(f'  cl-bindgen {" ".join(command):<16} {time_command(command, runs) * 1000:7.1f}ms')
+    if importtime:
+        print(f'slowest imports of cl-bindgen {" ".join(COMMANDS[0])}:')
+        for (cumulative, name) in slowest_imports(COMMANDS[0]):
+            print(f'  {cumulative / 1000:7.1f}ms {name}')
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
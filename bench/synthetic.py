@@ -0,0 +1,107 @@
+""" Generate large synthetic header files for benchmarking
+
+Each generator writes a header that stresses one part of processing a file.
+The headers only depend on their parameters, so runs on different trees
+process the same input.
+
+Usage: python bench/synthetic.py SCENARIO OUTPUT_FILE
+"""
+
+import sys
+
+_ARG_TYPES = ['int', 'unsigned long', 'const char *', 'double', 'void *',
+              'struct record_{r} *', 'enum kind_{e}', 'short[4]']
+
+def functions(f, count):
+    """ `count` function declarations, using a few hundred structs and enums """
+    records = max(1, count // 100)
+    for i in range(records):
+        f.write(f'struct record_{i} {{ int id; struct record_{i} *next; }};\n')
+        f.write(f'enum kind_{i} {{ KIND_{i}_A, KIND_{i}_B }};\n')
+    f.write('\n')
+    for i in range(count):
+        args = []
+        for j in range(i % 5):
+            arg_type = _ARG_TYPES[(i + j) % len(_ARG_TYPES)].format(r=(i + j) % records,
+                                                                    e=i % records)
+            if arg_type.endswith(']'):
+                (element, _, size) = arg_type.partition('[')
+                args.append(f'{element} arg_{j}[{size}')
+            else:
+                args.append(f'{arg_type} arg_{j}')
+        result = 'const char *' if i % 7 == 0 else 'int '
+        f.write(f'{result}function_number_{i}({", ".join(args) or "void"});\n')
+
+def nested_structs(f, count, depth):
+    """ `count` structs, each nesting anonymous structs and unions `depth` levels deep """
+    for i in range(count):
+        f.write(f'struct outer_{i} {{\n')
+        for level in range(depth):
+            indent = '  ' * (level + 1)
+            kind = 'union' if level % 2 else 'struct'
+            f.write(f'{indent}int value_{level};\n')
+            f.write(f'{indent}{kind} {{\n')
+        for level in reversed(range(depth)):
+            indent = '  ' * (level + 1)
+            f.write(f'{indent}  long leaf_{level};\n')
+            f.write(f'{indent}}} member_{level};\n')
+        f.write('};\n\n')
+
+def enums(f, count, values):
+    """ `count` enums with `values` enumerators each, half of them anonymous """
+    for i in range(count):
+        name = f' huge_enum_{i}' if i % 2 == 0 else ''
+        fixed_type = ' : unsigned short' if i % 4 == 0 else ''
+        f.write(f'enum{name}{fixed_type} {{\n')
+        for j in range(values):
+            f.write(f'  HUGE_ENUM_{i}_VALUE_{j} = {j * 2},\n')
+        f.write('};\n\n')
+
+def macros(f, count):
+    """ `count` macros: literals, expressions, strings and empty macros """
+    f.write('#ifndef SYNTHETIC_MACROS_H\n#define SYNTHETIC_MACROS_H\n\n')
+    for i in range(count):
+        kind = i % 5
+        if kind == 0:
+            f.write(f'#define MACRO_LITERAL_{i} {i}\n')
+        elif kind == 1:
+            f.write(f'#define MACRO_EXPRESSION_{i} (1 << ({i} % 16))\n')
+        elif kind == 2:
+            f.write(f'#define MACRO_STRING_{i} "value {i}"\n')
+        elif kind == 3:
+            f.write(f'#define MACRO_EMPTY_{i}\n')
+        else:
+            f.write(f'#define MACRO_FLOAT_{i} {i}.5\n')
+    f.write('\n#endif\n')
+
+def typedef_chains(f, count, length):
+    """ `count` chains of `length` typedefs, each naming the previous one """
+    for i in range(count):
+        f.write(f'typedef struct chain_base_{i} {{ int value; }} chain_{i}_0;\n')
+        for j in range(1, length):
+            f.write(f'typedef chain_{i}_{j - 1} chain_{i}_{j};\n')
+        f.write(f'typedef chain_{i}_{length - 1} *chain_{i}_pointer;\n')
+        f.write(f'chain_{i}_{length - 1} chain_function_{i}(chain_{i}_pointer arg);\n\n')
+
+# name -> (generator, arguments)
+SCENARIOS = {
+    'functions-1k': (functions, (1000,)),
+    'functions-10k': (functions, (10000,)),
+    'functions-100k': (functions, (100000,)),
+    'nested-structs': (nested_structs, (500, 12)),
+    'huge-enums': (enums, (200, 500)),
+    'macros': (macros, (10000,)),
+    'typedef-chains': (typedef_chains, (500, 40)),
+}
+
+def write_header(scenario, path):
+    (generator, arguments) = SCENARIOS[scenario]
+    with open(path, 'w') as f:
+        generator(f, *arguments)
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3 or sys.argv[1] not in SCENARIOS:
+        print(__doc__.strip(), file=sys.stderr)
+        print(f'Scenarios: {", ".join(SCENARIOS)}', file=sys.stderr)
+        sys.exit(1)
+    write_header(sys.argv[1], sys.argv[2])
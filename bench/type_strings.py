@@ -0,0 +1,63 @@
+""" Time rendering with and without the cache of Lisp type strings
+
+The functions scenario of synthetic.py, whose functions take pointers to a
+few hundred structs, is extracted once and then rendered with the cache of
+processfile._lisp_type_str in place and with a cache that never keeps
+anything. The outputs are checked to be the same.
+
+Usage: python bench/type_strings.py [FUNCTIONS] [REPEAT]
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+import cl_bindgen.processfile as processfile
+from cl_bindgen.util import build_default_options
+
+import synthetic
+
+class _Uncached(dict):
+    def __setitem__(self, key, value):
+        pass
+
+def _render(headers, output, repeat):
+    options = build_default_options()
+    options.output = output
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        processfile.render_headers(headers, options)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    with open(output) as f:
+        return (best, f.read())
+
+def main(args):
+    count = int(args[0]) if args else 5000
+    repeat = int(args[1]) if len(args) > 1 else 5
+    with tempfile.TemporaryDirectory() as directory:
+        header = os.path.join(directory, 'functions.h')
+        with open(header, 'w') as f:
+            synthetic.functions(f, count)
+        headers = processfile.extract_files([header], build_default_options())
+
+        (cached, cached_text) = _render(headers, os.path.join(directory, 'cached.lisp'), repeat)
+        original = processfile._lisp_type_str._cache
+        processfile._lisp_type_str._cache = _Uncached()
+        try:
+            (uncached, uncached_text) = _render(headers, os.path.join(directory, 'uncached.lisp'),
+                                                repeat)
+        finally:
+            processfile._lisp_type_str._cache = original
+
+    if cached_text != uncached_text:
+        print('The outputs differ', file=sys.stderr)
+        sys.exit(1)
+    print(f'{count} functions, best of {repeat} renders:')
+    print(f'  uncached {uncached:9.3f}s')
+    print(f'  cached   {cached:9.3f}s  {uncached / cached:5.2f}x')
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
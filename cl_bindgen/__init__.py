@@ -5,3 +5,5 @@ Provides the following modules:
 + processfile: The actual classes that perform the transformations
 
 """
+
+__version__ = '1.7.0'
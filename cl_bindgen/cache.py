@@ -0,0 +1,216 @@
+""" Caches that persist between runs of cl-bindgen
+
+Everything is stored in a directory given by the user. Entries are named by
+a hash of everything that can change their contents, so stale entries are
+never read; they can be removed by deleting the directory.
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+
+def file_digest(path):
+    """ Return the hex SHA-256 digest of the file's contents, or None if it can't be read """
+    digest = hashlib.sha256()
+    try:
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 16), b''):
+                digest.update(chunk)
+    except OSError:
+        return None
+    return digest.hexdigest()
+
+def make_key(*parts):
+    """ Return a hex digest identifying the given JSON-serializable values """
+    text = json.dumps(parts, sort_keys=True, default=str)
+    return hashlib.sha256(text.encode()).hexdigest()
+
+def write_atomically(path, data: bytes):
+    """ Write `data` to `path` so that readers never see a partially written file """
+    directory = os.path.dirname(path) or '.'
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+
+def library_identity(library_path):
+    """ Identify the installed libclang, so that upgrading it invalidates the cache """
+    try:
+        stat = os.stat(library_path)
+        return [os.path.realpath(library_path), stat.st_size, stat.st_mtime_ns]
+    except (OSError, TypeError):
+        return [library_path]
+
+class TranslationUnitCache:
+    """ Stores parsed translation units on disk
+
+    Each entry is keyed by the input file's contents, the clang arguments,
+    the parse options and the libclang being used. Because the files a
+    translation unit includes are only known after parsing it, their digests
+    are stored with the entry and checked before it is used.
+    """
+
+    def __init__(self, directory, library_path):
+        self.directory = os.path.join(directory, 'translation-units')
+        self.library = library_identity(library_path)
+
+    def key(self, filepath, arguments, parse_options, unsaved_files=()):
+        unsaved = [(name, hashlib.sha256(contents.encode()).hexdigest())
+                   for (name, contents) in unsaved_files]
+        # The path as it was given is also used, since the files are named
+        # after it when it is parsed, see file_names:
+        return make_key('translation-unit', self.library, os.path.abspath(filepath), filepath,
+                        file_digest(filepath), list(arguments), parse_options, unsaved)
+
+    def _paths(self, key):
+        base = os.path.join(self.directory, key)
+        return (base + '.ast', base + '.json')
+
+    def _dependencies_current_p(self, deps_path):
+        try:
+            with open(deps_path) as f:
+                dependencies = json.load(f)
+        except (OSError, ValueError):
+            return False
+        return all(file_digest(path) == digest for (path, digest) in dependencies.items())
+
+    def _store_dependencies(self, deps_path, names):
+        dependencies = {name: file_digest(name) for name in names}
+        write_atomically(deps_path, json.dumps(dependencies).encode())
+
+    def load(self, index, key):
+        """ Return the cached translation unit for `key`, or None if it is missing or stale """
+        # Imported here so that the lookup cache doesn't need clang.cindex:
+        from clang.cindex import TranslationUnitLoadError
+
+        ast_path, deps_path = self._paths(key)
+        if not self._dependencies_current_p(deps_path):
+            return None
+        try:
+            return index.read(ast_path)
+        except (TranslationUnitLoadError, OSError):
+            # The file is corrupt, or was removed in the meantime
+            return None
+
+    def file_names(self, key):
+        """ Return the names of the files the translation unit for `key` included when it was parsed
+
+        The result maps the absolute path of each file to its name. Loaded
+        translation units use the absolute paths instead.
+        """
+        (_, deps_path) = self._paths(key)
+        try:
+            with open(deps_path) as f:
+                return {os.path.abspath(name): name for name in json.load(f)}
+        except (OSError, ValueError):
+            return {}
+
+    def store(self, key, tu):
+        """ Save `tu` under `key` along with the digests of the files it includes """
+        os.makedirs(self.directory, exist_ok=True)
+        ast_path, deps_path = self._paths(key)
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, prefix='.tmp-', suffix='.ast')
+        os.close(fd)
+        try:
+            tu.save(temp_path)
+            os.replace(temp_path, ast_path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+        self._store_dependencies(deps_path, [i.include.name for i in tu.get_includes()])
+
+class HeaderCache(TranslationUnitCache):
+    """ Stores the declarations extracted from header files on disk, see the `ir` module
+
+    Entries are keyed like translation units, along with the path of the
+    header as it was given, which appears in the output, and the version of
+    the intermediate representation. The entries are opaque bytes.
+    """
+
+    def __init__(self, directory, library_path, version):
+        super().__init__(directory, library_path)
+        self.directory = os.path.join(directory, 'headers')
+        self.version = version
+
+    def key(self, filepath, arguments, parse_options, unsaved_files=(), extraction=None):
+        """ `extraction` describes any other options that change what is extracted """
+        return make_key('header', self.version, filepath, extraction,
+                        super().key(filepath, arguments, parse_options, unsaved_files))
+
+    def _paths(self, key):
+        base = os.path.join(self.directory, key)
+        return (base + '.ir', base + '.json')
+
+    def load(self, key):
+        """ Return the bytes stored under `key`, or None if they are missing or stale """
+        data_path, deps_path = self._paths(key)
+        if not self._dependencies_current_p(deps_path):
+            return None
+        try:
+            with open(data_path, 'rb') as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def store(self, key, data: bytes, dependencies):
+        """ Save `data` under `key` along with the digests of the files in `dependencies` """
+        os.makedirs(self.directory, exist_ok=True)
+        data_path, deps_path = self._paths(key)
+        write_atomically(data_path, data)
+        self._store_dependencies(deps_path, dependencies)
+
+class LookupCache:
+    """ Stores the results of running external programs, such as pkg-config
+
+    Results are kept in memory, and on disk as well if a directory is given.
+    The key should identify everything the program's result depends on.
+    """
+
+    def __init__(self, directory=None):
+        self.directory = directory and os.path.join(directory, 'lookups')
+        self.results = {}
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + '.json')
+
+    def _load(self, key):
+        if not self.directory:
+            return None
+        try:
+            with open(self._path(key)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _store(self, key, value):
+        if not self.directory:
+            return
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            write_atomically(self._path(key), json.dumps(value).encode())
+        except OSError:
+            # The cache is only an optimization
+            pass
+
+    def get(self, key, compute, valid_p=lambda value: True):
+        """ Return the cached value for `key`, calling `compute` to produce it if it is missing
+
+        Values read from disk are only used if `valid_p` returns True for
+        them. None is never cached, so `compute` should return None for
+        results that shouldn't be reused.
+        """
+        if (value := self.results.get(key)) is not None:
+            return value
+        value = self._load(key)
+        if value is None or not valid_p(value):
+            value = compute()
+            if value is None:
+                return None
+            self._store(key, value)
+        self.results[key] = value
+        return value
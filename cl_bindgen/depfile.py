@@ -0,0 +1,21 @@
+""" Dependency files that tell build systems which files an output was generated from
+
+The files are written in the format used by `gcc -MD`, which make and ninja
+can read: a single rule whose target is the output and whose prerequisites
+are the input files and every file they include.
+"""
+
+from cl_bindgen.cache import write_atomically
+
+def _escape(path):
+    # Spaces and '#' are escaped with a backslash, '$' is doubled:
+    return path.replace(' ', '\\ ').replace('#', '\\#').replace('$', '$$')
+
+def format_depfile(target, dependencies):
+    lines = [f'{_escape(target)}:']
+    lines.extend(f' {_escape(path)}' for path in dependencies)
+    return ' \\\n'.join(lines) + '\n'
+
+def write_depfile(path, target, dependencies):
+    """ Write a dependency file saying that `target` depends on `dependencies` """
+    write_atomically(path, format_depfile(target, dependencies).encode())
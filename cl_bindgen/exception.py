@@ -1,3 +1,5 @@
+import io
+
 class ProcessingError(Exception):
 
     def __init__(self, msg: str, location=None):
@@ -6,3 +8,34 @@ class ProcessingError(Exception):
         else:
             self.message = msg
         super().__init__(self.message)
+
+class ParserException(Exception):
+
+    def __init__(self, filepath, diagnostics):
+        self.filepath = filepath
+        self.diagnostics = list(diagnostics)
+        self.message = self.format_errors()
+
+    def format_errors(self):
+        stream = io.StringIO()
+        stream.write(self.diagnostics[0].format())
+        for diag in self.diagnostics[1:]:
+            stream.write('\n')
+            stream.write(diag.format())
+
+        return stream.getvalue()
+
+    def __reduce__(self):
+        # The diagnostics are tied to the translation unit, so they can't be
+        # sent between processes. Send their text instead:
+        diagnostics = [_FormattedDiagnostic(diag.format()) for diag in self.diagnostics]
+        return (ParserException, (self.filepath, diagnostics))
+
+class _FormattedDiagnostic:
+    """ Stands in for a clang.Diagnostic that has already been formatted """
+
+    def __init__(self, text):
+        self.text = text
+
+    def format(self):
+        return self.text
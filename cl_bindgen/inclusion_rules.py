@@ -1,3 +1,4 @@
+import functools
 import re
 
 def _extract_match_option(rules: dict, list_arg: str):
@@ -28,66 +29,47 @@ def process_inclusion_rules(options: dict, list_arg='names'):
     return make_batch_determiner(whitelist=inc_list, blacklist=ex_list,
                                  include_matcher=inc_regex, exclude_matcher=ex_regex)
 
-def _match_regex_list(regex_list, name):
-    for r in regex_list:
-        if r.search(name):
-            return True
-    return False
+def _compile_matcher(regexes):
+    """ Return a function that returns a match if any of the regexes match a string
 
-def _compile_regexes(regexes):
-    return [re.compile(m) for m in regexes]
+    The regexes are combined into a single alternation when possible, so
+    only one search is needed per string.
+    """
+    compiled = [re.compile(r) for r in regexes]
+    # Numbered backreferences and named groups don't survive being combined:
+    if all(r.groups == 0 for r in compiled):
+        try:
+            return re.compile('|'.join(f'(?:{r.pattern})' for r in compiled)).search
+        except re.error:
+            # e.g. global flags that aren't at the start of the combined regex
+            pass
+    return lambda name: any(r.search(name) for r in compiled)
 
 def make_batch_determiner(whitelist=None, blacklist=None, include_matcher=None, exclude_matcher=None):
+    """ Return a function that determines if a name should be included
+
+    A name is excluded if it is in `blacklist` or matches a regex in `exclude_matcher`.
+    If `whitelist` or `include_matcher` is given, only names in `whitelist` or
+    matching a regex in `include_matcher` are included.
+    """
     has_whitelist = whitelist or include_matcher is not None
     has_blacklist = blacklist or exclude_matcher is not None
 
-    white_set = set(whitelist)
-    black_set = set(blacklist)
-
-    if has_blacklist and not has_whitelist:
-        # import everything but the blacklist
-        if exclude_matcher:
-            excluder = _compile_regexes(exclude_matcher)
-            return lambda typename: typename not in black_set and not _match_regex_list(excluder, typename)
-        else:
-            return lambda typename: typename not in black_set
-    elif has_whitelist and not blacklist:
-        # only import the whitelist
-        if include_matcher:
-            includer = _compile_regexes(include_matcher)
-            return lambda typename: typename in white_set or _match_regex_list(includer, typename)
-        else:
-            return lambda x: x in white_set
-    elif has_whitelist and has_blacklist:
-        # import everything on whitelist, excluding blacklist
-        allowed_set = white_set.difference(black_set)
-        if exclude_matcher and include_matcher:
-            excluder = _compile_regexes(exclude_matcher)
-            includer = _compile_regexes(include_matcher)
-            def fn(typename):
-                in_white = (typename in allowed_set or _match_regex_list(includer, typename))
-                not_black = not (_match_regex_list(excluder, typename) or
-                             typename in blacklist)
-                return in_white and not_black
-            return fn
-        elif exclude_matcher is not None:
-            excluder = _compile_regexes(exclude_matcher)
-            def fn(typename):
-                in_white = typename in allowed_set
-                not_black = not (_match_regex_list(excluder, typename) or
-                             typename in blacklist)
-                return in_white and not_black
-            return fn
-        elif include_matcher:
-            includer = _compile_regexes(include_matcher)
-            def fn(typename):
-                in_white = (typename in allowed_set
-                            or _match_regex_list(includer, typename))
-                not_black = typename not in blacklist
-                return in_white and not_black
-            return fn
-        else:
-            return lambda x: x in allowed_set
-    else:
+    if not (has_whitelist or has_blacklist):
         # import everything
         return lambda x: True
+
+    white_set = set(whitelist or [])
+    black_set = set(blacklist or [])
+    includer = _compile_matcher(include_matcher) if include_matcher else None
+    excluder = _compile_matcher(exclude_matcher) if exclude_matcher else None
+
+    # The same names are checked over and over again, so remember the results:
+    @functools.cache
+    def determiner(typename):
+        if typename in black_set or (excluder and excluder(typename)):
+            return False
+        if not has_whitelist:
+            return True
+        return typename in white_set or bool(includer and includer(typename))
+    return determiner
@@ -0,0 +1,304 @@
+""" A database of the top-level declarations of header files
+
+Every top-level declaration of an indexed header is recorded in an SQLite
+file with its name, kind, clang USR, location, mangled Lisp name and the
+names of the types it refers to, so they can be looked up without parsing
+the headers again. The extracted declarations of each header are stored as
+well, see the `ir` module, so the bindings of single symbols can be
+generated from the database alone.
+
+Headers are only parsed again when they, a file they include, the clang
+arguments, libclang or the `ir` module change. When only the manglers
+change, the Lisp names are updated from the stored declarations.
+"""
+
+import copy
+import os
+import sqlite3
+from dataclasses import dataclass
+
+import clang.cindex as clang
+
+import cl_bindgen.cache as cache
+import cl_bindgen.ir as ir
+import cl_bindgen.manifest as manifest
+import cl_bindgen.processfile as processfile
+import cl_bindgen.reachability as reachability
+
+# Increment this whenever the tables change. Databases created by another
+# version are rebuilt when they are updated:
+SCHEMA_VERSION = 1
+
+_SCHEMA = '''
+CREATE TABLE headers (
+    id INTEGER PRIMARY KEY,
+    path TEXT UNIQUE NOT NULL,
+    key TEXT NOT NULL,
+    manglers TEXT NOT NULL,
+    ir BLOB NOT NULL
+);
+CREATE TABLE dependencies (
+    header_id INTEGER NOT NULL REFERENCES headers(id) ON DELETE CASCADE,
+    path TEXT NOT NULL,
+    digest TEXT
+);
+CREATE TABLE symbols (
+    id INTEGER PRIMARY KEY,
+    header_id INTEGER NOT NULL REFERENCES headers(id) ON DELETE CASCADE,
+    -- The index of the declaration in the header's declarations:
+    position INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    usr TEXT,
+    file TEXT,
+    line INTEGER,
+    lisp_name TEXT
+);
+CREATE TABLE refs (
+    symbol_id INTEGER NOT NULL REFERENCES symbols(id) ON DELETE CASCADE,
+    -- 'typedef', or 'tag' for structs, unions and enums:
+    kind TEXT NOT NULL,
+    name TEXT NOT NULL
+);
+CREATE INDEX dependencies_header ON dependencies(header_id);
+CREATE INDEX symbols_header ON symbols(header_id);
+CREATE INDEX symbols_name ON symbols(name);
+CREATE INDEX refs_symbol ON refs(symbol_id);
+CREATE INDEX refs_name ON refs(name);
+'''
+
+KINDS = ('function', 'variable', 'macro', 'typedef', 'struct', 'union', 'enum', 'other')
+
+# The kinds that can be used as roots, see the reachability module:
+ROOT_KINDS = ('function', 'variable', 'macro')
+
+# The kinds of the declarations other declarations refer to by each kind of name:
+_REFERENCED_KINDS = {
+    'typedef': ('typedef',),
+    'tag': ('struct', 'union', 'enum'),
+}
+
+class SymbolIndexError(Exception):
+    """ Raised when the database can't be used """
+
+@dataclass(eq=False)
+class Symbol:
+    __slots__ = ('name', 'kind', 'usr', 'file', 'line', 'lisp_name')
+    name: str
+    kind: str
+    usr: str
+    file: str
+    line: int
+    # None for declarations without a name of their own in the output, such
+    # as unnamed structs and anonymous enums:
+    lisp_name: str
+
+def _kind(node):
+    if isinstance(node, ir.Record):
+        return 'union' if node.is_union else 'struct'
+    return _kind._kinds.get(type(node), 'other')
+_kind._kinds = {
+    ir.Function: 'function',
+    ir.Var: 'variable',
+    ir.Macro: 'macro',
+    ir.Typedef: 'typedef',
+    ir.Enum: 'enum',
+}
+
+def _references(node):
+    """ Return the (kind, name) pairs of the declarations `node` refers to, without duplicates """
+    (refs, _) = reachability._references(node)
+    return list(dict.fromkeys(refs))
+
+def _manglers_key(options):
+    return cache.make_key([manifest._describe_manglers(manglers)
+                           for manglers in (options.typedef_manglers, options.type_manglers,
+                                            options.name_manglers, options.constant_manglers)])
+
+class SymbolIndex:
+    """ The database of symbols stored at `path`
+
+    Use it as a context manager, or call `close` when done with it. If
+    `read_only` is true, the database must already exist.
+    """
+
+    def __init__(self, path, read_only=False):
+        self.path = path
+        try:
+            if read_only:
+                self._db = sqlite3.connect(f'file:{os.path.abspath(path)}?mode=ro', uri=True)
+            else:
+                self._db = sqlite3.connect(path)
+            self._db.execute('PRAGMA foreign_keys = ON')
+            version = self._db.execute('PRAGMA user_version').fetchone()[0]
+        except sqlite3.Error as err:
+            raise SymbolIndexError(f'Could not open the symbol index {path}: {err}')
+        if version != SCHEMA_VERSION:
+            if read_only:
+                self._db.close()
+                raise SymbolIndexError(f'{path} is not a symbol index created by this version of cl-bindgen')
+            self._create()
+
+    def _create(self):
+        with self._db:
+            for (table,) in self._db.execute("SELECT name FROM sqlite_master WHERE type = 'table'").fetchall():
+                self._db.execute(f'DROP TABLE {table}')
+            self._db.executescript(_SCHEMA)
+            self._db.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+
+    def close(self):
+        self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _key(self, filepath, options):
+        # The path as it was given appears in the output:
+        return cache.make_key('index', cache.library_identity(clang.conf.get_filename()),
+                              ir.VERSION, filepath, os.path.abspath(filepath), list(options.arguments),
+                              processfile._PARSE_OPTIONS,
+                              processfile._extraction_options(options))
+
+    def _up_to_date_p(self, header_id):
+        dependencies = self._db.execute('SELECT path, digest FROM dependencies WHERE header_id = ?',
+                                        (header_id,))
+        return all(cache.file_digest(path) == digest for (path, digest) in dependencies)
+
+    def update(self, files, options):
+        """ Index the given files with the clang arguments and manglers in `options`
+
+        Files that haven't changed since they were last indexed with the
+        same arguments aren't parsed again. Headers that no longer exist are
+        removed. Returns the files that were parsed.
+        """
+        manglers = _manglers_key(options)
+        # The mangler lists may have changed since the last run:
+        processfile._mangle_string._pipelines.clear()
+        parsed = []
+        for filepath in files:
+            processfile._check_input_file(filepath)
+            path = os.path.abspath(filepath)
+            key = self._key(filepath, options)
+            row = self._db.execute('SELECT id, key, manglers, ir FROM headers WHERE path = ?',
+                                   (path,)).fetchone()
+            if row and row[1] == key and self._up_to_date_p(row[0]):
+                if row[2] != manglers:
+                    self._rename(row[0], ir.loads(row[3]), manglers, options)
+                continue
+            (header, usrs) = self._extract(filepath, options)
+            self._store(path, key, manglers, header, usrs, options)
+            parsed.append(filepath)
+
+        with self._db:
+            for (header_id, path) in self._db.execute('SELECT id, path FROM headers').fetchall():
+                if not os.path.exists(path):
+                    self._db.execute('DELETE FROM headers WHERE id = ?', (header_id,))
+        return parsed
+
+    def _extract(self, filepath, options):
+        """ Parse the file, returning its ir.Header and the USR of each of its declarations """
+        usrs = []
+        # The USRs are only needed here, so they aren't stored in the
+        # declarations, which would make every other run slower:
+        header = processfile._extract_file(
+            filepath, options, on_extracted=lambda cursor, node: usrs.append(cursor.get_usr() or None))
+        return (header, usrs)
+
+    def _store(self, path, key, manglers, header, usrs, options):
+        with self._db:
+            self._db.execute('DELETE FROM headers WHERE path = ?', (path,))
+            header_id = self._db.execute(
+                'INSERT INTO headers (path, key, manglers, ir) VALUES (?, ?, ?, ?)',
+                (path, key, manglers, ir.dumps(header))).lastrowid
+            self._db.executemany(
+                'INSERT INTO dependencies (header_id, path, digest) VALUES (?, ?, ?)',
+                [(header_id, os.path.abspath(dep), cache.file_digest(dep))
+                 for dep in dict.fromkeys(header.dependencies)])
+            for (position, (node, usr)) in enumerate(zip(header.declarations, usrs)):
+                location = node.location
+                symbol_id = self._db.execute(
+                    'INSERT INTO symbols (header_id, position, name, kind, usr, file, line, lisp_name)'
+                    ' VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                    (header_id, position, node.spelling, _kind(node), usr, location.file,
+                     location.line, processfile._lisp_name(node, options))).lastrowid
+                self._db.executemany('INSERT INTO refs (symbol_id, kind, name) VALUES (?, ?, ?)',
+                                     [(symbol_id, kind, name) for (kind, name) in _references(node)])
+
+    def _rename(self, header_id, header, manglers, options):
+        """ Update the Lisp names of the header's symbols for new manglers """
+        with self._db:
+            self._db.executemany(
+                'UPDATE symbols SET lisp_name = ? WHERE header_id = ? AND position = ?',
+                [(processfile._lisp_name(node, options), header_id, position)
+                 for (position, node) in enumerate(header.declarations)])
+            self._db.execute('UPDATE headers SET manglers = ? WHERE id = ?', (manglers, header_id))
+
+    def symbols(self, pattern=None, kind=None, references=None):
+        """ Return the symbols matching all of the given criteria, sorted by name
+
+        `pattern` is a glob pattern the name must match, `kind` one of KINDS
+        and `references` the name of a type, struct, union or enum the symbol
+        must refer to, directly or through pointers and arrays.
+        """
+        conditions = []
+        parameters = []
+        if pattern is not None:
+            conditions.append('name GLOB ?')
+            parameters.append(pattern)
+        if kind is not None:
+            conditions.append('kind = ?')
+            parameters.append(kind)
+        if references is not None:
+            conditions.append('id IN (SELECT symbol_id FROM refs WHERE name = ?)')
+            parameters.append(references)
+        where = f'WHERE {" AND ".join(conditions)}' if conditions else ''
+        rows = self._db.execute(
+            f'SELECT name, kind, usr, file, line, lisp_name FROM symbols {where}'
+            ' ORDER BY name, file, line', parameters)
+        return [Symbol(*row) for row in rows]
+
+    def _required_headers(self, roots):
+        """ Return the ids of the headers declaring the roots and the types they use """
+        placeholders = ', '.join('?' * len(ROOT_KINDS))
+        pending = [row for name in roots for row in self._db.execute(
+            f'SELECT id, header_id FROM symbols WHERE name = ? AND kind IN ({placeholders})',
+            (name, *ROOT_KINDS))]
+        seen = set()
+        header_ids = set()
+        while pending:
+            (symbol_id, header_id) = pending.pop()
+            if symbol_id in seen:
+                continue
+            seen.add(symbol_id)
+            header_ids.add(header_id)
+            for (kind, name) in self._db.execute('SELECT kind, name FROM refs WHERE symbol_id = ?',
+                                                 (symbol_id,)).fetchall():
+                kinds = _REFERENCED_KINDS[kind]
+                pending.extend(self._db.execute(
+                    f'SELECT id, header_id FROM symbols WHERE name = ?'
+                    f' AND kind IN ({", ".join("?" * len(kinds))})', (name, *kinds)))
+        return sorted(header_ids)
+
+    def generate(self, roots, options):
+        """ Write the bindings for the functions, variables and macros named in `roots`
+
+        Only they and the types they use are output, see the reachability
+        module, using the declarations stored in the database instead of
+        parsing the headers again. Returns the files the output depends on,
+        like processfile.render_headers.
+        """
+        roots = set(roots)
+        if not roots:
+            raise SymbolIndexError('No functions, variables or macros to generate bindings for')
+        header_ids = self._required_headers(roots)
+        if not header_ids:
+            raise SymbolIndexError(f'No function, variable or macro named {", ".join(sorted(roots))} is indexed')
+        headers = [ir.loads(self._db.execute('SELECT ir FROM headers WHERE id = ?',
+                                             (header_id,)).fetchone()[0])
+                   for header_id in header_ids]
+        options = copy.copy(options)
+        options.root_p = roots.__contains__
+        return processfile.render_headers(headers, options)
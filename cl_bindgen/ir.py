@@ -0,0 +1,206 @@
+""" The declarations extracted from header files, independent of how they are output
+
+A header file is parsed and its top-level declarations are extracted into the
+classes in this module once. They hold everything needed to generate the
+bindings, but none of the names are mangled and no rules have been applied,
+so the same `Header` can be rendered with any `ProcessOptions` without using
+libclang again. Headers can be saved to disk with `dumps` and `loads`.
+
+Nodes compare by identity. Type nodes are shared between the declarations of
+a header that use the same type.
+"""
+
+import pickle
+from dataclasses import dataclass
+
+# Increment this whenever the classes in this module change, so that headers
+# saved by an older version aren't loaded:
+VERSION = 2
+
+@dataclass(eq=False)
+class Location:
+    __slots__ = ('file', 'line', 'column')
+    file: str
+    line: int
+    column: int
+
+# Types:
+
+@dataclass(eq=False)
+class BuiltinType:
+    """ A type CFFI knows about, such as int """
+    __slots__ = ('lisp_name',)
+    lisp_name: str
+
+@dataclass(eq=False)
+class TypedefType:
+    __slots__ = ('spelling',)
+    spelling: str
+
+@dataclass(eq=False)
+class RecordType:
+    __slots__ = ('is_union', 'spelling')
+    is_union: bool
+    spelling: str
+
+@dataclass(eq=False)
+class EnumType:
+    __slots__ = ('spelling', 'underlying')
+    spelling: str
+    # Only set if the enum's underlying type was given explicitly:
+    underlying: object
+
+@dataclass(eq=False)
+class PointerType:
+    __slots__ = ('pointee', 'pointee_spelling')
+    pointee: object
+    pointee_spelling: str
+
+@dataclass(eq=False)
+class FunctionPointerType:
+    __slots__ = ('spelling',)
+    # The spelling of the function type that is pointed to:
+    spelling: str
+
+@dataclass(eq=False)
+class ArrayType:
+    __slots__ = ('element', 'count')
+    element: object
+    # None for arrays of unknown size:
+    count: int
+
+@dataclass(eq=False)
+class FunctionType:
+    __slots__ = ('spelling',)
+    spelling: str
+
+@dataclass(eq=False)
+class Unsupported:
+    """ Stands in for a type that can't be output
+
+    The error is only raised when something that uses the type is output,
+    so declarations that are excluded don't cause errors.
+    """
+    __slots__ = ('error',)
+    error: Exception
+
+# Declarations:
+
+@dataclass(eq=False)
+class MacroToken:
+    __slots__ = ('kind', 'spelling')
+    # The name of the clang.TokenKind:
+    kind: str
+    spelling: str
+
+@dataclass(eq=False)
+class Macro:
+    __slots__ = ('spelling', 'tokens', 'is_function_like', 'value', 'location')
+    spelling: str
+    # Up to two of the tokens after the macro's name:
+    tokens: list
+    # None unless the macros were extracted to be evaluated:
+    is_function_like: bool
+    # The value clang evaluated the macro to, see the macro_eval module:
+    value: object
+    location: Location
+
+@dataclass(eq=False)
+class Field:
+    __slots__ = ('spelling', 'is_anonymous_record', 'type', 'inner')
+    spelling: str
+    is_anonymous_record: bool
+    # None for anonymous fields, which are described by `inner` instead:
+    type: object
+    # The Record or Enum declared by an anonymous field, Unsupported or None:
+    inner: object
+
+@dataclass(eq=False)
+class Record:
+    __slots__ = ('is_union', 'spelling', 'decl_id', 'is_anonymous', 'is_definition',
+                 'comment', 'fields', 'location')
+    is_union: bool
+    spelling: str
+    # Identifies the declaration within its translation unit:
+    decl_id: int
+    is_anonymous: bool
+    is_definition: bool
+    comment: str
+    # None unless the record is a definition:
+    fields: list
+    location: Location
+
+@dataclass(eq=False)
+class Enum:
+    __slots__ = ('spelling', 'decl_id', 'is_anonymous', 'underlying', 'comment',
+                 'constants', 'location')
+    spelling: str
+    decl_id: int
+    is_anonymous: bool
+    # Only set if the underlying type was given explicitly:
+    underlying: object
+    comment: str
+    # (spelling, value) pairs:
+    constants: list
+    location: Location
+
+@dataclass(eq=False)
+class Function:
+    __slots__ = ('spelling', 'result', 'returns_char_pointer', 'comment', 'arguments',
+                 'location')
+    spelling: str
+    result: object
+    returns_char_pointer: bool
+    comment: str
+    # (spelling, type) pairs:
+    arguments: list
+    location: Location
+
+@dataclass(eq=False)
+class Typedef:
+    __slots__ = ('spelling', 'underlying', 'underlying_decl_id', 'location')
+    spelling: str
+    underlying: object
+    # Identifies the declaration of the underlying type:
+    underlying_decl_id: int
+    location: Location
+
+@dataclass(eq=False)
+class Var:
+    __slots__ = ('spelling', 'type', 'type_decl_id', 'is_const', 'comment', 'location')
+    spelling: str
+    type: object
+    type_decl_id: int
+    is_const: bool
+    comment: str
+    location: Location
+
+@dataclass(eq=False)
+class Unrecognized:
+    """ A declaration cl-bindgen doesn't know how to output """
+    __slots__ = ('kind', 'spelling', 'location')
+    kind: str
+    spelling: str
+    location: Location
+
+@dataclass(eq=False)
+class Header:
+    """ The declarations of a file, in the order they appear in it """
+    __slots__ = ('path', 'declarations', 'dependencies')
+    path: str
+    declarations: list
+    # The files that were read to produce the declarations:
+    dependencies: list
+
+def dumps(header: Header) -> bytes:
+    return pickle.dumps((VERSION, header), protocol=pickle.HIGHEST_PROTOCOL)
+
+def loads(data: bytes) -> Header:
+    """ Load a header saved by `dumps`
+
+    Raises ValueError if it was saved by a different version of this module.
+    """
+    (version, header) = pickle.loads(data)
+    if version != VERSION:
+        raise ValueError(f'Unsupported intermediate representation version {version}')
+    return header
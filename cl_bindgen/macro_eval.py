@@ -0,0 +1,108 @@
+""" Evaluate object-like macros with clang
+
+Instead of tokenizing each macro, every macro of a file is evaluated with a
+single extra parse: a translation unit is generated that includes the file
+and initializes a variable with each macro, and the values of the variables
+are read back with clang_Cursor_Evaluate. The python bindings don't provide
+that function, so it is bound here.
+
+Only integer and floating point values are read back. Macros that aren't
+constant expressions, such as types or string concatenations, produce
+errors in the generated translation unit, which are ignored.
+"""
+
+import ctypes
+import math
+import os
+
+import clang.cindex as clang
+
+import cl_bindgen.logging as logging
+
+# The name of the generated file. It is only passed to clang as an unsaved file.
+_MACROS_HEADER = '__cl_bindgen_macros__.h'
+_VARIABLE_PREFIX = '__cl_bindgen_macro_'
+
+# CXEvalResultKind:
+_EVAL_INT = 1
+_EVAL_FLOAT = 2
+
+_FUNCTIONS = [
+    ('clang_Cursor_Evaluate', [clang.Cursor], ctypes.c_void_p),
+    ('clang_EvalResult_getKind', [ctypes.c_void_p], ctypes.c_int),
+    ('clang_EvalResult_isUnsignedInt', [ctypes.c_void_p], ctypes.c_uint),
+    ('clang_EvalResult_getAsUnsigned', [ctypes.c_void_p], ctypes.c_ulonglong),
+    ('clang_EvalResult_getAsLongLong', [ctypes.c_void_p], ctypes.c_longlong),
+    ('clang_EvalResult_getAsDouble', [ctypes.c_void_p], ctypes.c_double),
+    ('clang_EvalResult_dispose', [ctypes.c_void_p], None),
+    ('clang_Cursor_isMacroFunctionLike', [clang.Cursor], ctypes.c_uint),
+]
+
+def _library():
+    """ Return libclang with the functions used here registered, or None if it doesn't provide them """
+    if _library.lib is None:
+        lib = clang.conf.lib
+        try:
+            for (name, argtypes, restype) in _FUNCTIONS:
+                function = getattr(lib, name)
+                function.argtypes = argtypes
+                function.restype = restype
+            _library.lib = lib
+        except AttributeError:
+            _library.lib = False
+    return _library.lib or None
+_library.lib = None
+
+def function_like_p(cursor):
+    """ Return True if the macro definition at `cursor` takes arguments """
+    lib = _library()
+    return bool(lib and lib.clang_Cursor_isMacroFunctionLike(cursor))
+
+def _evaluate(lib, cursor):
+    result = lib.clang_Cursor_Evaluate(cursor)
+    if not result:
+        return None
+    try:
+        kind = lib.clang_EvalResult_getKind(result)
+        if kind == _EVAL_INT:
+            if lib.clang_EvalResult_isUnsignedInt(result):
+                return lib.clang_EvalResult_getAsUnsigned(result)
+            return lib.clang_EvalResult_getAsLongLong(result)
+        elif kind == _EVAL_FLOAT:
+            value = lib.clang_EvalResult_getAsDouble(result)
+            return value if math.isfinite(value) else None
+        return None
+    finally:
+        lib.clang_EvalResult_dispose(result)
+
+def evaluate_macros(index, files, names, arguments):
+    """ Evaluate the macros named by `names`, which are defined by `files`
+
+    Returns a list with the value of each macro: an int, a float, or None if
+    it couldn't be evaluated.
+    """
+    values = [None] * len(names)
+    lib = _library()
+    if not lib:
+        if not evaluate_macros.warned:
+            logging.warn("the version of libclang being used can't evaluate expressions,",
+                         "so macros won't be evaluated.")
+            evaluate_macros.warned = True
+        return values
+    if not names:
+        return values
+
+    path = os.path.join(os.getcwd(), _MACROS_HEADER)
+    contents = ''.join(f'#include "{os.path.abspath(f)}"\n' for f in files)
+    contents += ''.join(f'static const __auto_type {_VARIABLE_PREFIX}{i} = ({name});\n'
+                        for (i, name) in enumerate(names))
+    tu = index.parse(path, args=arguments, unsaved_files=[(path, contents)],
+                     options=clang.TranslationUnit.PARSE_SKIP_FUNCTION_BODIES)
+    for cursor in tu.cursor.get_children():
+        if cursor.kind != clang.CursorKind.VAR_DECL:
+            continue
+        (prefix, _, number) = cursor.spelling.partition(_VARIABLE_PREFIX)
+        if not prefix and number.isdigit() and int(number) < len(names):
+            values[int(number)] = _evaluate(lib, cursor)
+    return values
+evaluate_macros.warned = False
@@ -3,17 +3,27 @@ import sys
 from pathlib import Path
 
 def macro_matches_file_path(location: str, name: str):
-    location_path = Path(location)
-    parent_name = '_'.join([g.name for g in location_path.parents]) + name.replace('.', '_')
+    parent_name = _joined_parent_names(location) + name.replace('.', '_')
     return parent_name.upper().endswith(name.upper())
 
+def _joined_parent_names(location: str):
+    # This is called for every macro without a value, and headers can have
+    # thousands of them, so only build the path once per file:
+    joined = _joined_parent_names._cache.get(location)
+    if joined is None:
+        joined = '_'.join([g.name for g in Path(location).parents])
+        _joined_parent_names._cache[location] = joined
+    return joined
+_joined_parent_names._cache = {}
+
 def is_header_guard(cursor, detector_fn):
+    return header_guard_p(cursor.location.file.name, cursor.spelling, detector_fn)
+
+def header_guard_p(file_name: str, macro_name: str, detector_fn):
+    """ Return True if `detector_fn` says the macro defined in `file_name` is a header guard """
     if not detector_fn:
         return False
-
-    location = cursor.location
-    macro_name = cursor.spelling
-    return detector_fn(location.file.name, macro_name)
+    return bool(detector_fn(file_name, macro_name))
 
 
 class LiteralConversionError(Exception):
@@ -31,3 +41,13 @@ def convert_literal_token(token):
         return token.spelling
     else:
         raise LiteralConversionError()
+
+def convert_value(value):
+    """ Convert the int or float a macro was evaluated to into a CL literal """
+    if isinstance(value, float):
+        # Use double floats so that no precision is lost:
+        literal = repr(value)
+        if 'e' in literal:
+            return literal.replace('e', 'd')
+        return literal + 'd0'
+    return str(value)
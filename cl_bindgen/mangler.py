@@ -8,10 +8,31 @@ into an lisp symbol.
 Each mangler class follows the following interface:
 + can_mangle(string): returns true if the entity knows how to mangle the string
 + mangle(string): returns a new string with the tranformations applied
+
+`compile_manglers` combines a list of manglers into a single function.
 """
 
-import re
+import functools
 import io
+import re
+
+def compile_manglers(manglers, maxsize=8192):
+    """ Return a function that applies each of the manglers in order to a string
+
+    The same names are mangled many times, so the results of the most recent
+    `maxsize` strings are remembered. This assumes that the manglers always
+    give the same result for the same string, which is true of the built-in
+    manglers. Later changes to `manglers` don't affect the returned function.
+    """
+    steps = tuple((m.can_mangle, m.mangle) for m in manglers)
+
+    @functools.lru_cache(maxsize=maxsize)
+    def mangle(string):
+        for (can_mangle, do_mangle) in steps:
+            if can_mangle(string):
+                string = do_mangle(string)
+        return string
+    return mangle
 
 class PrefixMangler:
     """ Mangler to replace the prefix of a string wtih a given string."""
@@ -108,10 +129,15 @@ class CamelCaseConverter:
     def can_mangle(self, string):
         return len(string) > 0
 
+    # Matches the places _should_add_dash is true for ASCII strings:
+    _dash_position_re = re.compile('(?<=[a-z0-9])(?=[A-Z])')
+
     def _should_add_dash(self, cur_char, prev):
         return cur_char.isupper() and not prev.isupper() and prev.isalnum()
 
     def mangle(self, string):
+        if string.isascii():
+            return self._dash_position_re.sub('-', string).lower()
         builder = io.StringIO()
         builder.write(string[0].lower())
         for i in range(1, len(string)):
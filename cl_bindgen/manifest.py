@@ -0,0 +1,83 @@
+""" Manifests used to skip regenerating output that is already up to date
+
+A manifest is stored next to each output file. It records a fingerprint of
+everything that was used to generate the output except the input files, and
+the digests of the input files, the files they include and the output itself.
+"""
+
+import json
+import os
+
+import cl_bindgen
+from cl_bindgen.cache import file_digest, make_key, write_atomically
+
+_MANIFEST_SUFFIX = '.cl-bindgen-manifest'
+
+def manifest_path(output):
+    return output + _MANIFEST_SUFFIX
+
+def _describe_callable(fn):
+    return f'{getattr(fn, "__module__", None)}.{getattr(fn, "__qualname__", type(fn).__qualname__)}'
+
+def _describe_manglers(manglers):
+    return [[type(m).__qualname__, {k: repr(v) for (k, v) in sorted(vars(m).items())}]
+            for m in manglers]
+
+def fingerprint(files, options, document=None):
+    """ Return a fingerprint of the files to process and the options to process them with
+
+    Functions created from inclusion rules can't be compared, so the batch
+    file document the options were created from should be given as well.
+    """
+    return make_key(cl_bindgen.__version__,
+                    list(files),
+                    document,
+                    options.output,
+                    options.package,
+                    options.force,
+                    options.arguments,
+                    options.evaluate_macros,
+                    options.depfile,
+                    _describe_manglers(options.typedef_manglers),
+                    _describe_manglers(options.enum_manglers),
+                    _describe_manglers(options.type_manglers),
+                    _describe_manglers(options.name_manglers),
+                    _describe_manglers(options.constant_manglers),
+                    _describe_callable(options.macro_detector))
+
+def read_manifest(output, key):
+    """ Return the manifest of `output` if it was generated with the fingerprint `key` and its inputs haven't changed
+
+    Returns None if the output isn't up to date.
+    """
+    try:
+        with open(manifest_path(output)) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if manifest.get('fingerprint') != key:
+        return None
+    if file_digest(output) != manifest.get('output'):
+        return None
+    dependencies = manifest.get('dependencies', {})
+    if not all(file_digest(path) == digest for (path, digest) in dependencies.items()):
+        return None
+    return manifest
+
+def is_up_to_date(output, key):
+    """ Return True if `output` was generated with the fingerprint `key` and its inputs haven't changed """
+    return read_manifest(output, key) is not None
+
+def write_manifest(output, key, dependencies, anon_enums=None):
+    """ Record that `output` was generated with the fingerprint `key` from `dependencies`
+
+    `anon_enums` is the range of numbers used to name the anonymous enums in
+    the output, which depends on the outputs generated before it.
+    """
+    manifest = {
+        'fingerprint': key,
+        'output': file_digest(output),
+        'dependencies': {os.path.abspath(path): file_digest(path) for path in dependencies},
+        'anon-enums': anon_enums
+    }
+    write_atomically(manifest_path(output), json.dumps(manifest, indent=1).encode())
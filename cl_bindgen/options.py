@@ -0,0 +1,84 @@
+""" The options that control how header files are processed """
+
+import dataclasses
+import sys
+import typing
+from dataclasses import dataclass
+
+@dataclass
+class InlineRule:
+    checker: typing.Callable[[str], bool] = dataclasses.field()
+    feature: str = dataclasses.field()
+
+@dataclass
+class ProcessOptions:
+    typedef_manglers: list = dataclasses.field(default_factory=list)
+    enum_manglers: list = dataclasses.field(default_factory=list)
+    type_manglers: list = dataclasses.field(default_factory=list)
+    name_manglers: list = dataclasses.field(default_factory=list)
+    constant_manglers: list = dataclasses.field(default_factory=list)
+
+    declaim_inline_rules: list = dataclasses.field(default_factory=list)
+
+    macro_detector: typing.Callable[[str,str,], bool] = dataclasses.field(
+        default_factory=lambda: lambda s, n: False)
+    expand_pointer_p: typing.Callable[[str], bool] = dataclasses.field(
+        default_factory=lambda: lambda s: True)
+    return_str_p: typing.Callable[[str], bool] = dataclasses.field(
+        default_factory=lambda: lambda s: False)
+    enum_constant_p: typing.Callable[[str], bool] = dataclasses.field(
+        default_factory=lambda: lambda s: False)
+    declaration_p: typing.Callable[[str], bool] = dataclasses.field(
+        default_factory=lambda: lambda s: True)
+    # If set, only the functions, variables and macros it accepts and the
+    # types they use are output:
+    root_p: typing.Callable[[str], bool] = None
+
+    output: str = dataclasses.field(default_factory=lambda: ":stdout")
+    package : str = None
+    arguments: list = dataclasses.field(default_factory=list)
+    force: bool = False
+    jobs: int = 1
+    cache_dir: str = None
+    umbrella: bool = False
+    evaluate_macros: bool = False
+    stream_output: bool = False
+    # Only replace the output if its contents changed, keeping its modification time:
+    write_if_changed: bool = False
+    # Where to write the make-style dependency file of the output, or
+    # DEPFILE_NEXT_TO_OUTPUT to write it to the output's path with .d added:
+    depfile: str = None
+    # Keeps translation units alive between runs, see watch.TranslationUnitStore:
+    translation_units: typing.Any = None
+
+    def declaim_inline_p(self, s: str):
+        if self.declaim_inline_rules:
+            for r in self.declaim_inline_rules:
+                expand = r.checker(s)
+                if expand:
+                    if r.feature:
+                        return [True, r.feature]
+                    else:
+                        return [True, None]
+        else:
+            return [False, None]
+
+    DEPFILE_NEXT_TO_OUTPUT = ':output'
+
+    @staticmethod
+    def depfile_path(option):
+        """ Return where to write the dependency file of the output, or None """
+        if option.depfile == ProcessOptions.DEPFILE_NEXT_TO_OUTPUT:
+            return option.output + '.d'
+        return option.depfile
+
+    @staticmethod
+    def output_file_from_option(option, open_args):
+        """ Open the file specified by `option` """
+        if option.output == ":stdout":
+            return sys.stdout
+        elif option.output == ":stderr":
+            return sys.stderr
+        else:
+            # TODO: try to do something intellegent here to avoid/warn when overwriting files?
+            return open(option.output, open_args)
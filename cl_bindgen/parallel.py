@@ -0,0 +1,60 @@
+""" Run work in a pool of forked processes
+
+`ProcessOptions` objects usually hold closures (e.g. the functions built by
+`inclusion_rules`), which can't be pickled. Instead of sending the work to the
+workers, it is stored in this module before the pool is created, and the forked
+workers inherit it. Only the indices of the work items and the results are
+sent between processes.
+"""
+
+import multiprocessing
+
+_work = None
+
+def _run_item(index):
+    fn, items = _work
+    try:
+        return (True, fn(items[index]))
+    # Whatever fn raises is re-raised by imap_forked in the parent:
+    except Exception as err:  # noqa: BLE001
+        return (False, err)
+
+def should_fork(jobs, count):
+    """ Return True if `count` items would be processed by a pool of `jobs` processes
+
+    The work is done in the current process if `jobs` is less than two or if
+    this process is already a pool worker.
+    """
+    return not (jobs is None or jobs < 2 or count < 2 or multiprocessing.current_process().daemon)
+
+def imap_forked(fn, items, jobs):
+    """ Yield `fn(item)` for each item in `items`, using up to `jobs` processes
+
+    The results are yielded in the same order as `items`. If calling `fn`
+    raised an exception for an item, it is re-raised when that item's result
+    would have been yielded.
+    """
+    items = list(items)
+    if not should_fork(jobs, len(items)):
+        for item in items:
+            yield fn(item)
+        return
+
+    global _work
+    _work = (fn, items)
+    try:
+        context = multiprocessing.get_context('fork')
+        with context.Pool(min(jobs, len(items))) as pool:
+            for (success, value) in pool.imap(_run_item, range(len(items))):
+                if not success:
+                    raise value
+                yield value
+    finally:
+        _work = None
+
+def map_forked(fn, items, jobs):
+    """ Return `[fn(item) for item in items]`, using up to `jobs` processes
+
+    See `imap_forked`.
+    """
+    return list(imap_forked(fn, items, jobs))
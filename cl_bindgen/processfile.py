@@ -1,27 +1,41 @@
-import sys
-import os.path
+import collections
+import ctypes
+import dataclasses
 import errno
+import functools
 import io
 import itertools
-import typing
+import os.path
+import pickle
 import re
-from enum import Enum
-import dataclasses
+import sys
+import tempfile
 from dataclasses import dataclass
-import cl_bindgen.macro_util as macro_util
-import cl_bindgen.logging as logging
-from cl_bindgen.exception import ProcessingError
+from enum import Enum
 
 import clang.cindex as clang
-from clang.cindex import TypeKind, CursorKind
+from clang.cindex import CursorKind, TypeKind
+
+import cl_bindgen.cache as cache
+import cl_bindgen.depfile as depfile
+import cl_bindgen.ir as ir
+import cl_bindgen.logging as logging
+import cl_bindgen.macro_eval as macro_eval
+import cl_bindgen.macro_util as macro_util
+import cl_bindgen.mangler as mangler
+import cl_bindgen.parallel as parallel
+import cl_bindgen.reachability as reachability
+from cl_bindgen.exception import ParserException, ProcessingError
+
+# InlineRule used to be defined here, so keep it importable from this module:
+from cl_bindgen.options import InlineRule, ProcessOptions  # noqa: F401
 
 def _lispify_comment(comment):
     comment = comment.replace('"', '\\"')
     return re.sub(_lispify_comment.doc_decorator_re, '', comment).strip()
 _lispify_comment.doc_decorator_re = re.compile("^\s*[*/]* ?",flags=re.MULTILINE)
 
-def _output_comment(cursor, output, before='', after=''):
-    comment = cursor.raw_comment
+def _output_comment(comment, output, before='', after=''):
     if comment:
         comment = _lispify_comment(comment)
         output.write(before)
@@ -42,74 +56,6 @@ else:
         # as this spelling isn't empty, and is instead something like "(anonymous at ...)"
         return cursor.spelling == ''
 
-class ParserException(Exception):
-
-    def __init__(self, filepath, diagnostics):
-        self.filepath = filepath
-        self.diagnostics = list(diagnostics)
-        self.message = self.format_errors()
-
-    def format_errors(self):
-        stream = io.StringIO()
-        stream.write(self.diagnostics[0].format())
-        for diag in self.diagnostics[1:]:
-            stream.write('\n')
-            stream.write(diag.format())
-
-        return stream.getvalue()
-
-@dataclass
-class InlineRule:
-    checker: typing.Callable[[str], bool] = dataclasses.field()
-    feature: str = dataclasses.field()
-
-@dataclass
-class ProcessOptions:
-    typedef_manglers: list = dataclasses.field(default_factory=lambda: [])
-    enum_manglers: list = dataclasses.field(default_factory=lambda: [])
-    type_manglers: list = dataclasses.field(default_factory=lambda: [])
-    name_manglers: list = dataclasses.field(default_factory=lambda: [])
-    constant_manglers: list = dataclasses.field(default_factory=lambda: [])
-
-    declaim_inline_rules: list = dataclasses.field(default_factory=lambda: [])
-
-    macro_detector: typing.Callable[[str,str,], bool] = dataclasses.field(
-        default_factory=lambda: lambda s, n: False)
-    expand_pointer_p: typing.Callable[[str], bool] = dataclasses.field(
-        default_factory=lambda: lambda s: True)
-    return_str_p: typing.Callable[[str], bool] = dataclasses.field(
-        default_factory=lambda: lambda s: False)
-    enum_constant_p: typing.Callable[[str], bool] = dataclasses.field(
-        default_factory=lambda: lambda s: False)
-
-    output: str = dataclasses.field(default_factory=lambda: ":stdout")
-    package : str = None
-    arguments: list = dataclasses.field(default_factory=lambda: [])
-    force: bool = False
-
-    def declaim_inline_p(self, s: str):
-        if self.declaim_inline_rules:
-            for r in self.declaim_inline_rules:
-                expand = r.checker(s)
-                if expand:
-                    if r.feature:
-                        return [True, r.feature]
-                    else:
-                        return [True, None]
-        else:
-            return [False, None]
-
-    @staticmethod
-    def output_file_from_option(option, open_args):
-        """ Open the file specified by `option` """
-        if option.output == ":stdout":
-            return sys.stdout
-        elif option.output == ":stderr":
-            return sys.stderr
-        else:
-            # TODO: try to do something intellegent here to avoid/warn when overwriting files?
-            return open(option.output, open_args)
-
 # _ParseData = namedtuple('ParseData', ['skipped_enums', 'skipped_records'])
 @dataclass
 class _ParseData:
@@ -118,16 +64,144 @@ class _ParseData:
     skipped_enums: dict = dataclasses.field(default_factory=dict)
     found_records: set = dataclasses.field(default_factory=set)
 
+def _number_anon_enums(text, start):
+    """ Replace the placeholder names of anonymous enums in `text`, numbering them from `start` """
+    return _number_anon_enums.placeholder_re.sub(
+        lambda match: f'anon-enum-{int(match.group(1)) + start}', text)
+_number_anon_enums.placeholder_re = re.compile('\0anon-enum-([0-9]+)\0')
+
+def _unnumbered_output_path(output):
+    """ Where the output is kept until its anonymous enums are numbered when only writing changes """
+    return output + '.cl-bindgen-unnumbered'
+
+def _number_anon_enums_in_output(options, start):
+    """ Replace the placeholder names of anonymous enums in the output file """
+    unnumbered = _unnumbered_output_path(options.output)
+    source = unnumbered if options.write_if_changed else options.output
+    with open(source) as f:
+        text = f.read()
+    output = _OutputWriter(dataclasses.replace(options, stream_output=True))
+    try:
+        output.write(_number_anon_enums(text, start))
+        output.commit()
+    except BaseException:
+        output.abort()
+        raise
+    if source == unnumbered:
+        os.unlink(unnumbered)
+
+def _remove_unnumbered_output(options):
+    """ Remove the output kept for `_number_anon_enums_in_output`, if there is one """
+    if options.write_if_changed and options.output not in (':stdout', ':stderr'):
+        try:
+            os.unlink(_unnumbered_output_path(options.output))
+        except FileNotFoundError:
+            pass
+
+def _same_contents(new_path, old_path):
+    """ Return True if the files have the same contents, comparing their sizes first """
+    try:
+        if os.path.getsize(new_path) != os.path.getsize(old_path):
+            return False
+    except OSError:
+        return False
+    digest = cache.file_digest(new_path)
+    return digest is not None and digest == cache.file_digest(old_path)
+
+def _default_file_mode():
+    umask = os.umask(0)
+    os.umask(umask)
+    return 0o666 & ~umask
+
+class _OutputWriter:
+    """ Writes the generated code to the output given in the options
+
+    Nothing is written to the output if an error occurs: the text is buffered
+    in memory, or when `options.stream_output` or `options.write_if_changed`
+    is true, written to a temporary file next to the output that replaces it
+    once everything has been written. With `options.write_if_changed`, the
+    output is only replaced if the new text is different.
+    Trailing whitespace is removed from the end of the output.
+
+    If `placeholder_names` is true, the anonymous enums in the text have
+    placeholder names. With `options.write_if_changed`, the text is then
+    kept next to the output for `_number_anon_enums_in_output`, which
+    compares it once the enums are numbered.
+    """
+
+    def __init__(self, options, placeholder_names=False):
+        self.options = options
+        self.placeholder_names = placeholder_names
+        self._pending = ''
+        self._temp_path = None
+        if ((options.stream_output or options.write_if_changed)
+            and options.output not in (':stdout', ':stderr')):
+            directory, name = os.path.split(os.path.abspath(options.output))
+            fd, self._temp_path = tempfile.mkstemp(dir=directory, prefix=f'.{name}.', suffix='.tmp')
+            self._stream = os.fdopen(fd, 'w')
+        else:
+            self._stream = io.StringIO()
+
+    def write(self, text):
+        # Hold on to trailing whitespace until we know more text follows it:
+        stripped = text.rstrip()
+        if stripped:
+            self._stream.write(self._pending)
+            self._stream.write(stripped)
+            self._pending = text[len(stripped):]
+        else:
+            self._pending = self._pending + text
+
+    def commit(self):
+        self._stream.write('\n')
+        if self._temp_path:
+            self._stream.close()
+            output = self.options.output
+            if self.options.write_if_changed:
+                if self.placeholder_names:
+                    os.replace(self._temp_path, _unnumbered_output_path(output))
+                    self._temp_path = None
+                    return
+                if _same_contents(self._temp_path, output):
+                    os.unlink(self._temp_path)
+                    self._temp_path = None
+                    return
+            mode = os.stat(output).st_mode if os.path.exists(output) else _default_file_mode()
+            os.chmod(self._temp_path, mode)
+            os.replace(self._temp_path, output)
+            self._temp_path = None
+        else:
+            actual_output = ProcessOptions.output_file_from_option(self.options, 'w')
+            try:
+                actual_output.write(self._stream.getvalue())
+            finally:
+                if not (actual_output == sys.stderr or actual_output == sys.stdout):
+                    actual_output.close()
+
+    def abort(self):
+        self._stream.close()
+        if self._temp_path:
+            os.unlink(self._temp_path)
+            self._temp_path = None
+
 class _ElaboratedType(Enum):
     UNION  = 0
     STRUCT = 1
     ENUM   = 2
 
 def _mangle_string(thing, manglers):
-    for mangler in manglers:
-        if mangler.can_mangle(thing):
-            thing = mangler.mangle(thing)
-    return thing
+    entry = _mangle_string._pipelines.get(id(manglers))
+    if entry is None:
+        # Keep a reference to the list so its id isn't reused during this run:
+        entry = (manglers, mangler.compile_manglers(manglers))
+        _mangle_string._pipelines[id(manglers)] = entry
+    return entry[1](thing)
+# The compiled mangler lists for the current call to render_headers:
+_mangle_string._pipelines = {}
+
+# Extraction: the top-level cursors of a file are turned into the
+# declarations of the ir module. Nothing here depends on the options used to
+# output the declarations.
 
 def _determine_elaborated_type(type_obj):
     named_type = type_obj.get_named_type()
@@ -139,11 +213,22 @@ def _determine_elaborated_type(type_obj):
         elif type_decl.kind == CursorKind.STRUCT_DECL:
             return _ElaboratedType.STRUCT
         else:
-            raise Exception(f"Unknown cursorkind: {type_decl.kind}")
+            raise ProcessingError(f"Unknown cursorkind: {type_decl.kind}")
     elif named_type_kind == TypeKind.ENUM:
         return _ElaboratedType.ENUM
 
 def _explicitly_typed_enum_p(decl: clang.Cursor):
+    # libclang doesn't say whether an enum's underlying type is fixed, so the
+    # declaration has to be tokenized. That is slow, so only do it once per enum:
+    key = decl.hash
+    result = _explicitly_typed_enum_p._cache.get(key)
+    if result is None:
+        result = _tokenize_explicitly_typed_enum_p(decl)
+        _explicitly_typed_enum_p._cache[key] = result
+    return result
+_explicitly_typed_enum_p._cache = {}
+
+def _tokenize_explicitly_typed_enum_p(decl: clang.Cursor):
     for token in decl.get_tokens():
         if token.spelling == '{':
             break
@@ -151,130 +236,145 @@ def _explicitly_typed_enum_p(decl: clang.Cursor):
             return True
     return False
 
-def _emit_enum_type(decl: clang.Cursor, options: ProcessOptions, location: clang.SourceLocation, name=None):
-    if name is not None:
-        mangled_name = name
-    else:
-        mangled_name = _mangle_string(decl.spelling, options.type_manglers)
-    # Because the default underlying enum type is dependent on the
-    # system and the enum's value, we can't use the underlying type
-    # and must use the enum as declared unless the underlying type
-    # was explicity set:
-    if _explicitly_typed_enum_p(decl):
-        enum_type = _cursor_lisp_type_str(decl.enum_type, options, location)
-        return f"{mangled_name} #| {enum_type} |#"
-    else:
-        return f"{mangled_name}"
-
-
+def _given_name(name):
+    """ Return the name clang gives the file `name` when it parses the current translation unit
 
-def _determine_elaborated_field(field, inner_name, output, options, found_records):
-    actual_elaborated_type = _determine_elaborated_type(field.type)
-    if actual_elaborated_type == _ElaboratedType.ENUM:
-        decl = field.type.get_declaration()
-        _process_realized_enum(inner_name, decl, output, options, as_constants=True)
-        return _emit_enum_type(decl, options, field.location, name=inner_name)
-    elif actual_elaborated_type == _ElaboratedType.UNION:
-        _process_record(inner_name, actual_elaborated_type, field, output, options, found_records)
-        return "(:union " + inner_name + ")"
-    elif actual_elaborated_type == _ElaboratedType.STRUCT:
-        # struct type
-        _process_record(inner_name, actual_elaborated_type, field, output, options, found_records)
-        return "(:struct " + inner_name + ")"
-
-def _determine_decl_field(field, inner_name, output, options, found_records):
-    cursor_decl = field.type.get_declaration()
-    cursor_kind = cursor_decl.kind
-    if cursor_kind == CursorKind.UNION_DECL:
-        _process_record(inner_name, _ElaboratedType.UNION, field, output, options, found_records)
-        return "(:union " + inner_name + ")"
-    elif cursor_kind == CursorKind.STRUCT_DECL:
-        _process_record(inner_name, _ElaboratedType.STRUCT, field, output, options, found_records)
-        return "(:struct " + inner_name + ")"
-    else:
-        raise Exception(f"Unknown cursor kind {cursor_kind} when realizing field type")
+    Translation units loaded from the cache refer to every file by its
+    absolute path instead, see _parse_translation_unit.
+    """
+    return _given_name.names.get(name, name)
 
-def _should_expand_pointer_type(pointee_type, options):
-    return (pointee_type.kind in _cursor_lisp_type_str._builtin_table
-            or options.expand_pointer_p(pointee_type.spelling))
+def _given_spelling(spelling):
+    """ Return `spelling` with the file names in it replaced by _given_name
 
-def _cursor_typedef_str(type_obj, options):
-    type_decl = type_obj.get_declaration()
-    # try the known typedefs:
-    type_decl_str = type_decl.type.spelling
-    known_type = _cursor_lisp_type_str._known_typedefs.get(type_decl_str)
-    if known_type:
-        return known_type
+    Unnamed types are spelled with their location, e.g.
+    "struct (anonymous at point.h:3:2)".
+    """
+    pattern = _given_name.pattern
+    if pattern is None:
+        return spelling
+    return pattern.sub(lambda match: _given_name.names[match.group(0)], spelling)
+
+def _use_given_names(names):
+    """ Set the names used by _given_name, mapping absolute paths to the names to use instead """
+    _given_name.names = names
+    if names:
+        alternatives = '|'.join(re.escape(path) for path in sorted(names, key=len, reverse=True))
+        _given_name.pattern = re.compile(f'(?:{alternatives})(?=:[0-9])')
     else:
-        return _mangle_string(type_decl_str, options.typedef_manglers)
+        _given_name.pattern = None
+# Set for the current translation unit by _parse_translation_unit:
+_given_name.names = {}
+_given_name.pattern = None
+
+def _cursor_location(cursor):
+    """ Return the ir.Location of `cursor` """
+    location = cursor.location
+    file = location.file
+    if file is None:
+        return ir.Location(None, location.line, location.column)
+    # Getting a file's name is slow compared to identifying it, so only do it
+    # once per file:
+    file_id = _file_id(file)
+    name = _cursor_location._file_names.get(file_id)
+    if name is None:
+        name = _given_name(file.name)
+        _cursor_location._file_names[file_id] = name
+    return ir.Location(name, location.line, location.column)
+# Caches the names for the current translation unit. See _reset_type_caches.
+_cursor_location._file_names = {}
+
+def _extract_type(type_obj, location):
+    """ Return the ir node for `type_obj`, or ir.Unsupported if it can't be output """
+    try:
+        return _extract_type_node(type_obj, location)
+    except ProcessingError as err:
+        return ir.Unsupported(err)
 
-def _cursor_lisp_type_str(type_obj, options, location=None, field=False):
-    def process_record_type():
+def _extract_type_node(type_obj, location):
+    assert(isinstance(type_obj, clang.Type))
+    kind = type_obj.kind
+    builtin = _extract_type_node._builtin_nodes.get(kind)
+    if builtin:
+        return builtin
+    # Within a translation unit, the kind and spelling of a type identify
+    # it: unnamed types are spelled with their location.
+    key = (kind, type_obj.spelling)
+    node = _extract_type_node._cache.get(key)
+    if node is None:
+        node = _resolve_type_node(type_obj, kind, location)
+        _extract_type_node._cache[key] = node
+    return node
+# Caches the nodes for the current translation unit. See _reset_type_caches.
+_extract_type_node._cache = {}
+
+def _extract_enum_type(decl, location):
+    node = _extract_enum_type._cache.get(decl.hash)
+    if node is None:
+        # Because the default underlying enum type is dependent on the
+        # system and the enum's value, we can't use the underlying type
+        # and must use the enum as declared unless the underlying type
+        # was explicity set:
+        underlying = None
+        if _explicitly_typed_enum_p(decl):
+            underlying = _extract_type_node(decl.enum_type, location)
+        node = ir.EnumType(_given_spelling(decl.spelling), underlying)
+        _extract_enum_type._cache[decl.hash] = node
+    return node
+_extract_enum_type._cache = {}
+
+def _typedef_type_node(type_obj):
+    return ir.TypedefType(_given_spelling(type_obj.get_declaration().type.spelling))
+
+def _resolve_type_node(type_obj, kind, location):
+    def record_type():
         type_decl = type_obj.get_declaration()
-        mangled_name = _mangle_string(type_decl.spelling, options.type_manglers)
         if type_decl.kind == CursorKind.UNION_DECL:
-            return "(:union " + mangled_name + ")"
+            return ir.RecordType(True, _given_spelling(type_decl.spelling))
         elif type_decl.kind == CursorKind.STRUCT_DECL:
-            return "(:struct " + mangled_name + ")"
+            return ir.RecordType(False, _given_spelling(type_decl.spelling))
         else:
             raise ProcessingError("Unknown cursorkind", location)
 
-    assert(isinstance(type_obj, clang.Type))
-    kind = type_obj.kind
-    known_type = _cursor_lisp_type_str._builtin_table.get(kind)
-    if known_type:
-        return known_type
-    elif kind == TypeKind.TYPEDEF:
-        return _cursor_typedef_str(type_obj, options)
+    if kind == TypeKind.TYPEDEF:
+        return _typedef_type_node(type_obj)
     elif kind == TypeKind.POINTER:
-        # emit the type of pointer:
         pointee_type = type_obj.get_pointee()
         if pointee_type.kind == TypeKind.FUNCTIONNOPROTO or pointee_type.kind == TypeKind.FUNCTIONPROTO:
-            return f":pointer #| function ptr {pointee_type.spelling} |#"
+            return ir.FunctionPointerType(_given_spelling(pointee_type.spelling))
         else:
-            pointee_type_str = _cursor_lisp_type_str(pointee_type, options, location)
-            if _should_expand_pointer_type(pointee_type, options):
-                type_str = "(:pointer " + pointee_type_str + ")"
-                return type_str
-            else:
-                return f':pointer #| {pointee_type_str} |#'
+            return ir.PointerType(_extract_type_node(pointee_type, location),
+                                  _given_spelling(pointee_type.spelling))
     elif kind == TypeKind.ELABORATED:
         # Either a struct, union, or enum: (any type that looks like "struct foo", "enum foo", etc
         named_type = type_obj.get_named_type()
         named_type_kind = named_type.kind
         if named_type_kind == TypeKind.RECORD:
-            return process_record_type()
+            return record_type()
         elif named_type_kind == TypeKind.ENUM:
-            enum_decl = type_obj.get_declaration()
-            return _emit_enum_type(enum_decl, options, location)
+            return _extract_enum_type(type_obj.get_declaration(), location)
         elif named_type_kind == TypeKind.TYPEDEF:
-            return _cursor_typedef_str(type_obj, options)
+            return _typedef_type_node(type_obj)
     elif kind == TypeKind.RECORD:
-        return process_record_type()
+        return record_type()
     elif kind == TypeKind.INCOMPLETEARRAY:
-        elem_type = type_obj.element_type
-        return f"(:pointer {_cursor_lisp_type_str(elem_type, options, location)} #| array |#)"
+        return ir.ArrayType(_extract_type_node(type_obj.element_type, location), None)
     elif kind == TypeKind.CONSTANTARRAY:
-        elem_type = type_obj.element_type
-        num_elems = type_obj.element_count
-        type_str = _cursor_lisp_type_str(elem_type, options, location)
-        if field:
-            return f"{type_str} :count {num_elems}"
-        else:
-            return f":pointer #| {type_str} :count {num_elems} |#"
+        return ir.ArrayType(_extract_type_node(type_obj.element_type, location),
+                            type_obj.element_count)
     elif kind == TypeKind.FUNCTIONPROTO:
-        return f":void #| {type_obj.spelling} |#"
+        return ir.FunctionType(_given_spelling(type_obj.spelling))
     elif kind == TypeKind.FUNCTIONNOPROTO:
         raise ProcessingError("Don't know how to handle type kind FUNCTIONNOPROTO", location)
     elif kind == TypeKind.ENUM:
-        enum_decl = type_obj.get_declaration()
-        return _emit_enum_type(enum_decl, options, location)
+        return _extract_enum_type(type_obj.get_declaration(), location)
 
-    raise ProcessingError(f"Don't know how to handle type: {type_obj.spelling} {kind}", location)
+    raise ProcessingError(f"Don't know how to handle type: {_given_spelling(type_obj.spelling)} {kind}",
+                          location)
 
 # This table contains types that don't have to be inferred or otherwise
 # built based off of the cursor type
-_cursor_lisp_type_str._builtin_table = {
+_builtin_types = {
     TypeKind.BOOL       : ":bool",
     TypeKind.DOUBLE     : ":double",
     TypeKind.FLOAT      : ":float",
@@ -296,9 +396,210 @@ _cursor_lisp_type_str._builtin_table = {
     TypeKind.SCHAR  : ":signed-char",
     TypeKind.UCHAR  : ":unsigned-char"
 }
+_extract_type_node._builtin_nodes = {kind: ir.BuiltinType(name) for (kind, name) in _builtin_types.items()}
+
+def _extract_macro_def(cursor):
+    # first token is always the macro name, so we can skip it.
+    tokens = [ir.MacroToken(token.kind.name, token.spelling)
+              for token in itertools.islice(cursor.get_tokens(), 1, 3)]
+    # Only macros that are evaluated need to know whether they take arguments:
+    function_like = macro_eval.function_like_p(cursor) if _extract_macro_def.evaluate else None
+    return ir.Macro(cursor.spelling, tokens, function_like, None, _cursor_location(cursor))
+# Set to options.evaluate_macros before extracting a translation unit:
+_extract_macro_def.evaluate = False
+
+def _evaluation_candidate_p(node):
+    """ Return True if the macro might be a constant expression """
+    if not isinstance(node, ir.Macro) or node.is_function_like or not node.tokens:
+        return False
+    # Braces and semicolons would break the declarations that follow them in
+    # the generated translation unit:
+    return not any(token.spelling in _evaluation_candidate_p._separators for token in node.tokens)
+_evaluation_candidate_p._separators = {'{', '}', ';'}
+
+def _evaluate_macros(files, declarations, options):
+    """ Set the values of the macros in `declarations`, which come from `files` """
+    macros = [node for node in declarations if _evaluation_candidate_p(node)]
+    values = macro_eval.evaluate_macros(_shared_index(), files, [node.spelling for node in macros],
+                                        options.arguments)
+    for (node, value) in zip(macros, values):
+        node.value = value
+
+def _extract_anonymous_field(field, location):
+    """ Return the declaration of an anonymous field's type """
+    kind = field.type.kind
+    if kind == TypeKind.ELABORATED or kind == TypeKind.ENUM:
+        try:
+            actual_elaborated_type = _determine_elaborated_type(field.type)
+        except ProcessingError as err:
+            return ir.Unsupported(err)
+        if actual_elaborated_type == _ElaboratedType.ENUM:
+            return _extract_enum(field.type.get_declaration())
+        elif actual_elaborated_type == _ElaboratedType.UNION:
+            return _extract_record(field, is_union=True)
+        elif actual_elaborated_type == _ElaboratedType.STRUCT:
+            return _extract_record(field, is_union=False)
+        return None
+    elif kind == TypeKind.RECORD:
+        cursor_kind = field.type.get_declaration().kind
+        if cursor_kind == CursorKind.UNION_DECL:
+            return _extract_record(field, is_union=True)
+        elif cursor_kind == CursorKind.STRUCT_DECL:
+            return _extract_record(field, is_union=False)
+        else:
+            return ir.Unsupported(Exception(f"Unknown cursor kind {cursor_kind} when realizing field type"))
+    else:
+        return ir.Unsupported(ProcessingError("Uknown typekind: " + str(kind), location))
+
+def _extract_record_fields(cursor, location):
+    fields = []
+    for field in cursor.type.get_fields():
+        if field.is_anonymous():
+            field_type = None
+            inner = _extract_anonymous_field(field, location)
+        else:
+            field_type = _extract_type(field.type, location)
+            inner = None
+        fields.append(ir.Field(_given_spelling(field.spelling), _is_anonymous_record_decl(field),
+                               field_type, inner))
+    return fields
+
+def _extract_record(cursor, is_union):
+    location = _cursor_location(cursor)
+    is_definition = cursor.is_definition()
+    fields = _extract_record_fields(cursor, location) if is_definition else None
+    return ir.Record(is_union, _given_spelling(cursor.spelling), cursor.hash, cursor.is_anonymous(),
+                     is_definition, cursor.raw_comment, fields, location)
+
+def _extract_struct_decl(cursor):
+    return _extract_record(cursor, is_union=False)
+
+def _extract_union_decl(cursor):
+    return _extract_record(cursor, is_union=True)
+
+def _extract_enum(cursor):
+    location = _cursor_location(cursor)
+    underlying = None
+    if _explicitly_typed_enum_p(cursor):
+        underlying = _extract_type(cursor.enum_type, location)
+    constants = [(field.spelling, field.enum_value) for field in cursor.get_children()]
+    return ir.Enum(_given_spelling(cursor.spelling), cursor.hash, cursor.is_anonymous(), underlying,
+                   cursor.raw_comment, constants, location)
+
+def _extract_func_decl(cursor):
+    location = _cursor_location(cursor)
+    ret_type = cursor.result_type
+    returns_char_pointer = (ret_type.kind == TypeKind.POINTER
+                            and ret_type.get_pointee().kind in (TypeKind.CHAR_S, TypeKind.CHAR_U))
+    arguments = [(arg.spelling, _extract_type(arg.type, location)) for arg in cursor.get_arguments()]
+    return ir.Function(cursor.spelling, _extract_type(ret_type, location), returns_char_pointer,
+                       cursor.raw_comment, arguments, location)
+
+def _extract_typedef_decl(cursor):
+    location = _cursor_location(cursor)
+    underlying_type = cursor.underlying_typedef_type
+    return ir.Typedef(cursor.spelling, _extract_type(underlying_type, location),
+                      underlying_type.get_declaration().hash, location)
+
+def _extract_var_decl(cursor):
+    location = _cursor_location(cursor)
+    var_type = cursor.type
+    return ir.Var(cursor.spelling, _extract_type(var_type, location),
+                  var_type.get_declaration().hash, var_type.is_const_qualified(),
+                  cursor.raw_comment, location)
+
+def _extract_no_op(cursor):
+    return None
+
+def _extract_unrecognized(cursor):
+    return ir.Unrecognized(f'{cursor.kind}', _given_spelling(cursor.spelling), _cursor_location(cursor))
+
+def _cursor_included(cursor, declaration_p):
+    """ The test done by `_declaration_included`, before the cursor is extracted """
+    if declaration_p(_given_spelling(cursor.spelling)):
+        return True
+    return cursor.kind in _cursor_included._unnamed_kinds and cursor.is_anonymous()
+_cursor_included._unnamed_kinds = frozenset([clang.CursorKind.STRUCT_DECL,
+                                             clang.CursorKind.UNION_DECL,
+                                             clang.CursorKind.ENUM_DECL])
+
+def _extract_declarations(cursors, declaration_p=None, on_extracted=None):
+    """ Extract the ir nodes of the cursors
+
+    If `declaration_p` is given, the cursors it excludes are skipped. If
+    `on_extracted` is given, it is called with each cursor and its node.
+    """
+    declarations = []
+    for cursor in cursors:
+        if declaration_p and not _cursor_included(cursor, declaration_p):
+            continue
+        extract = _extract_declarations._extract_table.get(cursor.kind, _extract_unrecognized)
+        node = extract(cursor)
+        if node is not None:
+            declarations.append(node)
+            if on_extracted:
+                on_extracted(cursor, node)
+    return declarations
+
+_extract_declarations._extract_table = {
+    clang.CursorKind.MACRO_DEFINITION    : _extract_macro_def,
+    clang.CursorKind.STRUCT_DECL         : _extract_struct_decl,
+    clang.CursorKind.ENUM_DECL           : _extract_enum,
+    clang.CursorKind.FUNCTION_DECL       : _extract_func_decl,
+    clang.CursorKind.TYPEDEF_DECL        : _extract_typedef_decl,
+    clang.CursorKind.UNION_DECL          : _extract_union_decl,
+    clang.CursorKind.VAR_DECL            : _extract_var_decl,
+    clang.CursorKind.INCLUSION_DIRECTIVE : _extract_no_op,
+    clang.CursorKind.MACRO_INSTANTIATION : _extract_no_op,
+}
+
+# Rendering: the declarations of the ir module are output as lisp code using
+# the manglers and rules in the options.
+
+def _lisp_name(node, options):
+    """ Return the name a top-level declaration is given in the output, or None
+
+    Unnamed records and enums don't have a name of their own: they are output
+    as part of the declarations that use them. Anonymous enums are numbered as
+    they are output, see _anon_enum_name.
+    """
+    manglers = _lisp_name._manglers.get(type(node))
+    if manglers is None or not node.spelling or (type(node) is ir.Enum and node.is_anonymous):
+        return None
+    return _mangle_string(node.spelling, manglers(node, options))
+_lisp_name._manglers = {
+    # Functions are mangled the same way as type names:
+    ir.Function: lambda node, options: options.type_manglers,
+    ir.Record  : lambda node, options: options.type_manglers,
+    ir.Enum    : lambda node, options: options.type_manglers,
+    ir.Typedef : lambda node, options: options.typedef_manglers,
+    ir.Var     : lambda node, options: (options.constant_manglers if node.is_const
+                                        else options.name_manglers),
+    ir.Macro   : lambda node, options: options.constant_manglers,
+}
+
+def _lisp_type_str(node, options, field=False):
+    if type(node) is ir.BuiltinType:
+        return node.lisp_name
+    key = (node, field)
+    result = _lisp_type_str._cache.get(key)
+    if result is None:
+        result = _lisp_type_str._render_table[type(node)](node, options, field)
+        _lisp_type_str._cache[key] = result
+    return result
+# Caches the results for the current call to render_headers:
+_lisp_type_str._cache = {}
+
+def _typedef_type_str(node, options, field):
+    # try the known typedefs:
+    known_type = _typedef_type_str._known_typedefs.get(node.spelling)
+    if known_type:
+        return known_type
+    else:
+        return _mangle_string(node.spelling, options.typedef_manglers)
 
 # There a few typdefs that are known to CFFI that we don't need to manually define:
-_cursor_lisp_type_str._known_typedefs = {
+_typedef_type_str._known_typedefs = {
     "uint64_t" : ":uint64",
     "uint32_t" : ":uint32",
     "uint16_t" : ":uint16",
@@ -318,162 +619,207 @@ _cursor_lisp_type_str._known_typedefs = {
     "off_t" : ":offset"
 }
 
-def _output_unknown_macro_def(spelling, cursor, output):
-    logging.warn(f'Could not transform macro {cursor.spelling}', location=cursor.location)
+def _record_type_str(node, options, field):
+    mangled_name = _mangle_string(node.spelling, options.type_manglers)
+    if node.is_union:
+        return "(:union " + mangled_name + ")"
+    else:
+        return "(:struct " + mangled_name + ")"
+
+def _enum_type_str(node, options, field):
+    mangled_name = _mangle_string(node.spelling, options.type_manglers)
+    if node.underlying is not None:
+        enum_type = _lisp_type_str(node.underlying, options)
+        return f"{mangled_name} #| {enum_type} |#"
+    else:
+        return f"{mangled_name}"
+
+def _should_expand_pointer_type(node, options):
+    return (type(node.pointee) is ir.BuiltinType
+            or options.expand_pointer_p(node.pointee_spelling))
+
+def _pointer_type_str(node, options, field):
+    pointee_type_str = _lisp_type_str(node.pointee, options)
+    if _should_expand_pointer_type(node, options):
+        type_str = "(:pointer " + pointee_type_str + ")"
+        return type_str
+    else:
+        return f':pointer #| {pointee_type_str} |#'
+
+def _function_pointer_type_str(node, options, field):
+    return f":pointer #| function ptr {node.spelling} |#"
+
+def _array_type_str(node, options, field):
+    type_str = _lisp_type_str(node.element, options)
+    if node.count is None:
+        return f"(:pointer {type_str} #| array |#)"
+    elif field:
+        return f"{type_str} :count {node.count}"
+    else:
+        return f":pointer #| {type_str} :count {node.count} |#"
+
+def _function_type_str(node, options, field):
+    return f":void #| {node.spelling} |#"
+
+def _unsupported_type_str(node, options, field):
+    raise node.error
+
+_lisp_type_str._render_table = {
+    ir.TypedefType         : _typedef_type_str,
+    ir.RecordType          : _record_type_str,
+    ir.EnumType            : _enum_type_str,
+    ir.PointerType         : _pointer_type_str,
+    ir.FunctionPointerType : _function_pointer_type_str,
+    ir.ArrayType           : _array_type_str,
+    ir.FunctionType        : _function_type_str,
+    ir.Unsupported         : _unsupported_type_str,
+}
+
+def _output_unknown_macro_def(spelling, node, output):
+    logging.warn(f'Could not transform macro {node.spelling}', location=node.location)
     output.write("#| MACRO_DEFINITION\n")
     output.write(f"(defconstant {spelling} ACTUAL_VALUE_HERE)\n")
     output.write("|#\n\n")
 
-def _process_macro_def(cursor, data, output, options):
-    spelling = _mangle_string(cursor.spelling, options.constant_manglers)
-    # first token is always the macro name, so we can skip it.
-    tokens = [i for i in itertools.islice(cursor.get_tokens(), 1, 3)]
-    if len(tokens) > 1:
-        _output_unknown_macro_def(spelling, cursor, output)
-    elif len(tokens) == 1:
-        if tokens[0].kind.name == 'LITERAL':
-            try:
-                cl_literal = macro_util.convert_literal_token(tokens[0])
-                output.write(f"(defconstant {spelling} {cl_literal})\n\n")
-            except macro_util.LiteralConversionError:
+def _process_macro_def(node, data, output, options):
+    spelling = _lisp_name(node, options)
+    tokens = node.tokens
+    if len(tokens) == 1 and tokens[0].kind == 'LITERAL':
+        try:
+            cl_literal = macro_util.convert_literal_token(tokens[0])
+            output.write(f"(defconstant {spelling} {cl_literal})\n\n")
+            return
+        except macro_util.LiteralConversionError:
+            if node.value is None:
                 logging.error(f"Could not convert C literal `{tokens[0].spelling}` to CL literal")
-                _output_unknown_macro_def(spelling, cursor, output)
+    if node.value is not None:
+        output.write(f"(defconstant {spelling} {macro_util.convert_value(node.value)})\n\n")
+    elif tokens or not macro_util.header_guard_p(node.location.file, node.spelling,
+                                                 options.macro_detector):
+        _output_unknown_macro_def(spelling, node, output)
+
+def _process_inner_declaration(node, inner_name, output, options, found_records):
+    """ Output the declaration of an anonymous field's type, returning the field's type """
+    if isinstance(node, ir.Enum):
+        _process_realized_enum(inner_name, node, output, options, as_constants=True)
+        if node.underlying is not None:
+            return f"{inner_name} #| {_lisp_type_str(node.underlying, options)} |#"
+        return inner_name
+    elif isinstance(node, ir.Record):
+        _process_record(inner_name, node, output, options, found_records)
+        if node.is_union:
+            return "(:union " + inner_name + ")"
         else:
-            _output_unknown_macro_def(spelling, cursor, output)
-    elif not macro_util.is_header_guard(cursor, options.macro_detector):
-        _output_unknown_macro_def(spelling, cursor, output)
+            return "(:struct " + inner_name + ")"
+    elif isinstance(node, ir.Unsupported):
+        raise node.error
+    return None
 
-def _extract_record_fields(name, cursor, text_stream, output, options, found_records):
-    this_type = cursor.type
+def _process_record_fields(name, node, text_stream, output, options, found_records):
     anon_count = 0
-    for field in this_type.get_fields():
+    for field in node.fields:
         field_name = _mangle_string(field.spelling, options.name_manglers)
-        if _is_anonymous_record_decl(field):
+        if field.is_anonymous_record:
             field_name = 'anon-' + str(anon_count)
             anon_count = anon_count + 1
-        if field.is_anonymous():
+        if field.type is None:
             inner_name = name + '-' + field_name
-            if field.type.kind == clang.TypeKind.ELABORATED:
-                field_type = _determine_elaborated_field(field, inner_name, output, options, found_records)
-            elif field.type.kind == clang.TypeKind.RECORD:
-                field_type = _determine_decl_field(field, inner_name, output, options, found_records)
-            elif field.type.kind == TypeKind.ENUM:
-                field_type = _determine_elaborated_field(field, inner_name, output, options, found_records)
-            else:
-                raise ProcessingError("Uknown typekind: " + str(field.type.kind),
-                                      cursor.location)
+            field_type = _process_inner_declaration(field.inner, inner_name, output, options,
+                                                    found_records)
         else:
-            field_type = _cursor_lisp_type_str(field.type, options, cursor.location, field=True)
+            field_type = _lisp_type_str(field.type, options, field=True)
         text_stream.write(f"\n  ({field_name} {field_type})")
 
-def _process_record(name, actual_type, cursor, output, options, found_records: set):
+def _process_record(name, node, output, options, found_records: set):
     # If we have seen this type before and there are no fields,
     # don't output anything:
-    if not cursor.is_definition() and name in found_records:
+    if not node.is_definition and name in found_records:
         # TODO: Duplicate definitions of structs aren't allowed by the spec.
 	#  maybe we can detect that? As of version 20, clang doesn't give us an error.
         return
     found_records.add(name)
 
     text_stream = io.StringIO()
-    if actual_type == _ElaboratedType.UNION:
+    if node.is_union:
         text_stream.write(f"(cffi:defcunion {name}")
-    elif actual_type == _ElaboratedType.STRUCT:
-        text_stream.write(f"(cffi:defcstruct {name}")
     else:
-        raise ProcessingError(f"Don't know how to handled actual type {actual_type}")
+        text_stream.write(f"(cffi:defcstruct {name}")
 
-    _output_comment(cursor, text_stream, before='\n',after='')
-    if cursor.is_definition():
-        _extract_record_fields(name, cursor,text_stream, output, options, found_records)
+    _output_comment(node.comment, text_stream, before='\n',after='')
+    if node.is_definition:
+        _process_record_fields(name, node, text_stream, output, options, found_records)
 
     text_stream.write(")\n\n")
     output.write(text_stream.getvalue())
     text_stream.close()
 
-def _process_struct_decl(cursor, data: _ParseData, output, options):
-    name = cursor.spelling
-    if name:
-        mangled_name = _mangle_string(name, options.type_manglers)
-        _process_record(mangled_name, _ElaboratedType.STRUCT, cursor, output,
-                        options, data.found_records)
-    else:
-        data.skipped_records[cursor.hash] = (_ElaboratedType.STRUCT, cursor)
-
-def _process_union_decl(cursor, data: _ParseData, output, options):
-    name = cursor.spelling
-    if name:
-        mangled_name = _mangle_string(name, options.type_manglers)
-        _process_record(mangled_name, _ElaboratedType.UNION, cursor, output,
-                        options, data.found_records)
+def _process_record_decl(node, data: _ParseData, output, options):
+    if node.spelling:
+        _process_record(_lisp_name(node, options), node, output, options, data.found_records)
     else:
-        data.skipped_records[cursor.hash] = (_ElaboratedType.UNION, cursor)
+        data.skipped_records[node.decl_id] = node
 
-def _process_realized_enum(name, cursor, output, options, as_constants=False):
-    if _explicitly_typed_enum_p(cursor):
-        type_name = _cursor_lisp_type_str(cursor.enum_type, options, cursor.location)
+def _process_realized_enum(name, node, output, options, as_constants=False):
+    if node.underlying is not None:
+        type_name = _lisp_type_str(node.underlying, options)
         output.write(f"(cffi:defcenum ({name} {type_name})")
     else:
         output.write(f"(cffi:defcenum {name}")
 
-    _output_comment(cursor, output, before='\n',after='')
+    _output_comment(node.comment, output, before='\n',after='')
 
     if as_constants or options.enum_constant_p(name):
         manglers = options.constant_manglers
     else:
         manglers = options.enum_manglers
-    for field in cursor.get_children():
-        if as_constants:
-            name = _mangle_string(field.spelling, manglers)
-        else:
-            name = _mangle_string(field.spelling, manglers)
-
-        output.write(f"\n  ({name} {field.enum_value})")
+    for (spelling, value) in node.constants:
+        name = _mangle_string(spelling, manglers)
+        output.write(f"\n  ({name} {value})")
     output.write(")\n\n")
 
-def _process_enum_as_constants(cursor, output, options):
-    for field in cursor.get_children():
-        field_name = _mangle_string(field.spelling, options.constant_manglers)
-        output.write(f"(defconstant {field_name} {field.enum_value})\n")
+def _process_enum_as_constants(node, output, options):
+    for (spelling, value) in node.constants:
+        field_name = _mangle_string(spelling, options.constant_manglers)
+        output.write(f"(defconstant {field_name} {value})\n")
     output.write("\n")
 
-def _process_enum_decl(cursor, data, output, options):
-    name = cursor.spelling
+def _anon_enum_name():
+    number = _process_enum_decl.anon_count
+    _process_enum_decl.anon_count = number + 1
+    if _process_enum_decl.placeholder_names:
+        return f'\0anon-enum-{number}\0'
+    else:
+        return f'anon-enum-{number}'
+
+def _process_enum_decl(node, data, output, options):
+    name = node.spelling
     if name:
-        if cursor.is_anonymous():
+        if node.is_anonymous:
             # Although we could just emit a constant here,
             # CFFI might need to do something to the definition
             # because it's an enum. To be safe, emit that too. It won't
             # affect the API at all.
-            name = f'anon-enum-{_process_enum_decl.anon_count}'
-            _process_enum_decl.anon_count = _process_enum_decl.anon_count + 1
-            _process_realized_enum(name, cursor, output, options, as_constants=True)
+            _process_realized_enum(_anon_enum_name(), node, output, options, as_constants=True)
         else:
-            name = _mangle_string(name, options.type_manglers)
-            _process_realized_enum(name, cursor, output, options, as_constants=False)
+            _process_realized_enum(_lisp_name(node, options), node, output, options,
+                                   as_constants=False)
     else:
-        data.skipped_enums[cursor.hash] = cursor
+        data.skipped_enums[node.decl_id] = node
 _process_enum_decl.anon_count = 0
+# Anonymous enums are numbered across everything processed by this process.
+# When the number of anonymous enums output before the current output isn't
+# known yet, render_headers is asked to use placeholder names instead, see
+# _number_anon_enums:
+_process_enum_decl.placeholder_names = False
 
-def _use_string_ret_type(name, ret_type, options):
-    kind = ret_type.kind
-    if kind == TypeKind.POINTER:
-        pointee_type = ret_type.get_pointee()
-
-        if pointee_type.kind == TypeKind.CHAR_S or pointee_type.kind == TypeKind.CHAR_U:
-            return options.return_str_p(name)
-    return False
-
-def _process_func_decl(cursor, data, output, options):
-    name = cursor.spelling
-    # mangle function names the same way as typenames:
-    mangled_name = _mangle_string(name, options.type_manglers)
+def _process_func_decl(node, data, output, options):
+    name = node.spelling
+    mangled_name = _lisp_name(node, options)
 
-    ret_type = cursor.result_type
-    if _use_string_ret_type(name, ret_type, options):
+    if node.returns_char_pointer and options.return_str_p(name):
         lisp_ret_type = ':string'
     else:
-        lisp_ret_type = _cursor_lisp_type_str(ret_type, options, cursor.location)
+        lisp_ret_type = _lisp_type_str(node.result, options)
 
     [inline, feature] = options.declaim_inline_p(name)
     if inline:
@@ -491,90 +837,164 @@ def _process_func_decl(cursor, data, output, options):
         output.write(f'"{name}"')
     output.write(f" {lisp_ret_type}")
 
-    _output_comment(cursor, output, before='\n',after='')
+    _output_comment(node.comment, output, before='\n',after='')
 
-    for arg in cursor.get_arguments():
-        arg_name = arg.spelling
+    for (arg_name, arg_type) in node.arguments:
         if arg_name == "" or arg_name is None:
             arg_name = "unknown"
-        else:
-            arg_name = arg.spelling
 
-        arg_type_name = _cursor_lisp_type_str(arg.type, options, cursor.location)
+        arg_type_name = _lisp_type_str(arg_type, options)
         arg_mangled_name = _mangle_string(arg_name, options.name_manglers)
 
         output.write(f"\n  ({arg_mangled_name} {arg_type_name})")
 
     output.write(")\n\n")
 
-def _expand_skipped_type(name, s_type, data, output, options):
+def _expand_skipped_type(name, decl_id, data, output, options):
     """ Expand the skipped type and return its string representation
 
     If the type has already been expanded, return None
     """
-    base_decl = s_type.get_declaration()
-    base_decl_hash = base_decl.hash
     base_type_name = None
     # Ensure that the type we are typdefing wasn't skipped:
-    if base_decl_hash in data.skipped_enums:
-        del data.skipped_enums[base_decl_hash]
+    if decl_id in data.skipped_enums:
+        enum = data.skipped_enums.pop(decl_id)
         base_type_name = name.replace('_', '-') + "-enum"
-        _process_realized_enum(base_type_name, base_decl, output, options)
+        _process_realized_enum(base_type_name, enum, output, options)
     else:
-        decl_type = data.skipped_records.get(base_decl_hash)
-        if decl_type:
-            del data.skipped_records[base_decl_hash]
+        record = data.skipped_records.pop(decl_id, None)
+        if record:
             base_type_str = name.replace('_', '-') + "-record"
-            _process_record(base_type_str, decl_type[0], base_decl, output, options)
-            if decl_type[0] == _ElaboratedType.UNION:
+            _process_record(base_type_str, record, output, options, data.found_records)
+            if record.is_union:
                 base_type_name = f"(:union {base_type_str})"
             else:
                 base_type_name = f"(:struct {base_type_str})"
     return base_type_name
 
 
-def _process_typedef_decl(cursor, data, output, options):
-    name = cursor.spelling
-    underlying_type = cursor.underlying_typedef_type
-    base_type_name = _expand_skipped_type(name, underlying_type, data, output, options)
+def _process_typedef_decl(node, data, output, options):
+    name = node.spelling
+    base_type_name = _expand_skipped_type(name, node.underlying_decl_id, data, output, options)
     if not base_type_name:
-        base_type_name = _cursor_lisp_type_str(underlying_type, options, cursor.location)
-    mangled_name = _mangle_string(cursor.spelling,
-                                                     options.typedef_manglers)
+        base_type_name = _lisp_type_str(node.underlying, options)
+    mangled_name = _lisp_name(node, options)
     output.write(f"(cffi:defctype {mangled_name} {base_type_name})\n\n")
 
-def _no_op(cursor, data, output, options):
-    pass
-
-def _process_var_decl(cursor, data, output, options):
-    name = cursor.spelling
-    underlying_type = cursor.type
-    base_type_name = _expand_skipped_type(name, underlying_type, data, output, options)
+def _process_var_decl(node, data, output, options):
+    name = node.spelling
+    base_type_name = _expand_skipped_type(name, node.type_decl_id, data, output, options)
     if not base_type_name:
-        base_type_name = _cursor_lisp_type_str(underlying_type, options, cursor.location)
-    if underlying_type.is_const_qualified():
-        mangled_name = _mangle_string(name, options.constant_manglers)
-        output.write(f'(cffi:defcvar ("{cursor.spelling}" {mangled_name} :read-only t) {base_type_name}')
+        base_type_name = _lisp_type_str(node.type, options)
+    mangled_name = _lisp_name(node, options)
+    if node.is_const:
+        output.write(f'(cffi:defcvar ("{name}" {mangled_name} :read-only t) {base_type_name}')
     else:
-        mangled_name = _mangle_string(name, options.name_manglers)
-        output.write(f'(cffi:defcvar ("{cursor.spelling}" {mangled_name}) {base_type_name}')
-    _output_comment(cursor, output, before='\n',after='')
+        output.write(f'(cffi:defcvar ("{name}" {mangled_name}) {base_type_name}')
+    _output_comment(node.comment, output, before='\n',after='')
     output.write(')\n\n')
 
 
-def _unrecognized_cursorkind(cursor):
-    logging.warn(f'Not processing {cursor.kind}', location=cursor.location, end='\n\n')
+def _unrecognized_cursorkind(node):
+    logging.warn(f'Not processing {node.kind}', location=node.location, end='\n\n')
+
+def _declaration_included(node, options):
+    if options.declaration_p(node.spelling):
+        return True
+    # Unnamed records and enums are output as part of the typedef or
+    # declaration that uses them, so they can't be excluded by name:
+    return isinstance(node, _declaration_included._unnamed_kinds) and node.is_anonymous
+_declaration_included._unnamed_kinds = (ir.Record, ir.Enum)
+
+def _process_header(header, output, options, found_records: set, filtered=False):
+    """ Write the output for the declarations of an ir.Header
+
+    `found_records` holds the names of the records output by previous headers.
+    `filtered` is true if the declarations excluded by the options were
+    already skipped when the header was extracted.
+    """
+    data = _ParseData(found_records=found_records)
+    output.write(f";; next section imported from file {header.path}\n\n")
+
+    for node in header.declarations:
+        if not filtered and not _declaration_included(node, options):
+            continue
+        handler_func = _process_header._visit_table.get(type(node))
+        if handler_func:
+            handler_func(node, data, output, options)
+        else:
+            _unrecognized_cursorkind(node)
+
+    # Once the file has been processed, if there are unused enums, output them as constants:
+    for node in data.skipped_enums.values():
+        _process_enum_as_constants(node, output, options)
+    # issue warnings for anonymus structs:
+    for node in data.skipped_records.values():
+        if node.is_union:
+            logging.warn("Skipped unamed union decl", location=node.location)
+        else:
+            logging.warn("Skipped unamed struct decl", location=node.location)
+
+_process_header._visit_table = {
+    ir.Macro   : _process_macro_def,
+    ir.Record  : _process_record_decl,
+    ir.Enum    : _process_enum_decl,
+    ir.Function: _process_func_decl,
+    ir.Typedef : _process_typedef_decl,
+    ir.Var     : _process_var_decl,
+}
 
-def _process_file(filepath, output, options, found_records):
+_PARSE_OPTIONS = (clang.TranslationUnit.PARSE_DETAILED_PROCESSING_RECORD
+                  | clang.TranslationUnit.PARSE_SKIP_FUNCTION_BODIES)
+
+def _shared_index():
+    """ Return the clang.Index used to parse every file, creating it the first time it is needed """
+    if _shared_index.index is None:
+        _shared_index.index = clang.Index.create()
+    return _shared_index.index
+
+_shared_index.index = None
+
+def _parse_translation_unit(filepath, options, unsaved_files=None):
+    """ Parse the file, using the translation unit store or cache if one is configured """
+    index = _shared_index()
+    _use_given_names({})
+    if options.translation_units is not None:
+        return options.translation_units.parse(index, filepath, options.arguments,
+                                               _PARSE_OPTIONS, unsaved_files)
+    if not options.cache_dir:
+        return index.parse(filepath, args=options.arguments, unsaved_files=unsaved_files,
+                           options=_PARSE_OPTIONS)
+
+    tu_cache = cache.TranslationUnitCache(options.cache_dir, clang.conf.get_filename())
+    key = tu_cache.key(filepath, options.arguments, _PARSE_OPTIONS, unsaved_files or ())
+    tu = tu_cache.load(index, key)
+    if tu:
+        # Saved translation units refer to every file by its absolute path,
+        # so use the names the files had when it was parsed instead, to
+        # keep the output the same as when the file is parsed:
+        names = tu_cache.file_names(key)
+        names[os.path.abspath(filepath)] = filepath
+        _use_given_names({path: name for (path, name) in names.items() if path != name})
+        return tu
+    tu = index.parse(filepath, args=options.arguments, unsaved_files=unsaved_files,
+                     options=_PARSE_OPTIONS)
+    # Diagnostics aren't saved with the translation unit, so only cache
+    # translation units that don't have any:
+    if not tu.diagnostics:
+        try:
+            tu_cache.store(key, tu)
+        except (clang.TranslationUnitSaveError, OSError) as err:
+            logging.warn(f'Could not cache the translation unit for {filepath}: {err}')
+    return tu
+
+def _check_input_file(filepath):
     if os.path.isdir(filepath):
         raise IsADirectoryError(errno.EISDIR, filepath)
     elif not os.path.isfile(filepath):
         raise FileNotFoundError(errno.ENOENT, filepath)
 
-    index = clang.Index.create()
-    tu = index.parse(filepath, args=options.arguments,
-                     options=clang.TranslationUnit.PARSE_DETAILED_PROCESSING_RECORD|clang.TranslationUnit.PARSE_SKIP_FUNCTION_BODIES)
-
+def _check_diagnostics(filepath, tu, options):
     diagnostics = tu.diagnostics
     if diagnostics:
         errors = []
@@ -588,72 +1008,304 @@ def _process_file(filepath, output, options, found_records):
                      sep='\n',
                      end='\n\n')
 
-    root_cursor = tu.cursor
-    data = _ParseData(found_records=found_records)
+def _reset_type_caches():
+    """ Clear the cached type nodes and file names, which are only valid for a single translation unit """
+    _cursor_location._file_names.clear()
+    _extract_type_node._cache.clear()
+    _extract_enum_type._cache.clear()
+    _explicitly_typed_enum_p._cache.clear()
 
-    for child in root_cursor.get_children():
-        location = child.location
-        if location.file and location.file.name == filepath:
-            handler_func = _process_file._visit_table.get(child.kind)
-            if handler_func:
-                handler_func(child, data, output, options)
-            else:
-                _unrecognized_cursorkind(child)
+def _tu_dependencies(tu):
+    return [_given_name(inclusion.include.name) for inclusion in tu.get_includes()]
 
-    # Once the file has been processed, if there are unused enums, output them as constants:
-    for cursor in data.skipped_enums.values():
-        _process_enum_as_constants(cursor, output, options)
-    # issue warnings for anonymus structs:
-    for (type, cursor) in data.skipped_records.values():
-        if type == _ElaboratedType.STRUCT:
-            logging.warn("Skipped unamed struct decl", location=location)
-        else:
-            logging.warn("Skipped unamed union decl", location=location)
-
-    return data.found_records
-_process_file._visit_table = {
-    clang.CursorKind.MACRO_DEFINITION    : _process_macro_def,
-    clang.CursorKind.STRUCT_DECL         : _process_struct_decl,
-    clang.CursorKind.ENUM_DECL           : _process_enum_decl,
-    clang.CursorKind.FUNCTION_DECL       : _process_func_decl,
-    clang.CursorKind.TYPEDEF_DECL        : _process_typedef_decl,
-    clang.CursorKind.UNION_DECL          : _process_union_decl,
-    clang.CursorKind.VAR_DECL            : _process_var_decl,
-    clang.CursorKind.INCLUSION_DIRECTIVE : _no_op,
-    clang.CursorKind.MACRO_INSTANTIATION : _no_op,
-}
+def _file_id(file: clang.File):
+    """ Return a value that identifies `file` within its translation unit
 
-def process_file(filepath, options):
-    process_files([filepath], options)
+    This is much cheaper than getting the file's name.
+    """
+    return ctypes.cast(file.obj, ctypes.c_void_p).value
+
+def _main_file_cursors(tu):
+    """ Return the top-level cursors of the translation unit's main file """
+    # The translation unit may refer to the file by its absolute path:
+    main_file = _file_id(tu.get_file(tu.spelling))
+    cursors = []
+    for child in tu.cursor.get_children():
+        child_file = child.location.file
+        if child_file and _file_id(child_file) == main_file:
+            cursors.append(child)
+    return cursors
+
+def _header_cache(options):
+    """ Return the cache of extracted headers to use, or None """
+    if not options.cache_dir or options.translation_units is not None:
+        return None
+    return cache.HeaderCache(options.cache_dir, clang.conf.get_filename(), ir.VERSION)
+
+def _extraction_filter(options):
+    """ Return the `declaration_p` to skip declarations with while extracting them, or None
+
+    Cached headers must hold every declaration, since the options used to
+    render them may be different. When roots are given, the excluded
+    declarations are still needed to find the ones reachable from them.
+    """
+    if _header_cache(options) or options.root_p:
+        return None
+    return options.declaration_p
 
-def process_files(files, options):
-    """ Process the given files using the given options
+def _extraction_options(options):
+    """ The options other than the parse options that change what is extracted """
+    return {'evaluate-macros': options.evaluate_macros}
 
-    If a file in the list isn't found, nothing will be written to the output file.
+def _extract_file(filepath, options, declaration_p=None, on_extracted=None):
+    """ Parse the given file and extract its declarations, returning an ir.Header
+
+    If `declaration_p` is given, only the declarations it accepts are
+    extracted. If `on_extracted` is given, it is called with the cursor and
+    the node of each declaration, see _extract_declarations. The header
+    cache isn't used in either case.
+    """
+    _check_input_file(filepath)
+    header_cache = None if declaration_p or on_extracted else _header_cache(options)
+    if header_cache:
+        key = header_cache.key(filepath, options.arguments, _PARSE_OPTIONS,
+                               extraction=_extraction_options(options))
+        data = header_cache.load(key)
+        if data:
+            try:
+                return ir.loads(data)
+            except (pickle.UnpicklingError, EOFError, AttributeError, ValueError) as err:
+                # The entry is corrupt or was saved by another version
+                logging.warn(f'Could not load the cached declarations of {filepath}: {err}')
+
+    tu = _parse_translation_unit(filepath, options)
+    _check_diagnostics(filepath, tu, options)
+    _reset_type_caches()
+
+    _extract_macro_def.evaluate = options.evaluate_macros
+    declarations = _extract_declarations(_main_file_cursors(tu), declaration_p, on_extracted)
+    if options.evaluate_macros:
+        _evaluate_macros([filepath], declarations, options)
+    header = ir.Header(filepath, declarations, [filepath] + _tu_dependencies(tu))
+    # Diagnostics are only reported when the file is parsed, so only cache
+    # headers that don't have any:
+    if header_cache and not tu.diagnostics:
+        try:
+            header_cache.store(key, ir.dumps(header), header.dependencies[1:])
+        except (pickle.PicklingError, OSError) as err:
+            logging.warn(f'Could not cache the declarations of {filepath}: {err}')
+    return header
+
+# The name of the header that includes every file when using an umbrella
+# translation unit. It is only passed to clang as an unsaved file.
+_UMBRELLA_HEADER = '__cl_bindgen_umbrella__.h'
+
+def _include_path(includer, spelling):
+    """ Return the name clang gives the file included as `spelling` when it is found next to `includer` """
+    return os.path.join(os.path.dirname(includer) or '.', spelling)
+
+def _umbrella_dependencies(filepath, key, inclusions, names):
+    """ Return the names of the files included by `filepath` in an umbrella translation unit
+
+    Returns a dictionary from the key of each file to the name it would have
+    if `filepath` were parsed by itself, in the order they're included.
+    `key` is the key of `filepath`, `inclusions` maps the key of each file
+    to the (spelling, key) pairs of the files it includes, and `names` maps
+    the keys to the names of the files in the translation unit. The umbrella
+    header is one directory above the inputs as far as clang is concerned,
+    so the names of the files found next to the file including them are
+    different.
     """
+    given_names = {key: filepath}
+    stack = [(key, iter(inclusions[key]))]
+    while stack:
+        (includer, includes) = stack[-1]
+        for (spelling, included) in includes:
+            if included not in given_names:
+                name = names[included]
+                if name == _include_path(names[includer], spelling):
+                    name = _include_path(given_names[includer], spelling)
+                given_names[included] = name
+                stack.append((included, iter(inclusions[included])))
+                break
+        else:
+            stack.pop()
+    return given_names
+
+def _extract_umbrella(files, options, declaration_p=None):
+    """ Extract the files' declarations using a single translation unit that includes all of them
+
+    Returns an ir.Header for each file, the same as _extract_file would, or
+    None if the translation unit has errors, since they may come from the
+    files conflicting with each other. `declaration_p` is used as by
+    `_extract_file`.
+    """
+    for f in files:
+        _check_input_file(f)
+    distinct_files = list(dict.fromkeys(files))
+    contents = ''.join(f'#include "{f}"\n' for f in distinct_files)
+    tu = _parse_translation_unit(_UMBRELLA_HEADER, options,
+                                 unsaved_files=[(_UMBRELLA_HEADER, contents)])
+    if any(diag.severity >= clang.Diagnostic.Error for diag in tu.diagnostics):
+        logging.warn('errors occured while parsing the files as a single translation unit,',
+                     'so they are parsed separately instead.')
+        return None
+    _check_diagnostics(_UMBRELLA_HEADER, tu, options)
+    _reset_type_caches()
+
+    # The same file can have several clang.Files with different names, e.g.
+    # when the translation unit was loaded from the cache, so the files are
+    # told apart by their real paths instead:
+    clang_names = {}
+    keys = {}
+    def file_key(file):
+        file_id = _file_id(file)
+        key = keys.get(file_id)
+        if key is None:
+            clang_names[file_id] = file.name
+            key = keys[file_id] = os.path.realpath(clang_names[file_id])
+        return key
+
+    inclusions = collections.defaultdict(list)
+    names = {}
+    file_cursors = collections.defaultdict(list)
+    for child in tu.cursor.get_children():
+        child_file = child.location.file
+        if child_file is None:
+            continue
+        if child.kind == CursorKind.INCLUSION_DIRECTIVE:
+            included = child.get_included_file()
+            if included is not None:
+                key = file_key(included)
+                # Files are named the way they were first included:
+                names.setdefault(key, _given_name(included.name))
+                inclusions[file_key(child_file)].append((child.spelling, key))
+        else:
+            file_cursors[file_key(child_file)].append(child)
+
+    # The umbrella header includes each file once, in order:
+    input_keys = dict(zip(distinct_files,
+                          (key for (_, key) in inclusions[os.path.realpath(tu.spelling)])))
+    given_names = {f: _umbrella_dependencies(f, key, inclusions, names)
+                   for (f, key) in input_keys.items()}
+    # Each file is named the way the first input including it names it:
+    first_names = {}
+    for f in distinct_files:
+        for (key, name) in given_names[f].items():
+            first_names.setdefault(key, name)
+    _use_given_names({**_given_name.names,
+                      **{clang_names[file_id]: first_names[key] for (file_id, key) in keys.items()
+                         if first_names.get(key, clang_names[file_id]) != clang_names[file_id]}})
+
+    _extract_macro_def.evaluate = options.evaluate_macros
+    declarations = {key: _extract_declarations(file_cursors[key], declaration_p)
+                    for key in dict.fromkeys(input_keys.values())}
+    if options.evaluate_macros:
+        _evaluate_macros(distinct_files, [node for nodes in declarations.values() for node in nodes],
+                         options)
+    return [ir.Header(f, declarations[input_keys[f]], list(given_names[f].values()))
+            for f in files]
+
+def _extract_headers(files, options, declaration_p=None):
+    """ Yield an ir.Header for each file, see extract_files and _extract_file """
+    if options.umbrella and len(files) > 1:
+        headers = _extract_umbrella(files, options, declaration_p)
+        if headers is not None:
+            yield from headers
+            return
+    yield from parallel.imap_forked(functools.partial(_extract_file, options=options,
+                                                      declaration_p=declaration_p),
+                                    files, options.jobs)
+
+def extract_files(files, options):
+    """ Parse the given files and extract their declarations, returning an ir.Header for each
+
+    Only the options that affect parsing are used: `arguments`, `force`,
+    `jobs`, `umbrella`, `cache_dir`, `translation_units` and
+    `evaluate_macros`. When
+    `options.cache_dir` is set, the extracted declarations are cached there
+    as well, so files that haven't changed aren't parsed again.
+    """
+    return list(_extract_headers(files, options))
+
+def render_headers(headers, options, filtered=False, placeholder_names=False):
+    """ Write the bindings for the given ir.Headers to the output given in the options
+
+    Nothing is written if an error occurs. Returns a sorted list of the
+    files the output depends on. If `options.depfile` is set, they are also
+    written to a make-style dependency file.
 
+    If `options.root_p` is set, only the declarations reachable from the
+    roots it accepts are output, see the reachability module. All of the
+    headers are needed to find them, so nothing is output until every
+    header has been extracted.
+
+    `filtered` is true if the headers were extracted with
+    `options.declaration_p`, so they only hold the declarations to output.
+    If `placeholder_names` is true, anonymous enums are given placeholder
+    names instead of being numbered, see `_number_anon_enums`.
+    """
     # do a santity check on the output before doing all of that processing:
     if os.path.isdir(options.output):
         raise IsADirectoryError(errno.EISDIR, options.output)
 
-    output = io.StringIO()
-    actual_output = None
-    found_records = set()
+    dependencies = set()
+    if options.root_p:
+        headers = list(headers)
+        for header in headers:
+            dependencies.update(header.dependencies)
+        headers = reachability.prune_headers(headers, options.root_p)
 
-    if options.package:
-        output.write(f'(cl:in-package #:{options.package})\n\n')
+    # The mangler lists may have changed since the last run:
+    _mangle_string._pipelines.clear()
 
+    output = _OutputWriter(options, placeholder_names)
+    _process_enum_decl.placeholder_names = placeholder_names
     try:
-        for f in files:
-            output.write(f";; next section imported from file {f}\n\n")
-            found_records = _process_file(f, output, options, found_records)
+        if options.package:
+            output.write(f'(cl:in-package #:{options.package})\n\n')
+
+        found_records = set()
+        for header in headers:
+            _process_header(header, output, options, found_records, filtered)
+            dependencies.update(header.dependencies)
+
+        output.commit()
+    except BaseException:
+        output.abort()
+        raise
+    finally:
+        _process_enum_decl.placeholder_names = False
+        _lisp_type_str._cache.clear()
+    dependencies = sorted(dependencies)
+    if depfile_path := ProcessOptions.depfile_path(options):
+        depfile.write_depfile(depfile_path, options.output, dependencies)
+    return dependencies
 
-        actual_output = ProcessOptions.output_file_from_option(options, 'w')
+def process_file(filepath, options):
+    return process_files([filepath], options)
 
-        output_text = output.getvalue().rstrip()
-        actual_output.write(output_text)
-        actual_output.write('\n')
-    finally:
-        output.close()
-        if actual_output and not (actual_output == sys.stderr or actual_output == sys.stdout):
-            actual_output.close()
+def process_files(files, options, placeholder_names=False):
+    """ Process the given files using the given options
+
+    If a file in the list isn't found, nothing will be written to the output file.
+    When `options.jobs` is greater than one, the files are parsed in separate
+    processes. The output is the same as when they are processed one at a time.
+    When `options.stream_output` is true, the output is written to a temporary
+    file as it is generated instead of being kept in memory.
+    When `options.umbrella` is true, the files are instead parsed together as
+    one translation unit, so headers they have in common are only parsed once.
+
+    This is the same as passing the result of `extract_files` to
+    `render_headers`, except that each file is output as soon as it has been
+    extracted.
+
+    `placeholder_names` is passed to `render_headers`.
+
+    Returns a sorted list of the files the output depends on: the given files
+    and every file they include.
+    """
+    declaration_p = _extraction_filter(options)
+    return render_headers(_extract_headers(files, options, declaration_p), options,
+                          filtered=declaration_p is not None,
+                          placeholder_names=placeholder_names)
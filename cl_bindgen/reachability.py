@@ -0,0 +1,134 @@
+""" Prune extracted headers down to the declarations reachable from a set of roots
+
+The functions, variables and macros whose names are accepted by a root
+predicate are kept, along with every struct, union, enum and typedef their
+types refer to, directly or through other types, in any of the headers.
+Everything else is dropped.
+
+Within a header, declarations keep their order: C requires types to be
+declared before they are used, so that order is already a dependency order.
+The headers themselves are reordered so that a header comes after the
+headers declaring the types it uses.
+"""
+
+import collections
+
+import cl_bindgen.ir as ir
+
+_ROOT_KINDS = (ir.Function, ir.Var, ir.Macro)
+
+def _declaration_key(node):
+    """ Return the name other declarations use to refer to `node`, or None """
+    if isinstance(node, ir.Typedef):
+        return ('typedef', node.spelling)
+    elif isinstance(node, (ir.Record, ir.Enum)) and not node.is_anonymous:
+        # Structs, unions and enums share a namespace in C:
+        return ('tag', node.spelling)
+    return None
+
+def _type_references(node, refs):
+    """ Add the keys of the declarations the type `node` refers to to `refs` """
+    while node is not None:
+        node_type = type(node)
+        if node_type is ir.TypedefType:
+            refs.append(('typedef', node.spelling))
+            return
+        elif node_type is ir.RecordType:
+            refs.append(('tag', node.spelling))
+            return
+        elif node_type is ir.EnumType:
+            refs.append(('tag', node.spelling))
+            node = node.underlying
+        elif node_type is ir.PointerType:
+            node = node.pointee
+        elif node_type is ir.ArrayType:
+            node = node.element
+        else:
+            return
+
+def _record_references(node, refs):
+    for field in node.fields or ():
+        _type_references(field.type, refs)
+        inner = field.inner
+        if isinstance(inner, ir.Record):
+            _record_references(inner, refs)
+        elif isinstance(inner, ir.Enum):
+            _type_references(inner.underlying, refs)
+
+def _references(node):
+    """ Return the keys and declaration ids of the declarations `node` depends on """
+    refs = []
+    ids = []
+    if isinstance(node, ir.Function):
+        _type_references(node.result, refs)
+        for (_, arg_type) in node.arguments:
+            _type_references(arg_type, refs)
+    elif isinstance(node, ir.Var):
+        _type_references(node.type, refs)
+    elif isinstance(node, ir.Typedef):
+        _type_references(node.underlying, refs)
+        # Unnamed records and enums are output by the typedefs naming them:
+        ids.append(node.underlying_decl_id)
+    elif isinstance(node, ir.Record):
+        _record_references(node, refs)
+    elif isinstance(node, ir.Enum):
+        _type_references(node.underlying, refs)
+    return (refs, ids)
+
+def prune_headers(headers, root_p):
+    """ Return copies of `headers` with only the declarations reachable from the roots
+
+    `root_p` is called with the name of each function, variable and macro,
+    and returns whether it is a root. Headers without any reachable
+    declarations are left out, and the rest are put in dependency order.
+    """
+    # (header index, node) for every declaration by key, and by header
+    # index and id, since ids are only unique within a translation unit:
+    by_key = collections.defaultdict(list)
+    by_id = collections.defaultdict(list)
+    pending = []
+    for (index, header) in enumerate(headers):
+        for node in header.declarations:
+            if key := _declaration_key(node):
+                by_key[key].append((index, node))
+            if isinstance(node, (ir.Record, ir.Enum)):
+                by_id[(index, node.decl_id)].append((index, node))
+            if isinstance(node, _ROOT_KINDS) and root_p(node.spelling):
+                pending.append((index, node))
+
+    reachable = set()
+    # header index -> indices of the headers it depends on:
+    header_deps = collections.defaultdict(set)
+    while pending:
+        (index, node) = pending.pop()
+        if id(node) in reachable:
+            continue
+        reachable.add(id(node))
+        (refs, ids) = _references(node)
+        targets = [t for key in refs for t in by_key.get(key, ())]
+        targets.extend(t for decl_id in ids for t in by_id.get((index, decl_id), ()))
+        for (target_index, target) in targets:
+            if target_index != index:
+                header_deps[index].add(target_index)
+            if id(target) not in reachable:
+                pending.append((target_index, target))
+
+    order = []
+    visited = set()
+    def visit(index):
+        if index in visited:
+            return
+        visited.add(index)
+        for dep in sorted(header_deps[index]):
+            visit(dep)
+        order.append(index)
+    for index in range(len(headers)):
+        visit(index)
+
+    pruned = []
+    for index in order:
+        header = headers[index]
+        declarations = [node for node in header.declarations if id(node) in reachable]
+        if declarations:
+            pruned.append(ir.Header(header.path, declarations, header.dependencies))
+    return pruned
@@ -0,0 +1,172 @@
+""" A server that keeps libclang loaded between runs of cl-bindgen
+
+`serve` loads libclang, creates the clang.Index and finds clang's builtin
+headers once, then listens on a Unix socket. Each request is handled in a
+forked process that inherits that state, so requests are handled
+concurrently and can't affect each other. The results of pkg-config and
+other lookups are shared between requests through a temporary directory,
+and parsed translation units through the cache directory if one is given.
+
+A request is the arguments of a `files` or `batch` command, along with the
+client's working directory and environment. The client's stdout and stderr
+are sent with the request, so the output is written directly to them. When
+the request is finished, its exit status is sent back to the client.
+"""
+
+import json
+import os
+import shutil
+import signal
+import socket
+import socketserver
+import sys
+import tempfile
+import traceback
+
+import cl_bindgen.logging as logging
+
+_MAX_REQUEST_FDS = 2
+_RECEIVE_SIZE = 1 << 16
+_COMMANDS = ('files', 'f', 'batch', 'b')
+
+def _exit_status(code):
+    """ Return the exit status the interpreter would use for `SystemExit(code)` """
+    if code is None:
+        return 0
+    elif isinstance(code, int):
+        return code
+    print(code, file=sys.stderr)
+    return 1
+
+def _receive_request(sock):
+    data, fds, _, _ = socket.recv_fds(sock, _RECEIVE_SIZE, _MAX_REQUEST_FDS)
+    chunks = [data]
+    while not data.endswith(b'\n'):
+        data = sock.recv(_RECEIVE_SIZE)
+        if not data:
+            break
+        chunks.append(data)
+    return (json.loads(b''.join(chunks)), fds)
+
+def _run_request(request, fds, options):
+    """ Run the command described by `request` in this process, returning its exit status """
+    import cl_bindgen.util as util
+
+    sys.stdout.flush()
+    sys.stderr.flush()
+    for (fd, target) in zip(fds, (1, 2)):
+        os.dup2(fd, target)
+        os.close(fd)
+
+    argv = request['argv']
+    try:
+        os.chdir(request['cwd'])
+        os.environ.clear()
+        os.environ.update(request['env'])
+        if not argv or argv[0] not in _COMMANDS:
+            logging.error(f'The server can only run the {", ".join(_COMMANDS)} commands.')
+            return 2
+        util.dispatch_from_arguments(argv, options)
+        return 0
+    except SystemExit as err:
+        return _exit_status(err.code)
+    # Report the error to the client, as running the command locally would:
+    except Exception:  # noqa: BLE001
+        traceback.print_exc()
+        return 1
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+
+class _RequestHandler(socketserver.BaseRequestHandler):
+
+    def handle(self):
+        (request, fds) = _receive_request(self.request)
+        status = _run_request(request, fds, self.server.options)
+        self.request.sendall(f'{status}\n'.encode())
+
+class _Server(socketserver.ForkingMixIn, socketserver.UnixStreamServer):
+
+    def __init__(self, path, options):
+        self.options = options
+        socketserver.UnixStreamServer.__init__(self, path, _RequestHandler)
+
+def _remove_stale_socket(path):
+    """ Remove the socket at `path` if no server is listening on it """
+    if not os.path.exists(path):
+        return
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        try:
+            sock.connect(path)
+        except ConnectionRefusedError:
+            os.unlink(path)
+            return
+    raise FileExistsError(f'A server is already listening on "{path}"')
+
+def _warm_up(options):
+    """ Do the work every request would otherwise do itself """
+    import clang.cindex as clang
+
+    import cl_bindgen.processfile as processfile
+    import cl_bindgen.util as util
+
+    # Loads libclang:
+    _ = clang.conf.lib
+    processfile._shared_index()
+    util.find_clang_resource_dir(options.cache_dir)
+
+def _interrupt(signum, frame):
+    raise KeyboardInterrupt
+
+def serve(path, options):
+    """ Handle requests sent to the Unix socket at `path` until interrupted or terminated
+
+    `options` are the default options of each request. Unless
+    `options.cache_dir` is set, header files are parsed again by every
+    request, exactly as a local run would, and only the results of
+    pkg-config and other lookups are shared, through a temporary directory
+    that is removed when the server stops.
+    """
+    import cl_bindgen.util as util
+
+    temp_dir = None
+    if not options.cache_dir:
+        temp_dir = tempfile.mkdtemp(prefix='cl-bindgen-')
+    util._lookup_cache.default_dir = options.cache_dir or temp_dir
+    try:
+        _warm_up(options)
+        _remove_stale_socket(path)
+        with _Server(path, options) as server:
+            signal.signal(signal.SIGTERM, _interrupt)
+            try:
+                server.serve_forever()
+            except KeyboardInterrupt:
+                pass
+            finally:
+                os.unlink(path)
+    finally:
+        util._lookup_cache.default_dir = None
+        if temp_dir:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+
+def request(path, argv):
+    """ Have the server listening on `path` run cl-bindgen with `argv`, returning the exit status """
+    message = json.dumps({
+        'argv': argv,
+        'cwd': os.getcwd(),
+        'env': dict(os.environ)
+    }) + '\n'
+    sys.stdout.flush()
+    sys.stderr.flush()
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(path)
+        socket.send_fds(sock, [message.encode()], [sys.stdout.fileno(), sys.stderr.fileno()])
+        chunks = []
+        while data := sock.recv(_RECEIVE_SIZE):
+            chunks.append(data)
+    reply = b''.join(chunks)
+    try:
+        return int(reply)
+    except ValueError:
+        logging.error('The server stopped before finishing the request.')
+        return 1
@@ -0,0 +1,291 @@
+""" Collect statistics about where the time processing files goes
+
+Nothing in processfile is instrumented permanently. While `Statistics` or
+`Profile` is active, the functions of each phase and the entries of the
+extraction and rendering tables are replaced by versions that record what
+they do, and the originals are put back afterwards, so processing files
+without them costs nothing extra.
+
+While either of them is active, everything is done in the current process,
+since work done by forked processes couldn't be recorded.
+"""
+
+import collections
+import cProfile
+import functools
+import os
+import sys
+import time
+
+import cl_bindgen.cache as cache
+import cl_bindgen.parallel as parallel
+import cl_bindgen.processfile as processfile
+
+# (phase, names of the processfile functions that belong to it). The time of
+# a phase doesn't include the time spent in the other phases it calls.
+PHASES = [
+    ('parse', ['_parse_translation_unit']),
+    ('macro evaluation', ['_evaluate_macros']),
+    ('extraction', ['_extract_declarations', '_extract_unrecognized']),
+    ('tokenization', ['_extract_macro_def', '_tokenize_explicitly_typed_enum_p']),
+    ('type resolution', ['_extract_type']),
+    ('rendering', ['render_headers']),
+    ('type rendering', ['_lisp_type_str']),
+    ('mangling', ['_mangle_string']),
+]
+
+# (cache, name of the processfile function that uses it). A call that
+# doesn't add an entry to the cache is counted as a hit.
+CACHES = [
+    ('type nodes', '_extract_type_node'),
+    ('enum types', '_extract_enum_type'),
+    ('explicit enum types', '_explicitly_typed_enum_p'),
+    ('type strings', '_lisp_type_str'),
+]
+
+class _Timing:
+    __slots__ = ('count', 'seconds')
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+
+class _Patches:
+    """ Replaces attributes and dictionary entries, and puts the originals back when closed """
+
+    def __init__(self):
+        self._originals = []
+
+    def setattr(self, obj, name, value):
+        self._originals.append((setattr, obj, name, getattr(obj, name)))
+        setattr(obj, name, value)
+
+    def setitem(self, dictionary, key, value):
+        self._originals.append((dict.__setitem__, dictionary, key, dictionary[key]))
+        dictionary[key] = value
+
+    def close(self):
+        for (restore, obj, name, original) in reversed(self._originals):
+            restore(obj, name, original)
+        self._originals.clear()
+
+def _serial_only(patches):
+    patches.setattr(parallel, 'should_fork', lambda jobs, count: False)
+
+class Statistics:
+    """ Records the statistics of the files processed while it is active
+
+    Use it as a context manager, then call `report` to print the results.
+    """
+
+    def __init__(self):
+        self.phases = {phase: 0.0 for (phase, _) in PHASES}
+        # CursorKind name -> _Timing for the top-level cursors extracted:
+        self.cursors = collections.defaultdict(_Timing)
+        # ir class name -> _Timing for the declarations output:
+        self.handlers = collections.defaultdict(_Timing)
+        # cache -> [hits, misses]:
+        self.caches = {name: [0, 0] for (name, _) in CACHES}
+        self.caches['header cache'] = [0, 0]
+        self.caches['translation unit cache'] = [0, 0]
+        self.bytes_written = 0
+        self.diagnostics = 0
+        self._stack = []
+        self._patches = _Patches()
+
+    def _phase(self, phase, function):
+        stack = self._stack
+        phases = self.phases
+        @functools.wraps(function)
+        def timed(*args, **kwargs):
+            # Calls from within the same phase are already being timed:
+            if stack and stack[-1] == phase:
+                return function(*args, **kwargs)
+            stack.append(phase)
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - start
+                stack.pop()
+                phases[phase] += elapsed
+                if stack:
+                    phases[stack[-1]] -= elapsed
+        return timed
+
+    def _timed(self, timing, function):
+        @functools.wraps(function)
+        def timed(*args, **kwargs):
+            timing.count += 1
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                timing.seconds += time.perf_counter() - start
+        return timed
+
+    def _cached(self, counts, cache_dict, function):
+        @functools.wraps(function)
+        def counted(*args, **kwargs):
+            size = len(cache_dict)
+            result = function(*args, **kwargs)
+            counts[0 if len(cache_dict) == size else 1] += 1
+            return result
+        return counted
+
+    def _loaded(self, counts, function):
+        @functools.wraps(function)
+        def counted(*args, **kwargs):
+            result = function(*args, **kwargs)
+            counts[1 if result is None else 0] += 1
+            return result
+        return counted
+
+    def _install(self):
+        patches = self._patches
+        _serial_only(patches)
+
+        replaced = {}
+        for (name, fn_name) in CACHES:
+            function = getattr(processfile, fn_name)
+            replaced[fn_name] = self._cached(self.caches[name], function._cache, function)
+        for (phase, names) in PHASES:
+            for fn_name in names:
+                function = replaced.get(fn_name, getattr(processfile, fn_name))
+                replaced[fn_name] = self._phase(phase, function)
+        # The tables hold the original functions, so use the replacements in them:
+        by_original = {getattr(processfile, fn_name): function
+                       for (fn_name, function) in replaced.items()}
+        for (fn_name, function) in replaced.items():
+            patches.setattr(processfile, fn_name, function)
+
+        for (kind, function) in list(processfile._extract_declarations._extract_table.items()):
+            function = by_original.get(function, function)
+            patches.setitem(processfile._extract_declarations._extract_table, kind,
+                            self._timed(self.cursors[kind.name], function))
+        for (node_type, function) in list(processfile._process_header._visit_table.items()):
+            patches.setitem(processfile._process_header._visit_table, node_type,
+                            self._timed(self.handlers[node_type.__name__], function))
+
+        patches.setattr(cache.HeaderCache, 'load',
+                        self._loaded(self.caches['header cache'], cache.HeaderCache.load))
+        patches.setattr(cache.TranslationUnitCache, 'load',
+                        self._loaded(self.caches['translation unit cache'],
+                                     cache.TranslationUnitCache.load))
+
+        check_diagnostics = processfile._check_diagnostics
+        def counted_diagnostics(filepath, tu, options):
+            self.diagnostics += len(tu.diagnostics)
+            return check_diagnostics(filepath, tu, options)
+        patches.setattr(processfile, '_check_diagnostics', counted_diagnostics)
+
+        commit = processfile._OutputWriter.commit
+        def counted_commit(writer):
+            commit(writer)
+            output = writer.options.output
+            if output in (':stdout', ':stderr'):
+                self.bytes_written += len(writer._stream.getvalue().encode())
+            else:
+                self.bytes_written += os.path.getsize(output)
+        patches.setattr(processfile._OutputWriter, 'commit', counted_commit)
+
+    def __enter__(self):
+        try:
+            self._install()
+        except BaseException:
+            self._patches.close()
+            raise
+        return self
+
+    def __exit__(self, *exc_info):
+        self._patches.close()
+
+    def report(self, file=sys.stderr):
+        """ Print the statistics """
+        def timings(title, table):
+            print(f'{title}:', file=file)
+            for (name, timing) in sorted(table.items(), key=lambda item: -item[1].seconds):
+                if timing.count:
+                    print(f'  {name:<24} {timing.count:9} {timing.seconds:9.3f}s', file=file)
+
+        print('Phases:', file=file)
+        for (phase, seconds) in self.phases.items():
+            print(f'  {phase:<24} {seconds:19.3f}s', file=file)
+        print(f'  {"total":<24} {sum(self.phases.values()):19.3f}s', file=file)
+        timings('Top-level cursors extracted', self.cursors)
+        timings('Declarations output', self.handlers)
+        print('Caches:', file=file)
+        for (name, (hits, misses)) in self.caches.items():
+            lookups = hits + misses
+            if lookups:
+                print(f'  {name:<24} {lookups:9} lookups {hits / lookups:7.1%} hits', file=file)
+        print(f'Bytes written: {self.bytes_written}', file=file)
+        print(f'Diagnostics:   {self.diagnostics}', file=file)
+
+class _CollapsedStacks:
+    """ Records the time spent in each call stack, for flame graph tools """
+
+    def __init__(self):
+        # stack -> seconds, where the stack is the names of the functions
+        # called joined with ';':
+        self.stacks = collections.Counter()
+        self._stack = []
+        self._last = 0.0
+
+    def _event(self, frame, event, arg):
+        now = time.perf_counter()
+        stack = self._stack
+        if stack:
+            self.stacks[stack[-1]] += now - self._last
+        if event == 'call':
+            code = frame.f_code
+            name = f'{frame.f_globals.get("__name__")}.{getattr(code, "co_qualname", code.co_name)}'
+            stack.append(f'{stack[-1]};{name}' if stack else name)
+        elif event == 'c_call':
+            name = f'{getattr(arg, "__module__", None) or "builtins"}.{arg.__qualname__}'
+            stack.append(f'{stack[-1]};{name}' if stack else name)
+        elif stack:
+            # Returns from the frames that were running when recording
+            # started aren't on the stack:
+            stack.pop()
+        self._last = time.perf_counter()
+
+    def enable(self):
+        self._last = time.perf_counter()
+        sys.setprofile(self._event)
+
+    def disable(self):
+        sys.setprofile(None)
+
+    def dump_stats(self, path):
+        with open(path, 'w') as f:
+            for (stack, seconds) in sorted(self.stacks.items()):
+                if microseconds := round(seconds * 1e6):
+                    f.write(f'{stack} {microseconds}\n')
+
+class Profile:
+    """ Profiles the code run while it is active, saving the results to `path`
+
+    If `path` ends in .folded or .collapsed, the time spent in each call
+    stack is saved in microseconds, one stack per line, as used by flame
+    graph tools. Otherwise it is saved by cProfile, and can be read with
+    the pstats module.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        if path.endswith(('.folded', '.collapsed')):
+            self._profiler = _CollapsedStacks()
+        else:
+            self._profiler = cProfile.Profile()
+        self._patches = _Patches()
+
+    def __enter__(self):
+        _serial_only(self._patches)
+        self._profiler.enable()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._profiler.disable()
+        self._patches.close()
+        self._profiler.dump_stats(self.path)
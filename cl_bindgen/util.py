@@ -1,19 +1,24 @@
 import argparse
+import contextlib
 import copy
-import yaml
 import errno
-import subprocess
-import shutil
+import io
 import os.path
 import re
+import shutil
+import subprocess
+import sys
 
-import clang.cindex as clang
-
-import cl_bindgen.processfile as processfile
+# libclang, PyYAML and the modules that use them are imported by the
+# functions that need them, so that commands like --version and --help
+# start quickly.
+import cl_bindgen
 import cl_bindgen.logging as logging
-from cl_bindgen.inclusion_rules import process_inclusion_rules
 import cl_bindgen.macro_util as macro_util
 import cl_bindgen.mangler as mangler
+from cl_bindgen.exception import ParserException
+from cl_bindgen.inclusion_rules import make_batch_determiner, process_inclusion_rules
+from cl_bindgen.options import InlineRule, ProcessOptions
 
 def build_default_options():
     u_mangler =  mangler.UnderscoreMangler()
@@ -32,7 +37,7 @@ def build_default_options():
     typedef_manglers = [case_mangler, u_mangler]
     constant_manglers = [u_mangler, const_mangler]
 
-    return processfile.ProcessOptions(typedef_manglers=typedef_manglers,
+    return ProcessOptions(typedef_manglers=typedef_manglers,
                              enum_manglers=enum_manglers,
                              type_manglers=type_manglers,
                              name_manglers=name_manglers,
@@ -44,18 +49,104 @@ class BatchException(Exception):
     def __init__(self, error_string):
         Exception.__init__(self, error_string)
 
-def _process_pkg_config(pkg_names, arg_list):
-    if executable := shutil.which('pkg-config'):
-        result = subprocess.run([executable, '--cflags'] + pkg_names, capture_output=True)
+class DocumentErrors(Exception):
+    """ Raised when processing batch documents in parallel fails
+
+    `errors` holds the exception raised by each document that failed, in the
+    order the documents appear in the batch files.
+    """
+
+    def __init__(self, errors):
+        self.errors = errors
+        Exception.__init__(self, f'{len(errors)} batch documents failed')
+
+# Environment variables that change what pkg-config finds
+_PKG_CONFIG_ENVIRONMENT = ('PKG_CONFIG_PATH', 'PKG_CONFIG_LIBDIR', 'PKG_CONFIG_SYSROOT_DIR')
+
+def _lookup_cache(cache_dir):
+    """ Return the cache of external program results for `cache_dir`, shared by the whole run
+
+    When `cache_dir` isn't given, the results are saved in
+    `_lookup_cache.default_dir` if it is set.
+    """
+    import cl_bindgen.cache as cache
+
+    cache_dir = cache_dir or _lookup_cache.default_dir
+    caches = _lookup_cache._caches
+    if cache_dir not in caches:
+        caches[cache_dir] = cache.LookupCache(cache_dir)
+    return caches[cache_dir]
+
+_lookup_cache._caches = {}
+# Set by the server, so that the requests it handles share their results:
+_lookup_cache.default_dir = None
+
+def _pkg_config_flags(pkg_names, lookups):
+    """ Return the flags pkg-config gives for compiling with `pkg_names`, or None if pkg-config isn't installed
+
+    `lookups` is the cache.LookupCache that the result is kept in.
+    """
+    import clang.cindex as clang
+
+    import cl_bindgen.cache as cache
+
+    if not (executable := shutil.which('pkg-config')):
+        return None
+
+    def run_pkg_config():
+        result = subprocess.run([executable, '--cflags'] + list(pkg_names), capture_output=True,
+                                check=False)
         if not result.returncode == 0:
             raise BatchException(f"pkg-config command failed: {result.stderr}")
-        include_dirs = result.stdout.strip().decode().split(' ')
-        arg_list.extend(include_dirs)
-
-    print(pkg_names, arg_list)
+        flags = result.stdout.strip().decode().split(' ')
+        # The .pc files the flags came from, so that upgrading a package
+        # invalidates them. They're only checked when the flags are loaded
+        # from disk, so don't pay for another run otherwise:
+        pc_files = []
+        if lookups.directory:
+            result = subprocess.run([executable, '--path'] + list(pkg_names), capture_output=True,
+                                    check=False)
+            if result.returncode == 0:
+                pc_files = result.stdout.decode().split('\n')
+        return {'flags': flags,
+                'files': {path: cache.file_digest(path) for path in pc_files if path}}
+
+    def valid_p(value):
+        return (all(cache.file_digest(path) == digest for (path, digest) in value['files'].items())
+                and all(os.path.isdir(flag[2:]) for flag in value['flags'] if flag.startswith('-I')))
+
+    environment = [os.environ.get(name) for name in _PKG_CONFIG_ENVIRONMENT]
+    key = cache.make_key('pkg-config-files', clang.conf.get_filename(), executable,
+                         list(pkg_names), environment)
+    return lookups.get(key, run_pkg_config, valid_p=valid_p)['flags']
+
+def _process_pkg_config(pkg_names, arg_list, cache_dir=None):
+    if (flags := _pkg_config_flags(pkg_names, _lookup_cache(cache_dir))) is not None:
+        arg_list.extend(flags)
+
+def _prefetch_pkg_config(documents, cache_dir):
+    """ Run pkg-config concurrently for the package lists used by the documents
+
+    Errors are ignored: the lookup is repeated, and the error raised, when the
+    document's options are processed.
+    """
+    import concurrent.futures
+
+    pkg_lists = {tuple(d['pkg-config']) for d in documents
+                 if isinstance(d.get('pkg-config'), list)}
+    if len(pkg_lists) < 2:
+        return
+    # Create the cache before starting the threads, so they all use it:
+    lookups = _lookup_cache(cache_dir)
+    with concurrent.futures.ThreadPoolExecutor(min(len(pkg_lists), 8)) as executor:
+        for pkg_names in pkg_lists:
+            executor.submit(_pkg_config_flags, pkg_names, lookups)
 
 def _process_batch_options(option, dictionary):
     option = copy.copy(option)
+    # Don't modify the lists shared with the other documents:
+    option.arguments = list(option.arguments)
+    option.declaim_inline_rules = list(option.declaim_inline_rules)
 
     output = dictionary.get('output')
     args = dictionary.get('arguments')
@@ -66,12 +157,18 @@ def _process_batch_options(option, dictionary):
     enum_handling = dictionary.get('enum-constants')
     inline_handling = dictionary.get('make-inline')
     return_str = dictionary.get('string-return')
+    umbrella = dictionary.get('umbrella')
+    evaluate_macros = dictionary.get('evaluate-macros')
+    depfile = dictionary.get('depfile')
+    write_if_changed = dictionary.get('write-if-changed')
+    declarations = dictionary.get('declarations')
+    roots = dictionary.get('roots')
     if ptr_handling:
         option.expand_pointer_p = process_inclusion_rules(ptr_handling, list_arg='types')
     if inline_handling is not None:
         rules = []
         for r in inline_handling:
-            rules.append(processfile.InlineRule(
+            rules.append(InlineRule(
                 process_inclusion_rules(r),
                 r.get('feature-flag')
             ))
@@ -80,6 +177,10 @@ def _process_batch_options(option, dictionary):
         option.enum_constant_p = process_inclusion_rules(enum_handling)
     if return_str:
         option.return_str_p = process_inclusion_rules(return_str)
+    if declarations:
+        option.declaration_p = process_inclusion_rules(declarations)
+    if roots:
+        option.root_p = process_inclusion_rules(roots)
     if output:
         option.output = output
     if args:
@@ -90,8 +191,31 @@ def _process_batch_options(option, dictionary):
         if not isinstance(force, bool):
             raise BatchException(f"Invalid value in 'force' option: {force.__repr__()}")
         option.force = force
+    if umbrella is not None:
+        if not isinstance(umbrella, bool):
+            raise BatchException(f"Invalid value in 'umbrella' option: {umbrella.__repr__()}")
+        option.umbrella = umbrella
+    if evaluate_macros is not None:
+        if not isinstance(evaluate_macros, bool):
+            raise BatchException(f"Invalid value in 'evaluate-macros' option: {evaluate_macros.__repr__()}")
+        option.evaluate_macros = evaluate_macros
+    if write_if_changed is not None:
+        if not isinstance(write_if_changed, bool):
+            raise BatchException(f"Invalid value in 'write-if-changed' option: {write_if_changed.__repr__()}")
+        option.write_if_changed = write_if_changed
+    if depfile is not None:
+        if depfile is True:
+            option.depfile = ProcessOptions.DEPFILE_NEXT_TO_OUTPUT
+        elif depfile is False:
+            option.depfile = None
+        elif isinstance(depfile, str):
+            option.depfile = depfile
+        else:
+            raise BatchException(f"Invalid value in 'depfile' option: {depfile.__repr__()}")
+    if option.depfile and option.output in (':stdout', ':stderr'):
+        raise BatchException(f"A dependency file can't be written for output {option.output}")
     if pkg_config:
-        _process_pkg_config(pkg_config, option.arguments)
+        _process_pkg_config(pkg_config, option.arguments, option.cache_dir)
 
     return option
 
@@ -102,77 +226,397 @@ def _add_args_to_option(option, args):
     if hasattr(args, 'output') and args.output:
         option.output = args.output
     if args.arguments:
-        option.arguments.extend(args.arguments)
+        option.arguments = option.arguments + args.arguments
     if hasattr(args, 'package') and args.package:
         option.package = args.package
     if args.force:
         option.force = True
+    if hasattr(args, 'jobs') and args.jobs:
+        option.jobs = args.jobs
+    if args.cache_dir:
+        option.cache_dir = args.cache_dir
+    if hasattr(args, 'umbrella') and args.umbrella:
+        option.umbrella = True
+    if args.stream_output:
+        option.stream_output = True
+    if args.evaluate_macros:
+        option.evaluate_macros = True
+    if args.write_if_changed:
+        option.write_if_changed = True
+    if hasattr(args, 'roots') and args.roots:
+        option.root_p = make_batch_determiner(whitelist=args.roots)
+    if hasattr(args, 'depfile') and args.depfile:
+        option.depfile = args.depfile
+    elif hasattr(args, 'depfile_next_to_output') and args.depfile_next_to_output:
+        option.depfile = ProcessOptions.DEPFILE_NEXT_TO_OUTPUT
     return option
 
 def _verify_document(document):
     return 'files' in document and 'output' in document
 
-def process_batch_file(batchfile, options):
-    """ Perform the actions specified in the batch file with the given base options
-
-    If options are specified in the batch file that override the options given, those
-    options will be used instead.
-    """
+def _process_document(document, options, incremental):
+    import cl_bindgen.manifest as manifest
+    import cl_bindgen.processfile as processfile
+
+    files = document['files']
+    if not _incremental_p(options, incremental):
+        processfile.process_files(files, options)
+        return
+
+    start = processfile._process_enum_decl.anon_count
+    key = manifest.fingerprint(files, options, document)
+    recorded = manifest.read_manifest(options.output, key)
+    # The names of anonymous enums depend on the outputs generated before this one:
+    if recorded and recorded.get('anon-enums') and recorded['anon-enums'][0] == start:
+        processfile._process_enum_decl.anon_count = recorded['anon-enums'][1]
+        return
+    dependencies = processfile.process_files(files, options)
+    manifest.write_manifest(options.output, key, dependencies,
+                            anon_enums=[start, processfile._process_enum_decl.anon_count])
+
+def _incremental_p(options, incremental):
+    return incremental and options.output not in (':stdout', ':stderr')
+
+def _read_documents(batchfile):
+    """ Return the documents in the batch file """
+    import yaml
+
+    documents = []
     with open(batchfile, 'r') as f:
         data = yaml.load_all(f, Loader=yaml.Loader)
         for document in data:
             if not _verify_document(document):
                 raise BatchException(f'Missing fields in batchfile "{batchfile}"')
-            new_options = _process_batch_options(options, document)
-            processfile.process_files(document['files'], new_options)
+            documents.append(document)
+    return documents
+
+def _load_documents(batchfiles, options):
+    """ Return a (document, options) pair for each document in the batch files """
+    documents = []
+    for batchfile in batchfiles:
+        documents.extend(_read_documents(batchfile))
+    _prefetch_pkg_config(documents, options.cache_dir)
+    return [(document, _process_batch_options(options, document)) for document in documents]
+
+def _check_output_conflicts(documents):
+    outputs = set()
+    for (_, options) in documents:
+        if options.output in (':stdout', ':stderr'):
+            continue
+        output = os.path.realpath(options.output)
+        if output in outputs:
+            raise BatchException(f'More than one batch document writes to "{options.output}"')
+        outputs.add(output)
+
+class _DocumentRun:
+    """ The result of processing a document in a pool worker """
+
+    def __init__(self):
+        self.stdout = ''
+        self.stderr = ''
+        self.error = None
+        # The manifest's range of anonymous enum numbers if the output was up to date:
+        self.up_to_date = None
+        self.key = None
+        self.dependencies = []
+        self.anon_count = 0
+
+def _run_document(job):
+    """ Process a document in a pool worker, capturing what it writes to stdout and stderr
+
+    The number of anonymous enums output by the documents before this one
+    isn't known yet, so they are given placeholder names numbered from zero.
+    See _finish_document_runs.
+    """
+    import cl_bindgen.manifest as manifest
+    import cl_bindgen.processfile as processfile
+
+    (document, options, incremental) = job
+    processfile._process_enum_decl.anon_count = 0
+    run = _DocumentRun()
+    stdout = io.StringIO()
+    stderr = io.StringIO()
+    with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+        try:
+            files = document['files']
+            if _incremental_p(options, incremental):
+                run.key = manifest.fingerprint(files, options, document)
+                recorded = manifest.read_manifest(options.output, run.key)
+                if recorded and recorded.get('anon-enums'):
+                    run.up_to_date = recorded['anon-enums']
+            if not run.up_to_date:
+                run.dependencies = processfile.process_files(files, options,
+                                                             placeholder_names=True)
+        # Errors are reported once every document has been processed:
+        except Exception as err:  # noqa: BLE001
+            run.error = err
+    run.stdout = stdout.getvalue()
+    run.stderr = stderr.getvalue()
+    run.anon_count = processfile._process_enum_decl.anon_count
+    return run
+
+def _finish_document_runs(documents, runs, incremental):
+    """ Number the anonymous enums of the documents processed by pool workers
+
+    Writes what the documents wrote to stdout and stderr, and writes their
+    manifests. Up to date documents whose anonymous enums would be numbered
+    differently are processed again. Returns the errors raised while
+    processing the documents.
+    """
+    import cl_bindgen.manifest as manifest
+    import cl_bindgen.processfile as processfile
+
+    errors = []
+    renumber = []
+    count = processfile._process_enum_decl.anon_count
+    for (i, ((document, options), run)) in enumerate(zip(documents, runs)):
+        sys.stdout.write(processfile._number_anon_enums(run.stdout, count))
+        sys.stderr.write(processfile._number_anon_enums(run.stderr, count))
+        if run.error is not None:
+            processfile._remove_unnumbered_output(options)
+            errors.append((i, run.error))
+        elif run.up_to_date:
+            (start, end) = run.up_to_date
+            if start != count:
+                renumber.append((i, document, options, count))
+            count += end - start
+            continue
+        else:
+            try:
+                # With write_if_changed, the output is always kept unnumbered
+                # next to the output file until it is compared:
+                if ((run.anon_count or options.write_if_changed)
+                    and options.output not in (':stdout', ':stderr')):
+                    processfile._number_anon_enums_in_output(options, count)
+                if run.key:
+                    manifest.write_manifest(options.output, run.key, run.dependencies,
+                                            anon_enums=[count, count + run.anon_count])
+            except Exception as err:  # noqa: BLE001
+                processfile._remove_unnumbered_output(options)
+                errors.append((i, err))
+        count += run.anon_count
+    sys.stdout.flush()
+    sys.stderr.flush()
+
+    for (i, document, options, start) in renumber:
+        processfile._process_enum_decl.anon_count = start
+        try:
+            _process_document(document, options, incremental)
+        except Exception as err:  # noqa: BLE001
+            errors.append((i, err))
+    processfile._process_enum_decl.anon_count = count
+    return [err for (_, err) in sorted(errors, key=lambda e: e[0])]
+
+def process_batch_files(batchfiles, options, incremental=False, jobs=1):
+    """ Perform the actions specified in the batch files with the given base options
+
+    If options are specified in the batch files that override the options given, those
+    options will be used instead.
+
+    If `incremental` is true, a manifest is written next to each output file, and
+    documents whose inputs and options haven't changed since the manifest was
+    written are skipped.
+
+    If `jobs` is greater than one, the documents are processed in that many
+    processes. What each document writes to stdout and stderr is written in the
+    order the documents are given once they have all finished. If any of them
+    failed, a DocumentErrors exception is raised.
+    """
+    import cl_bindgen.parallel as parallel
+
+    documents = _load_documents(batchfiles, options)
+    _check_output_conflicts(documents)
+
+    if not parallel.should_fork(jobs, len(documents)):
+        for (document, doc_options) in documents:
+            _process_document(document, doc_options, incremental)
+        return
+
+    work = [(document, doc_options, incremental) for (document, doc_options) in documents]
+    runs = parallel.map_forked(_run_document, work, jobs)
+    if errors := _finish_document_runs(documents, runs, incremental):
+        raise DocumentErrors(errors)
+
+def process_batch_file(batchfile, options, incremental=False, jobs=1):
+    """ Perform the actions specified in the batch file with the given base options
+
+    See `process_batch_files`.
+    """
+    process_batch_files([batchfile], options, incremental=incremental, jobs=jobs)
+
+def _report_batch_error(err):
+    """ Report an error that stopped a batch file from being processed, returning the exit status """
+    # Errors about input files raised by processfile only carry the path as strerror
+    if isinstance(err, FileNotFoundError):
+        if err.filename is None:
+            logging.error(f'Input file "{err.strerror}" not found.\nNo output produced.')
+        else:
+            logging.error(f'Batch file "{err.filename}" not found.\nNo output produced.')
+        return err.errno
+    elif isinstance(err, IsADirectoryError):
+        logging.error(f'"{err.filename or err.strerror}" is a directory.\nNo output produced.')
+        return err.errno
+    elif isinstance(err, BatchException):
+        logging.error(f'{str(err)}.', 'Exiting.')
+        return errno.EINVAL
+    elif isinstance(err, ParserException):
+        logging.error('Problem encountered while processing file:',
+                      err.format_errors(),
+                      'No output produced.',
+                      sep='\n')
+        return 1
+    else:
+        logging.error(f'{type(err).__name__}: {err}')
+        return 1
+
+@contextlib.contextmanager
+def _instrumentation(arguments):
+    """ Collect the statistics and profile requested by --stats and --profile while active """
+    if not (arguments.stats or arguments.profile):
+        yield
+        return
+
+    import cl_bindgen.stats as stats
+
+    with contextlib.ExitStack() as stack:
+        if arguments.profile:
+            stack.enter_context(stats.Profile(arguments.profile))
+        statistics = stack.enter_context(stats.Statistics()) if arguments.stats else None
+        try:
+            yield
+        finally:
+            if statistics:
+                statistics.report()
 
 def _arg_batch_files(arguments, options):
     """ Perform the actions described in batch_files using `options` as the defaults """
 
     options = _add_args_to_option(options, arguments)
     try:
-        for batch_file in arguments.inputs:
-            process_batch_file(batch_file, options)
-    except FileNotFoundError as err:
-        logging.error(f'Batch file "{err.filename}" not found.\nNo output produced.')
-        exit(err.errno)
-    except IsADirectoryError as err:
-        logging.error(f'"{err.filename}" is a directory.\nNo output produced.')
-        exit(err.errno)
-    except BatchException as err:
-        logging.error(f'{str(err)}.', 'Exiting.')
-        exit(errno.EINVAL)
-    except processfile.ParserException as err:
-        logging.error('Problem encountered while processing file:',
-	              err.format_errors(),
-	              'No output produced.',
-	              sep='\n')
-        exit(1)
+        with _instrumentation(arguments):
+            process_batch_files(arguments.inputs, options,
+                                incremental=arguments.incremental, jobs=arguments.jobs)
+    except DocumentErrors as errors:
+        statuses = [_report_batch_error(err) for err in errors.errors]
+        sys.exit(statuses[0])
+    except (FileNotFoundError, IsADirectoryError, BatchException, ParserException) as err:
+        sys.exit(_report_batch_error(err))
 
 def _arg_process_files(arguments, options):
     """ Process the files using the given parsed arguments and options """
 
+    import cl_bindgen.processfile as processfile
+
     options = _add_args_to_option(options, arguments)
+    if options.depfile and options.output in (':stdout', ':stderr'):
+        logging.error('Writing a dependency file requires an output file, given with -o.')
+        sys.exit(errno.EINVAL)
+    if options.umbrella and options.jobs > 1 and len(arguments.inputs) > 1:
+        logging.warn('--umbrella parses the files as a single translation unit, so -j is ignored.')
     try:
-        processfile.process_files(arguments.inputs, options)
+        with _instrumentation(arguments):
+            processfile.process_files(arguments.inputs, options)
     except FileNotFoundError as err:
         logging.error(f'Input file "{err.strerror}" not found.\nNo output produced.')
-        exit(err.errno)
+        sys.exit(err.errno)
     except IsADirectoryError as err:
         logging.error(f'"{err.strerror}" is a directory.\nNo output produced.')
-        exit(err.errno)
-    except processfile.ParserException as err:
+        sys.exit(err.errno)
+    except ParserException as err:
         logging.error('Problem encountered while processing file:',
                       err.format_errors(),
                       'No output produced.',
                       sep='\n')
-        exit(1)
+        sys.exit(1)
+
+def _arg_index(arguments, options):
+    """ Add the declarations of the files to the symbol index """
+    import cl_bindgen.index as index
+
+    options = _add_args_to_option(options, arguments)
+    try:
+        with index.SymbolIndex(arguments.database) as symbol_index:
+            symbol_index.update(arguments.inputs, options)
+    except index.SymbolIndexError as err:
+        logging.error(str(err))
+        sys.exit(1)
+    except FileNotFoundError as err:
+        logging.error(f'Input file "{err.strerror}" not found.')
+        sys.exit(err.errno)
+    except IsADirectoryError as err:
+        logging.error(f'"{err.strerror}" is a directory.')
+        sys.exit(err.errno)
+    except ParserException as err:
+        logging.error('Problem encountered while processing file:',
+                      err.format_errors(),
+                      sep='\n')
+        sys.exit(1)
+
+def _arg_query(arguments, options):
+    """ Print the indexed symbols matching the arguments, or generate their bindings """
+    import cl_bindgen.index as index
+
+    try:
+        with index.SymbolIndex(arguments.database, read_only=True) as symbol_index:
+            symbols = [symbol
+                       for pattern in arguments.patterns or [None]
+                       for symbol in symbol_index.symbols(pattern, arguments.kind,
+                                                          arguments.references)]
+            if arguments.generate:
+                options = copy.copy(options)
+                if arguments.output:
+                    options.output = arguments.output
+                if arguments.package:
+                    options.package = arguments.package
+                roots = [symbol.name for symbol in symbols if symbol.kind in index.ROOT_KINDS]
+                symbol_index.generate(roots, options)
+                return
+    except index.SymbolIndexError as err:
+        logging.error(str(err))
+        sys.exit(1)
+    for symbol in symbols:
+        print(symbol.name, symbol.kind, symbol.lisp_name or '-',
+              f'{symbol.file}:{symbol.line}', symbol.usr or '-', sep='\t')
+
+def _arg_watch(arguments, options):
+    """ Process the batch files, and process them again when the files they use change """
+    import cl_bindgen.watch as watch
+
+    options = _add_args_to_option(options, arguments)
+    try:
+        watch.watch(arguments.inputs, options, poll=arguments.poll)
+    except (FileNotFoundError, IsADirectoryError, BatchException) as err:
+        sys.exit(_report_batch_error(err))
+
+def _arg_serve(arguments, options):
+    """ Handle requests from cl-bindgen clients using `options` as the defaults """
+    import cl_bindgen.server as server
+
+    options = copy.copy(options)
+    if arguments.cache_dir:
+        options.cache_dir = arguments.cache_dir
+    try:
+        server.serve(arguments.socket, options)
+    except OSError as err:
+        logging.error(f'Could not listen on "{arguments.socket}": {err}')
+        sys.exit(err.errno or 1)
+
+def _arg_client(arguments, options):
+    """ Have a cl-bindgen server run the command given in the arguments """
+    import cl_bindgen.server as server
+
+    try:
+        status = server.request(arguments.socket, arguments.request)
+    except OSError as err:
+        logging.error(f'Could not connect to the server at "{arguments.socket}": {err}')
+        sys.exit(err.errno or 1)
+    sys.exit(status)
 
 def _build_parser():
     parser = argparse.ArgumentParser()
 
     parser.add_argument('--version',action='version',
-                        version='CL-BINDGEN 1.7.0',
+                        version=f'CL-BINDGEN {cl_bindgen.__version__}',
                         help="Print the version information")
     subparsers = parser.add_subparsers()
 
@@ -190,6 +634,43 @@ def _build_parser():
                               action='store_true',
                               dest='force',
                               help='ignore parsing errors')
+    batch_parser.add_argument('--cache-dir',
+                              metavar='directory',
+                              dest='cache_dir',
+                              help='Cache parsed header files in the given directory')
+    batch_parser.add_argument('--incremental',
+                              action='store_true',
+                              dest='incremental',
+                              help='Skip documents whose inputs and options have not changed since the last run')
+    batch_parser.add_argument('--stream',
+                              action='store_true',
+                              dest='stream_output',
+                              help='Write the output to a temporary file while it is generated instead of keeping it in memory')
+    batch_parser.add_argument('-j', '--jobs',
+                              metavar='N',
+                              dest='jobs',
+                              type=int,
+                              help='Process the batch documents using N processes')
+    batch_parser.add_argument('--write-if-changed',
+                              action='store_true',
+                              dest='write_if_changed',
+                              help='Only replace output files whose contents changed, so their modification times are kept')
+    batch_parser.add_argument('--evaluate-macros',
+                              action='store_true',
+                              dest='evaluate_macros',
+                              help='Evaluate macros that are constant expressions with clang')
+    batch_parser.add_argument('-MD',
+                              action='store_true',
+                              dest='depfile_next_to_output',
+                              help='Write a make-style dependency file next to each output file, named after it with .d added')
+    batch_parser.add_argument('--stats',
+                              action='store_true',
+                              dest='stats',
+                              help='Print how long each phase of processing took and other statistics to stderr')
+    batch_parser.add_argument('--profile',
+                              metavar='file',
+                              dest='profile',
+                              help='Profile cl-bindgen and save the results to the given file. Files ending in .folded are saved as collapsed stacks, others are saved by cProfile')
     batch_parser.set_defaults(func=_arg_batch_files)
 
 
@@ -214,11 +695,165 @@ def _build_parser():
                                 action='store_true',
                                 dest='force',
                                 help='ignore parsing errors')
+    process_parser.add_argument('-j', '--jobs',
+                                metavar='N',
+                                dest='jobs',
+                                type=int,
+                                help='Parse the input files using N processes')
+    process_parser.add_argument('--cache-dir',
+                                metavar='directory',
+                                dest='cache_dir',
+                                help='Cache parsed header files in the given directory')
+    process_parser.add_argument('--umbrella',
+                                action='store_true',
+                                dest='umbrella',
+                                help='Parse all of the input files as a single translation unit')
+    process_parser.add_argument('--stream',
+                                action='store_true',
+                                dest='stream_output',
+                                help='Write the output to a temporary file while it is generated instead of keeping it in memory')
+    process_parser.add_argument('--write-if-changed',
+                                action='store_true',
+                                dest='write_if_changed',
+                                help='Only replace output files whose contents changed, so their modification times are kept')
+    process_parser.add_argument('--evaluate-macros',
+                                action='store_true',
+                                dest='evaluate_macros',
+                                help='Evaluate macros that are constant expressions with clang')
+    process_parser.add_argument('--root',
+                                metavar='name',
+                                dest='roots',
+                                action='append',
+                                help='Only output the given function, variable or macro and the types it uses. Can be given more than once')
+    process_parser.add_argument('-MD',
+                                action='store_true',
+                                dest='depfile_next_to_output',
+                                help='Write a make-style dependency file next to the output file, named after it with .d added')
+    process_parser.add_argument('--depfile',
+                                metavar='path',
+                                dest='depfile',
+                                help='Write a make-style dependency file listing the files the output depends on to the given path')
+    process_parser.add_argument('--stats',
+                                action='store_true',
+                                dest='stats',
+                                help='Print how long each phase of processing took and other statistics to stderr')
+    process_parser.add_argument('--profile',
+                                metavar='file',
+                                dest='profile',
+                                help='Profile cl-bindgen and save the results to the given file. Files ending in .folded are saved as collapsed stacks, others are saved by cProfile')
     process_parser.set_defaults(func=_arg_process_files)
 
+    watch_parser = subparsers.add_parser('watch', aliases=['w'],
+                                         help="Process batch files again whenever the files they use change",
+                                         description="Process the batch files, then keep the parsed header files in memory and update the documents whose header files change until interrupted")
+    watch_parser.add_argument('inputs', nargs='+',
+                              metavar='batch files',
+                              help="The batch files to process")
+    watch_parser.add_argument('-a', metavar='compiler arguments',
+                              dest='arguments',
+                              nargs=argparse.REMAINDER,
+                              help='Consume the rest of the arguments and pass them to libclang')
+    watch_parser.add_argument('-f',
+                              action='store_true',
+                              dest='force',
+                              help='ignore parsing errors')
+    watch_parser.add_argument('--poll',
+                              action='store_true',
+                              dest='poll',
+                              help='Check the files for changes periodically instead of using inotify')
+    watch_parser.add_argument('--write-if-changed',
+                              action='store_true',
+                              dest='write_if_changed',
+                              help='Only replace output files whose contents changed, so their modification times are kept')
+    watch_parser.add_argument('--evaluate-macros',
+                              action='store_true',
+                              dest='evaluate_macros',
+                              help='Evaluate macros that are constant expressions with clang')
+    watch_parser.set_defaults(func=_arg_watch, cache_dir=None, stream_output=False)
+
+    index_parser = subparsers.add_parser('index',
+                                         help="Record the declarations of header files in a symbol index",
+                                         description="Store every top-level declaration of the files in an SQLite database, which can be searched with the query command. Files that haven't changed since they were last indexed aren't parsed again")
+    index_parser.add_argument('database',
+                              help="The symbol index to update. It is created if it doesn't exist")
+    index_parser.add_argument('inputs', nargs='+',
+                              metavar='input files',
+                              help="The files to index")
+    index_parser.add_argument('-a', metavar='compiler arguments',
+                              dest='arguments',
+                              nargs=argparse.REMAINDER,
+                              help='Consume the rest of the arguments and pass them to libclang')
+    index_parser.add_argument('-f',
+                              action='store_true',
+                              dest='force',
+                              help='ignore parsing errors')
+    index_parser.add_argument('--cache-dir',
+                              metavar='directory',
+                              dest='cache_dir',
+                              help='Cache parsed header files in the given directory')
+    index_parser.add_argument('--evaluate-macros',
+                              action='store_true',
+                              dest='evaluate_macros',
+                              help='Evaluate macros that are constant expressions with clang')
+    index_parser.set_defaults(func=_arg_index, stream_output=False, write_if_changed=False)
+
+    query_parser = subparsers.add_parser('query',
+                                         help="Search a symbol index",
+                                         description="Print the name, kind, Lisp name, location and USR of the indexed symbols matching the arguments, one per line, or generate the bindings of the matching functions, variables and macros")
+    query_parser.add_argument('database',
+                              help="The symbol index created by the index command")
+    query_parser.add_argument('patterns', nargs='*',
+                              metavar='name',
+                              help="Glob patterns the names of the symbols must match, such as 'wl_display_*'")
+    query_parser.add_argument('-k', '--kind',
+                              choices=['function', 'variable', 'macro', 'typedef',
+                                       'struct', 'union', 'enum', 'other'],
+                              dest='kind',
+                              help='Only print symbols of the given kind')
+    query_parser.add_argument('--references',
+                              metavar='type',
+                              dest='references',
+                              help='Only print symbols whose types use the given typedef, struct, union or enum')
+    query_parser.add_argument('-g', '--generate',
+                              action='store_true',
+                              dest='generate',
+                              help='Output the bindings of the matching functions, variables and macros and the types they use instead, without parsing the header files again')
+    query_parser.add_argument('-o',
+                              metavar='output',
+                              dest='output',
+                              help="Where to place the generated bindings")
+    query_parser.add_argument('-p',
+                              metavar='package',
+                              dest='package',
+                              help="Output an in-package form with the given package at the top of the generated bindings")
+    query_parser.set_defaults(func=_arg_query, needs_clang_dir=False)
+
+    serve_parser = subparsers.add_parser('serve',
+                                         help="Keep libclang loaded and process commands sent by cl-bindgen client",
+                                         description="Listen on a Unix socket for files and batch commands sent by cl-bindgen client. Each command is processed in a separate process, so many can be processed at once.")
+    serve_parser.add_argument('socket',
+                              help="The path of the Unix socket to listen on")
+    serve_parser.add_argument('--cache-dir',
+                              metavar='directory',
+                              dest='cache_dir',
+                              help='Cache parsed header files in the given directory, sharing them between requests')
+    serve_parser.set_defaults(func=_arg_serve, needs_clang_dir=False)
+
+    client_parser = subparsers.add_parser('client',
+                                          help="Send a command to a cl-bindgen server",
+                                          description="Process a files or batch command using the server listening on the given socket")
+    client_parser.add_argument('socket',
+                               help="The path of the server's Unix socket")
+    client_parser.add_argument('request', nargs=argparse.REMAINDER,
+                               metavar='command',
+                               help="The files or batch command and its arguments")
+    client_parser.set_defaults(func=_arg_client, needs_clang_dir=False)
+
     return parser
 
 def _guess_clang_version():
+    import clang.cindex as clang
+
     matcher = re.compile('libclang-([0-9]+).*.so')
     found = matcher.search(clang.conf.get_filename())
     if found:
@@ -226,7 +861,11 @@ def _guess_clang_version():
     else:
         return None
 
-def find_clang_resource_dir():
+def find_clang_resource_dir(cache_dir=None):
+    """ Return clang's builtin include directory, or None if it can't be found
+
+    The result is cached for the rest of the run, and in `cache_dir` if given.
+    """
     if version := _guess_clang_version():
         exec_name = 'clang-' + version
     else:
@@ -234,17 +873,29 @@ def find_clang_resource_dir():
         logging.warn("could not determine clang version. System header files",
                      "may not be processed correctly.")
 
-    if executable := shutil.which(exec_name):
-        result = subprocess.run([executable, '--print-resource-dir'], capture_output=True)
+    if not (executable := shutil.which(exec_name)):
+        return None
+
+    def run_clang():
+        result = subprocess.run([executable, '--print-resource-dir'], capture_output=True,
+                                check=False)
         path = result.stdout.strip().decode()
         inc_path = os.path.join(path, "include")
         # probably don't need the sanity check, but it might prevent some problems
         if os.path.exists(inc_path):
             return inc_path
-    return None
+        return None
+
+    import clang.cindex as clang
+
+    import cl_bindgen.cache as cache
+
+    key = cache.make_key('resource-dir', cache.library_identity(clang.conf.get_filename()),
+                         os.path.realpath(executable))
+    return _lookup_cache(cache_dir).get(key, run_clang, valid_p=os.path.exists)
 
 def add_clang_dir(parsed_args):
-    if clang_inc_dir := find_clang_resource_dir():
+    if clang_inc_dir := find_clang_resource_dir(getattr(parsed_args, 'cache_dir', None)):
         clang_args = parsed_args.arguments
         if not clang_args:
             clang_args = []
@@ -260,10 +911,11 @@ def dispatch_from_arguments(arguments, options):
 
     if not len(arguments) > 0:
         parser.print_help()
-        exit(1)
+        sys.exit(1)
 
     args = parser.parse_args(arguments)
 
-    add_clang_dir(args)
+    if getattr(args, 'needs_clang_dir', True):
+        add_clang_dir(args)
 
     return args.func(args, options)
@@ -0,0 +1,254 @@
+""" Regenerate the output of batch files when the files they use change
+
+The translation units of every input file are kept alive between runs and
+reparsed with a precompiled preamble when the files they use change, which is
+much faster than parsing them again. Only the documents that use a changed
+file are regenerated. Changes are detected with inotify where it is
+available, and by periodically checking the files' modification times
+otherwise.
+"""
+
+import copy
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import time
+
+import clang.cindex as clang
+
+import cl_bindgen.logging as logging
+import cl_bindgen.processfile as processfile
+import cl_bindgen.util as util
+
+def _stamp(path):
+    """ Return a value that changes when the file at `path` is modified, replaced or removed """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+
+class TranslationUnitStore:
+    """ Keeps translation units alive so they can be reparsed when the files they use change
+
+    Set an instance as `ProcessOptions.translation_units` to have it used
+    instead of parsing every file from scratch. Translation units are parsed
+    with a precompiled preamble, so reparsing a file whose includes haven't
+    changed doesn't parse them again.
+    """
+
+    def __init__(self):
+        # (path, arguments, unsaved files) -> (translation unit, {path: stamp})
+        self.units = {}
+
+    def parse(self, index, filepath, arguments, parse_options, unsaved_files=None):
+        """ Return an up to date translation unit for the file, reparsing it if needed """
+        key = (os.path.abspath(filepath), tuple(arguments), tuple(unsaved_files or ()))
+        entry = self.units.get(key)
+        if entry is None:
+            before = {key[0]: _stamp(key[0])}
+            tu = index.parse(filepath, args=arguments, unsaved_files=unsaved_files,
+                             options=parse_options | clang.TranslationUnit.PARSE_PRECOMPILED_PREAMBLE)
+        else:
+            (tu, stamps) = entry
+            # Take the stamps before reparsing so that changes made while
+            # reparsing are noticed next time:
+            before = {path: _stamp(path) for path in stamps}
+            if before == stamps:
+                return tu
+            tu.reparse(unsaved_files=unsaved_files)
+
+        paths = [key[0]] + [os.path.abspath(i.include.name) for i in tu.get_includes()]
+        stamps = {path: before[path] if path in before else _stamp(path) for path in paths}
+        self.units[key] = (tu, stamps)
+        return tu
+
+class _PollingWatcher:
+    """ Detects changes by checking the modification times of the files """
+
+    def __init__(self, paths, interval=0.5):
+        self.interval = interval
+        self.stamps = {}
+        self.update(paths)
+
+    def update(self, paths):
+        self.stamps = {path: self.stamps.get(path, _stamp(path)) for path in paths}
+
+    def wait(self):
+        """ Block until some of the files change, returning their paths """
+        while True:
+            time.sleep(self.interval)
+            changed = set()
+            for (path, stamp) in self.stamps.items():
+                current = _stamp(path)
+                if current != stamp:
+                    self.stamps[path] = current
+                    changed.add(path)
+            if changed:
+                return changed
+
+    def close(self):
+        pass
+
+_IN_ATTRIB = 0x4
+_IN_CLOSE_WRITE = 0x8
+_IN_MOVED_FROM = 0x40
+_IN_MOVED_TO = 0x80
+_IN_CREATE = 0x100
+_IN_DELETE = 0x200
+# Editors often save files by writing a new file and renaming it, so watch
+# for files being replaced as well as written:
+_IN_WATCH_MASK = _IN_ATTRIB | _IN_CLOSE_WRITE | _IN_MOVED_FROM | _IN_MOVED_TO | _IN_CREATE | _IN_DELETE
+_INOTIFY_EVENT = struct.Struct('iIII')
+
+class _InotifyWatcher:
+    """ Detects changes using inotify, watching the directories that contain the files """
+
+    def __init__(self, paths, settle_time=0.05):
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.libc.inotify_init1.argtypes = [ctypes.c_int]
+        self.libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self.libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+        self.fd = self.libc.inotify_init1(os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        self.settle_time = settle_time
+        self.directories = {}
+        self.paths = set()
+        self.update(paths)
+
+    def update(self, paths):
+        self.paths = set(paths)
+        directories = {os.path.dirname(path) for path in self.paths}
+        for directory in set(self.directories) - directories:
+            self.libc.inotify_rm_watch(self.fd, self.directories.pop(directory))
+        for directory in directories - set(self.directories):
+            wd = self.libc.inotify_add_watch(self.fd, os.fsencode(directory), _IN_WATCH_MASK)
+            if wd < 0:
+                logging.warn(f'Could not watch "{directory}" for changes: {os.strerror(ctypes.get_errno())}')
+                continue
+            self.directories[directory] = wd
+
+    def _read_events(self):
+        names = {wd: directory for (directory, wd) in self.directories.items()}
+        data = os.read(self.fd, 1 << 16)
+        changed = set()
+        offset = 0
+        while offset < len(data):
+            (wd, _, _, length) = _INOTIFY_EVENT.unpack_from(data, offset)
+            offset += _INOTIFY_EVENT.size
+            name = data[offset:offset + length].rstrip(b'\0')
+            offset += length
+            if wd in names and name:
+                path = os.path.join(names[wd], os.fsdecode(name))
+                if path in self.paths:
+                    changed.add(path)
+        return changed
+
+    def wait(self):
+        """ Block until some of the files change, returning their paths """
+        while True:
+            select.select([self.fd], [], [])
+            changed = self._read_events()
+            # Wait for the rest of the changes when many files are saved at once:
+            while select.select([self.fd], [], [], self.settle_time)[0]:
+                changed.update(self._read_events())
+            if changed:
+                return changed
+
+    def close(self):
+        os.close(self.fd)
+
+def _make_watcher(paths, poll):
+    if not poll:
+        try:
+            return _InotifyWatcher(paths)
+        except (OSError, AttributeError, TypeError) as err:
+            # AttributeError or TypeError: libc doesn't provide inotify
+            logging.warn(f'Could not use inotify to watch for changes ({err}).',
+                         'Checking for changes periodically instead.')
+    return _PollingWatcher(paths)
+
+class _Document:
+
+    def __init__(self, document, options):
+        self.document = document
+        self.options = options
+        self.dependencies = {os.path.abspath(f) for f in document['files']}
+        # The range of numbers used to name anonymous enums by the last run:
+        self.anon_enums = None
+
+    def regenerate(self, anon_count):
+        """ Regenerate the output, numbering anonymous enums from `anon_count` """
+        processfile._process_enum_decl.anon_count = anon_count
+        try:
+            dependencies = processfile.process_files(self.document['files'], self.options)
+            self.dependencies = {os.path.abspath(d) for d in dependencies}
+        # Keep watching, so that the output is regenerated once the error is fixed:
+        except Exception as err:  # noqa: BLE001
+            util._report_batch_error(err)
+        self.anon_enums = (anon_count, processfile._process_enum_decl.anon_count)
+
+def _regenerate(documents, outdated, anon_count):
+    """ Regenerate the outdated documents
+
+    Anonymous enums are numbered across all of the documents, so documents
+    after one whose number of anonymous enums changed are regenerated as
+    well. This keeps the output the same as processing the batch files again.
+    """
+    for document in documents:
+        if document in outdated or document.anon_enums[0] != anon_count:
+            document.regenerate(anon_count)
+        anon_count = document.anon_enums[1]
+
+def _load_documents(batchfiles, options):
+    documents = util._load_documents(batchfiles, options)
+    util._check_output_conflicts(documents)
+    return [_Document(document, doc_options) for (document, doc_options) in documents]
+
+def _watched_paths(batchfiles, documents):
+    paths = set(batchfiles)
+    for document in documents:
+        paths.update(document.dependencies)
+    return paths
+
+def watch(batchfiles, options, poll=False):
+    """ Process the batch files, then process the documents again whenever the files they use change
+
+    Runs until interrupted. The translation units are kept in memory, so the
+    files are always processed in this process, one at a time. Outputs are
+    written to a temporary file that replaces the output file once it is
+    complete. If `poll` is true, the files are checked for changes
+    periodically instead of using inotify.
+    """
+    options = copy.copy(options)
+    options.jobs = 1
+    options.stream_output = True
+    options.translation_units = TranslationUnitStore()
+    batchfiles = [os.path.abspath(f) for f in batchfiles]
+
+    anon_count = processfile._process_enum_decl.anon_count
+    documents = _load_documents(batchfiles, options)
+    _regenerate(documents, set(documents), anon_count)
+
+    watcher = _make_watcher(_watched_paths(batchfiles, documents), poll)
+    try:
+        while True:
+            changed = watcher.wait()
+            if changed.intersection(batchfiles):
+                try:
+                    documents = _load_documents(batchfiles, options)
+                except Exception as err:  # noqa: BLE001
+                    util._report_batch_error(err)
+                    continue
+                outdated = set(documents)
+            else:
+                outdated = {d for d in documents if not d.dependencies.isdisjoint(changed)}
+            _regenerate(documents, outdated, anon_count)
+            watcher.update(_watched_paths(batchfiles, documents))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.close()
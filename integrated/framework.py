@@ -1,11 +1,16 @@
 import difflib
 import filecmp
-import os.path
-import os
+import functools
 import io
+import json
+import os
+import os.path
+import time
 import traceback
-from enum import Enum
 from dataclasses import dataclass, field
+from enum import Enum
+
+import cl_bindgen.parallel as parallel
 
 def _perform_diff(result, original):
     """  Compares the files `result` and `original`
@@ -73,12 +78,15 @@ class TestOptions(Enum):
     EXPECT_FAIL = 0
     SKIP = 1
     THROWS_EXCEPTION = 2
+    # The number of seconds the test may take, instead of the budget given to run_tests:
+    TIME_BUDGET = 3
 
 def _get_options(opt_dict):
     options = dict()
     options[TestOptions.EXPECT_FAIL] = opt_dict.get(TestOptions.EXPECT_FAIL, False)
     options[TestOptions.SKIP] = opt_dict.get(TestOptions.SKIP, False)
     options[TestOptions.THROWS_EXCEPTION] = opt_dict.get(TestOptions.THROWS_EXCEPTION, False)
+    options[TestOptions.TIME_BUDGET] = opt_dict.get(TestOptions.TIME_BUDGET, None)
     return options
 
 def _make_path_list(path):
@@ -108,10 +116,13 @@ def _mangle_input_file(filename):
 
 @dataclass
 class TestStats:
-    failed: list = field(default_factory=lambda: [])
-    expected_fail: list = field(default_factory=lambda: [])
-    unexpected_pass: list = field(default_factory=lambda: [])
-    skipped: list = field(default_factory=lambda: [])
+    failed: list = field(default_factory=list)
+    expected_fail: list = field(default_factory=list)
+    unexpected_pass: list = field(default_factory=list)
+    skipped: list = field(default_factory=list)
+    too_slow: list = field(default_factory=list)
+    # input file -> seconds spent generating its output:
+    times: dict = field(default_factory=dict)
 
     @staticmethod
     def print_stats(total, stat_object, outfile):
@@ -119,37 +130,59 @@ class TestStats:
         expected_fail = len(stat_object.expected_fail)
         unexpected_pass = len(stat_object.unexpected_pass)
         skipped = len(stat_object.skipped)
+        too_slow = len(stat_object.too_slow)
         outfile.write("Results:\n")
-        num_okay = total - failed - expected_fail - unexpected_pass - skipped
+        num_okay = total - failed - expected_fail - unexpected_pass - skipped - too_slow
         outfile.write(f"  Ok:                    {num_okay}\n")
         outfile.write(f"  Expected Fail:         {expected_fail}\n")
         outfile.write(f"  Fail:                  {failed}\n")
         outfile.write(f"  Unexpected Pass:       {unexpected_pass}\n")
         outfile.write(f"  Skipped:               {skipped}\n")
+        outfile.write(f"  Too Slow:              {too_slow}\n")
 
     @staticmethod
-    def was_succes(stat_object):
-        return len(stat_object.failed) == 0 and len(stat_object.unexpected_pass) == 0
+    def print_times(stat_object, outfile, count=5):
+        slowest = sorted(stat_object.times.items(), key=lambda item: -item[1])[:count]
+        if slowest:
+            outfile.write("Slowest tests:\n")
+        for (input_file, seconds) in slowest:
+            outfile.write(f"  {seconds:8.3f}s  {input_file}\n")
 
+    @staticmethod
+    def was_succes(stat_object):
+        return (len(stat_object.failed) == 0 and len(stat_object.unexpected_pass) == 0
+                and len(stat_object.too_slow) == 0)
 
-def _perform_test(form, gen_fn, stat_object, outdir, outfile):
+@dataclass
+class _TestResult:
+    input_file: str
+    # The TestStats list the test belongs in, or None if it passed:
+    category: str = None
+    # What to print about the test:
+    message: str = ''
+    # The time taken to generate the output, or None if it wasn't generated:
+    seconds: float = None
+
+def _perform_test(form, gen_fn, outdir):
     input_file, compare_file, opts = form
 
     output_file = os.path.join(outdir, _mangle_input_file(input_file))
 
     options = _get_options(opts)
+    result = _TestResult(input_file)
 
     if options[TestOptions.SKIP]:
-        stat_object.skipped.append(input_file)
-        return
-    should_continue = True
+        result.category = 'skipped'
+        return result
+    outfile = io.StringIO()
+    start = time.perf_counter()
     try:
         gen_fn(input_file, output_file)
     except Exception as err:
         if options[TestOptions.EXPECT_FAIL]:
-            stat_object.expected_fail.append(input_file)
+            result.category = 'expected_fail'
         elif not options[TestOptions.THROWS_EXCEPTION]:
-            stat_object.failed.append(input_file)
+            result.category = 'failed'
             stream = io.StringIO()
             stream.write("Exception thrown during file generation:\n")
             if hasattr(err, 'message'):
@@ -159,40 +192,96 @@ def _perform_test(form, gen_fn, stat_object, outdir, outfile):
             _output_error(input_file, "TEST FAILED",
                           stream.getvalue().rstrip(),
                           outfile)
-        should_continue = False
-    if not should_continue:
-        return
+            result.message = outfile.getvalue()
+        return result
+    result.seconds = time.perf_counter() - start
 
     if not os.path.exists(output_file):
-        stat_object.failed.append(input_file)
+        result.category = 'failed'
         _output_error(input_file, "TEST FAILED",
                       f"File {output_file} wasn't produced.",
                       outfile)
-        return
+        result.message = outfile.getvalue()
+        return result
 
     is_same, diff = _perform_diff(output_file, compare_file)
 
     if not is_same:
         if options[TestOptions.EXPECT_FAIL]:
-            stat_object.expected_fail.append(input_file)
+            result.category = 'expected_fail'
         else:
-            stat_object.failed.append(input_file)
+            result.category = 'failed'
             _output_diff_error(input_file, compare_file, output_file, diff, outfile)
     else:
         if options[TestOptions.EXPECT_FAIL]:
-            stat_object.unexpected_pass.append(input_file)
+            result.category = 'unexpected_pass'
             _output_error(input_file, "UNEXPECTED PASS",
                           "The test unexpectedly passed", outfile)
-
-
-def run_tests(test_forms, gen_fn, outdir, outfile):
+    result.message = outfile.getvalue()
+    return result
+
+def _slow_reason(result, budget, baseline, tolerance, min_slowdown):
+    """ Return why the test took too long, or None if it didn't """
+    if budget is not None and result.seconds > budget:
+        return f"Took {result.seconds:.3f}s, more than its budget of {budget:.3f}s."
+    previous = baseline.get(result.input_file)
+    if previous is not None:
+        allowed = max(previous * (1 + tolerance), previous + min_slowdown)
+        if result.seconds > allowed:
+            return (f"Took {result.seconds:.3f}s, more than the {allowed:.3f}s allowed"
+                    f" by its baseline of {previous:.3f}s.")
+    return None
+
+def _perform_tests(test_forms, gen_fn, outdir, jobs):
+    """ Yield the _TestResult of each test, in order, running up to `jobs` at once """
+    # The tests are run in forked processes, since `gen_fn` usually can't be pickled:
+    return parallel.imap_forked(functools.partial(_perform_test, gen_fn=gen_fn, outdir=outdir),
+                                test_forms, jobs)
+
+def read_baseline(path):
+    """ Return the times recorded by write_baseline, or an empty dict if `path` doesn't exist """
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+def write_baseline(path, stat_object):
+    with open(path, 'w') as f:
+        json.dump(stat_object.times, f, indent=2, sort_keys=True)
+        f.write('\n')
+
+def run_tests(test_forms, gen_fn, outdir, outfile, jobs=1, time_budget=None,
+              baseline=None, tolerance=0.5, min_slowdown=0.05, record_baseline=None):
+    """ Run the tests, printing the results to `outfile`, and return True if they succeeded
+
+    The tests are run in `jobs` forked processes, so `gen_fn` mustn't depend
+    on state shared between tests. A test fails if generating its output
+    takes longer than `time_budget` seconds, or longer than its time in the
+    `baseline` file by more than `tolerance` times that time and more than
+    `min_slowdown` seconds. The time each test took is written to
+    `record_baseline` if it is given.
+    """
     _prep_output_dir(outdir)
 
     stats = TestStats()
-
-    for form in test_forms:
-        _perform_test(form, gen_fn, stats, outdir, outfile)
+    previous_times = read_baseline(baseline) if baseline else {}
+
+    results = _perform_tests(test_forms, gen_fn, outdir, jobs)
+    for (form, result) in zip(test_forms, results):
+        outfile.write(result.message)
+        if result.seconds is not None:
+            stats.times[result.input_file] = result.seconds
+            budget = _get_options(form[2])[TestOptions.TIME_BUDGET] or time_budget
+            reason = _slow_reason(result, budget, previous_times, tolerance, min_slowdown)
+            if reason and not result.category:
+                result.category = 'too_slow'
+                _output_error(result.input_file, "TOO SLOW", reason, outfile)
+        if result.category:
+            getattr(stats, result.category).append(result.input_file)
 
     TestStats.print_stats(len(test_forms), stats, outfile)
+    TestStats.print_times(stats, outfile)
+    if record_baseline:
+        write_baseline(record_baseline, stats)
 
     return TestStats.was_succes(stats)
@@ -1,11 +1,14 @@
-import framework
+import argparse
+import copy
 import os
 import shutil
 import sys
 
-from cl_bindgen.processfile import process_file
+import cl_bindgen.processfile as processfile
 import cl_bindgen.util as util
 
+import framework
+
 def make_gen_fn():
     options = util.build_default_options()
     if clang_dir := util.find_clang_resource_dir():
@@ -14,8 +17,12 @@ def make_gen_fn():
         print('WARNING: Could not find clang include directory. It must be manually added as a clang argument', file=sys.stderr)
 
     def gen_fn(inputfile, outputfile):
-        options.output = outputfile
-        process_file(inputfile, options)
+        # Each test gets its own options and numbers its anonymous enums
+        # from zero, so the tests don't depend on the order they're run in:
+        test_options = copy.copy(options)
+        test_options.output = outputfile
+        processfile._process_enum_decl.anon_count = 0
+        processfile.process_file(inputfile, test_options)
     return gen_fn
 
 tests = [
@@ -38,22 +45,47 @@ tests = [
     ('inputs/constant_array_in_param.h', 'outputs/constant-array-in-param.lisp', {}),
 ]
 
-def test_file_generation():
+def test_file_generation(jobs=1, time_budget=None, baseline=None, tolerance=0.5,
+                         min_slowdown=0.05, record_baseline=None):
     cur_dir = os.getcwd()
     file_dir = os.path.dirname(os.path.realpath(__file__))
     os.chdir(file_dir)
 
     output_dir = ".output"
-    success = framework.run_tests(tests, make_gen_fn(), output_dir, os.sys.stdout)
+    success = framework.run_tests(tests, make_gen_fn(), output_dir, os.sys.stdout,
+                                  jobs=jobs, time_budget=time_budget,
+                                  baseline=baseline and os.path.join(cur_dir, baseline),
+                                  tolerance=tolerance, min_slowdown=min_slowdown,
+                                  record_baseline=record_baseline and os.path.join(cur_dir, record_baseline))
     if success:
         shutil.rmtree(".output")
 
     os.chdir(cur_dir)
     return success
 
+def _parse_args(args):
+    parser = argparse.ArgumentParser(description="Compare cl-bindgen's output with the expected output")
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count(),
+                        help='run N tests at once (default: the number of CPUs)')
+    parser.add_argument('--budget', type=float, dest='time_budget', metavar='SECONDS',
+                        help='fail tests that take longer than SECONDS')
+    parser.add_argument('--baseline', metavar='FILE',
+                        help='fail tests that are slower than the times recorded in FILE')
+    parser.add_argument('--tolerance', type=float, default=0.5,
+                        help='how much slower than the baseline, as a fraction of it, tests may be (default: 0.5)')
+    parser.add_argument('--min-slowdown', type=float, default=0.05, metavar='SECONDS',
+                        help='how many seconds slower than the baseline tests may always be (default: 0.05)')
+    parser.add_argument('--record-baseline', metavar='FILE',
+                        help='record the time each test took in FILE')
+    return parser.parse_args(args)
+
 if __name__ == "__main__":
-    success = test_file_generation()
+    args = _parse_args(sys.argv[1:])
+    success = test_file_generation(jobs=args.jobs, time_budget=args.time_budget,
+                                   baseline=args.baseline, tolerance=args.tolerance,
+                                   min_slowdown=args.min_slowdown,
+                                   record_baseline=args.record_baseline)
     if success:
-        exit(0)
+        sys.exit(0)
     else:
-        exit(1)
+        sys.exit(1)
@@ -0,0 +1,59 @@
+""" Helpers shared by the tests
+"""
+import os
+import tempfile
+import unittest
+
+class TempDirTest(unittest.TestCase):
+    """ Gives each test a temporary directory, `self.dir`, that is removed afterwards """
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def _write(self, name, contents):
+        """ Write `contents` to the file `name` in the temporary directory, returning its path """
+        path = os.path.join(self.dir.name, name)
+        with open(path, 'w') as f:
+            f.write(contents)
+        return path
+
+# Stand-ins for the libclang objects used by the translation unit caches:
+
+class FakeFile:
+    def __init__(self, name):
+        self.name = name
+
+class FakeInclusion:
+    def __init__(self, name):
+        self.include = FakeFile(name)
+
+class FakeTranslationUnit:
+    def __init__(self, includes):
+        self.includes = includes
+        self.reparse_count = 0
+
+    def get_includes(self):
+        return [FakeInclusion(i) for i in self.includes]
+
+    def reparse(self, unsaved_files=None):
+        self.reparse_count += 1
+
+    def save(self, filename):
+        with open(filename, 'w') as f:
+            f.write('ast')
+
+class FakeIndex:
+    def __init__(self, includes=()):
+        self.includes = includes
+        self.parse_count = 0
+
+    def parse(self, path, args=None, unsaved_files=None, options=0):
+        self.parse_count += 1
+        return FakeTranslationUnit(self.includes)
+
+    def read(self, path):
+        with open(path) as f:
+            return f.read()
@@ -1,7 +1,19 @@
+import random
+import string
 import unittest
 
 from cl_bindgen.mangler import CamelCaseConverter
 
+def _reference_mangle(name):
+    result = name[0].lower()
+    for i in range(1, len(name)):
+        cur_char = name[i]
+        prev = name[i-1]
+        if cur_char.isupper() and not prev.isupper() and prev.isalnum():
+            result += '-'
+        result += cur_char.lower()
+    return result
+
 class CamelCaseConverterTest(unittest.TestCase):
     mangler = CamelCaseConverter()
 
@@ -28,3 +40,14 @@ class CamelCaseConverterTest(unittest.TestCase):
     def test_converts_snakecase_names(self):
         result = self.mangler.mangle('GRAVITY_TOP_RIGHT')
         self.assertEqual('gravity_top_right', result)
+
+    def test_converts_non_ascii_names(self):
+        result = self.mangler.mangle('ÜberThingÄrger')
+        self.assertEqual('über-thing-ärger', result)
+
+    def test_matches_reference_implementation(self):
+        rand = random.Random(0)
+        alphabet = string.ascii_letters + string.digits + '_$'
+        for _ in range(2000):
+            name = ''.join(rand.choice(alphabet) for _ in range(rand.randint(1, 20)))
+            self.assertEqual(_reference_mangle(name), self.mangler.mangle(name), name)
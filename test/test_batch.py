@@ -0,0 +1,93 @@
+import os
+
+from cl_bindgen import util
+
+from .helpers import TempDirTest
+
+class BatchFilesTest(TempDirTest):
+
+    def test_documents_with_the_same_output_are_rejected(self):
+        first = self._write('first.yaml', 'output: out.lisp\nfiles: [a.h]\n')
+        second = self._write('second.yaml', 'output: ./out.lisp\nfiles: [b.h]\n')
+        with self.assertRaises(util.BatchException):
+            util.process_batch_files([first, second], util.build_default_options(), jobs=2)
+
+    def test_document_arguments_are_not_shared(self):
+        batch = self._write('batch.yaml',
+                            'output: a.lisp\nfiles: [a.h]\narguments: [-DA]\n'
+                            '---\n'
+                            'output: b.lisp\nfiles: [b.h]\narguments: [-DB]\n')
+        options = util.build_default_options()
+        documents = util._load_documents([batch], options)
+        self.assertEqual(['-DA'], documents[0][1].arguments[len(options.arguments):])
+        self.assertEqual(['-DB'], documents[1][1].arguments[len(options.arguments):])
+        self.assertNotIn('-DA', options.arguments)
+
+_FAKE_PKG_CONFIG = '''#!/bin/sh
+echo run >> "{log}"
+if [ "$1" = --path ]; then
+    echo "{pc_file}"
+else
+    echo "-I$(cat "{pc_file}")"
+fi
+'''
+
+class PkgConfigTest(TempDirTest):
+
+    def setUp(self):
+        super().setUp()
+        self.log = os.path.join(self.dir.name, 'log')
+        self.pc_file = os.path.join(self.dir.name, 'foo.pc')
+        self.include = os.path.join(self.dir.name, 'foo-1.2')
+        os.mkdir(self.include)
+        with open(self.pc_file, 'w') as f:
+            f.write(self.include)
+        bin_dir = os.path.join(self.dir.name, 'bin')
+        os.mkdir(bin_dir)
+        script = os.path.join(bin_dir, 'pkg-config')
+        with open(script, 'w') as f:
+            f.write(_FAKE_PKG_CONFIG.format(log=self.log, pc_file=self.pc_file))
+        os.chmod(script, 0o755)
+        self.path = os.environ['PATH']
+        os.environ['PATH'] = bin_dir + os.pathsep + self.path
+        self.cache_dir = os.path.join(self.dir.name, 'cache')
+
+    def tearDown(self):
+        os.environ['PATH'] = self.path
+        util._lookup_cache._caches.clear()
+        self.dir.cleanup()
+
+    def _flags(self):
+        # Start each lookup as a new run would:
+        util._lookup_cache._caches.clear()
+        return util._pkg_config_flags(['foo'], util._lookup_cache(self.cache_dir))
+
+    def _runs(self):
+        with open(self.log) as f:
+            return len(f.readlines())
+
+    def test_flags_are_cached(self):
+        self.assertEqual([f'-I{self.include}'], self._flags())
+        runs = self._runs()
+        self.assertEqual([f'-I{self.include}'], self._flags())
+        self.assertEqual(runs, self._runs())
+
+    def test_upgraded_package_invalidates_flags(self):
+        self._flags()
+        upgraded = os.path.join(self.dir.name, 'foo-1.3')
+        os.rename(self.include, upgraded)
+        with open(self.pc_file, 'w') as f:
+            f.write(upgraded)
+        self.assertEqual([f'-I{upgraded}'], self._flags())
+
+    def test_missing_include_directory_invalidates_flags(self):
+        self._flags()
+        runs = self._runs()
+        os.rmdir(self.include)
+        self._flags()
+        self.assertGreater(self._runs(), runs)
+
+    def test_package_files_are_only_found_for_the_disk_cache(self):
+        self.cache_dir = None
+        self.assertEqual([f'-I{self.include}'], self._flags())
+        self.assertEqual(1, self._runs())
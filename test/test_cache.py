@@ -0,0 +1,145 @@
+import contextlib
+import glob
+import io
+import os
+
+import cl_bindgen.processfile as processfile
+from cl_bindgen.cache import HeaderCache, LookupCache, TranslationUnitCache
+from cl_bindgen.processfile import ProcessOptions
+
+from .helpers import FakeIndex, FakeTranslationUnit, TempDirTest
+
+class TranslationUnitCacheTest(TempDirTest):
+
+    def setUp(self):
+        super().setUp()
+        self.header = self._write('header.h', 'int a;')
+        self.include = self._write('include.h', 'int b;')
+        self.cache = TranslationUnitCache(os.path.join(self.dir.name, 'cache'), None)
+
+    def test_missing_entry_is_not_loaded(self):
+        key = self.cache.key(self.header, [], 0)
+        self.assertIsNone(self.cache.load(FakeIndex(), key))
+
+    def test_stored_entry_is_loaded(self):
+        key = self.cache.key(self.header, ['-DFOO'], 0)
+        self.cache.store(key, FakeTranslationUnit([self.include]))
+        self.assertEqual('ast', self.cache.load(FakeIndex(), key))
+
+    def test_key_depends_on_arguments_and_contents(self):
+        key = self.cache.key(self.header, ['-DFOO'], 0)
+        self.assertNotEqual(key, self.cache.key(self.header, ['-DBAR'], 0))
+        self._write('header.h', 'int c;')
+        self.assertNotEqual(key, self.cache.key(self.header, ['-DFOO'], 0))
+
+    def test_changed_include_invalidates_entry(self):
+        key = self.cache.key(self.header, [], 0)
+        self.cache.store(key, FakeTranslationUnit([self.include]))
+        self._write('include.h', 'int d;')
+        self.assertIsNone(self.cache.load(FakeIndex(), key))
+
+class HeaderCacheTest(TranslationUnitCacheTest):
+
+    def setUp(self):
+        super().setUp()
+        self.cache = HeaderCache(os.path.join(self.dir.name, 'cache'), None, 1)
+
+    def test_stored_entry_is_loaded(self):
+        key = self.cache.key(self.header, ['-DFOO'], 0)
+        self.cache.store(key, b'header', [self.include])
+        self.assertEqual(b'header', self.cache.load(key))
+
+    def test_missing_entry_is_not_loaded(self):
+        self.assertIsNone(self.cache.load(self.cache.key(self.header, [], 0)))
+
+    def test_changed_include_invalidates_entry(self):
+        key = self.cache.key(self.header, [], 0)
+        self.cache.store(key, b'header', [self.include])
+        self._write('include.h', 'int d;')
+        self.assertIsNone(self.cache.load(key))
+
+    def test_key_depends_on_version_and_given_path(self):
+        key = self.cache.key(self.header, [], 0)
+        other_version = HeaderCache(os.path.join(self.dir.name, 'cache'), None, 2)
+        self.assertNotEqual(key, other_version.key(self.header, [], 0))
+        relative = os.path.relpath(self.header)
+        self.assertNotEqual(key, self.cache.key(relative, [], 0))
+
+class LookupCacheTest(TempDirTest):
+
+    def setUp(self):
+        super().setUp()
+        self.calls = 0
+
+    def _compute(self, value):
+        def compute():
+            self.calls += 1
+            return value
+        return compute
+
+    def test_value_is_computed_once_per_run(self):
+        cache = LookupCache()
+        self.assertEqual(['-Ia'], cache.get('key', self._compute(['-Ia'])))
+        self.assertEqual(['-Ia'], cache.get('key', self._compute(['-Ib'])))
+        self.assertEqual(1, self.calls)
+
+    def test_value_is_reused_across_runs(self):
+        LookupCache(self.dir.name).get('key', self._compute('/include'))
+        self.assertEqual('/include', LookupCache(self.dir.name).get('key', self._compute('/other')))
+        self.assertEqual(1, self.calls)
+
+    def test_invalid_value_is_recomputed(self):
+        LookupCache(self.dir.name).get('key', self._compute('/include'))
+        value = LookupCache(self.dir.name).get('key', self._compute('/other'), valid_p=lambda v: False)
+        self.assertEqual('/other', value)
+
+    def test_none_is_not_cached(self):
+        cache = LookupCache(self.dir.name)
+        self.assertIsNone(cache.get('key', self._compute(None)))
+        self.assertEqual('/include', cache.get('key', self._compute('/include')))
+
+_NESTED_HEADER = '''
+struct outer {
+    union {
+        int a;
+        float b;
+    };
+};
+'''
+
+class CachedTranslationUnitTest(TempDirTest):
+
+    def setUp(self):
+        super().setUp()
+        self._write('nested.h', _NESTED_HEADER)
+        self.cwd = os.getcwd()
+        os.chdir(self.dir.name)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        super().tearDown()
+
+    def _process(self, **kwargs):
+        options = ProcessOptions(output='out.lisp', depfile='out.d', **kwargs)
+        processfile._process_enum_decl.anon_count = 0
+        processfile.process_files(['nested.h'], options)
+        with open('out.lisp') as output, open('out.d') as depfile:
+            return (output.read(), depfile.read())
+
+    def test_loaded_translation_unit_uses_given_names(self):
+        uncached = self._process(evaluate_macros=True)
+        self.assertIn('(anonymous at nested.h:3:5)', uncached[0])
+        self._process(cache_dir='cache')
+        # The extracted declarations aren't cached with these options, but
+        # the translation unit is:
+        self.assertEqual(uncached, self._process(cache_dir='cache', evaluate_macros=True))
+
+    def test_corrupt_header_entry_is_replaced(self):
+        uncached = self._process()
+        self._process(cache_dir='cache')
+        for entry in glob.glob('cache/headers/*.ir'):
+            with open(entry, 'wb') as f:
+                f.write(b'corrupt')
+        with contextlib.redirect_stderr(io.StringIO()) as stderr:
+            self.assertEqual(uncached, self._process(cache_dir='cache'))
+        self.assertIn('Could not load the cached declarations of nested.h', stderr.getvalue())
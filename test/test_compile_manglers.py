@@ -0,0 +1,46 @@
+import unittest
+
+from cl_bindgen import mangler
+
+class _CountingMangler:
+
+    def __init__(self):
+        self.calls = 0
+
+    def can_mangle(self, string):
+        return True
+
+    def mangle(self, string):
+        self.calls = self.calls + 1
+        return string + '!'
+
+class CompileManglersTest(unittest.TestCase):
+
+    def test_applies_manglers_in_order(self):
+        manglers = [mangler.UnderscoreMangler(), mangler.ConstantMangler()]
+        compiled = mangler.compile_manglers(manglers)
+        self.assertEqual('+foo-bar+', compiled('FOO_BAR'))
+
+    def test_skips_manglers_that_cannot_mangle(self):
+        manglers = [mangler.KeywordMangler(), mangler.UnderscoreMangler()]
+        compiled = mangler.compile_manglers(manglers)
+        self.assertEqual('pkg:foo-bar', compiled('pkg:foo_bar'))
+        self.assertEqual(':foo-bar', compiled('foo_bar'))
+
+    def test_matches_uncompiled_manglers(self):
+        manglers = [mangler.CamelCaseConverter(), mangler.PrefixMangler('wlr-', 'wlr:'),
+                    mangler.UnderscoreMangler(), mangler.RegexSubMangler('^wlr:', 'w:')]
+        compiled = mangler.compile_manglers(manglers)
+        for name in ['wlr_output_state', 'wlrOutput', 'WLR_THING', 'x', 'SDL_testThing']:
+            expected = name
+            for m in manglers:
+                if m.can_mangle(expected):
+                    expected = m.mangle(expected)
+            self.assertEqual(expected, compiled(name))
+
+    def test_results_are_memoized(self):
+        counter = _CountingMangler()
+        compiled = mangler.compile_manglers([counter])
+        compiled('foo')
+        compiled('foo')
+        self.assertEqual(1, counter.calls)
@@ -0,0 +1,55 @@
+import os
+import unittest
+
+import cl_bindgen.processfile as processfile
+from cl_bindgen import util
+from cl_bindgen.depfile import format_depfile
+from cl_bindgen.options import ProcessOptions
+
+from .helpers import TempDirTest
+
+class FormatDepfileTest(unittest.TestCase):
+
+    def test_one_dependency_per_line(self):
+        self.assertEqual('out.lisp: \\\n a.h \\\n b.h\n', format_depfile('out.lisp', ['a.h', 'b.h']))
+
+    def test_special_characters_are_escaped(self):
+        self.assertEqual('out.lisp: \\\n my\\ dir/\\#a$$.h\n',
+                         format_depfile('out.lisp', ['my dir/#a$.h']))
+
+class DepfileTest(TempDirTest):
+
+    def test_includes_are_listed(self):
+        included = self._write('included.h', 'int g(void);\n')
+        header = self._write('main.h', '#include "included.h"\nint f(void);\n')
+        output = os.path.join(self.dir.name, 'out.lisp')
+        options = ProcessOptions(output=output, depfile=ProcessOptions.DEPFILE_NEXT_TO_OUTPUT)
+        dependencies = processfile.process_file(header, options)
+        with open(output + '.d') as f:
+            text = f.read()
+        self.assertEqual(format_depfile(output, dependencies), text)
+        self.assertIn(header, text)
+        self.assertIn(os.path.basename(included), text)
+
+    def test_batch_option(self):
+        batch = self._write('batch.yaml',
+                            'output: a.lisp\nfiles: [a.h]\ndepfile: True\n'
+                            '---\n'
+                            'output: b.lisp\nfiles: [b.h]\ndepfile: deps/b.d\n'
+                            '---\n'
+                            'output: c.lisp\nfiles: [c.h]\ndepfile: False\n')
+        options = util.build_default_options()
+        options.depfile = ProcessOptions.DEPFILE_NEXT_TO_OUTPUT
+        documents = util._load_documents([batch], options)
+        self.assertEqual(['a.lisp.d', 'deps/b.d', None],
+                         [ProcessOptions.depfile_path(o) for (_, o) in documents])
+
+    def test_batch_option_requires_an_output_file(self):
+        batch = self._write('batch.yaml', 'output: ":stdout"\nfiles: [a.h]\ndepfile: True\n')
+        with self.assertRaises(util.BatchException):
+            util._load_documents([batch], util.build_default_options())
+
+    def test_invalid_batch_option(self):
+        batch = self._write('batch.yaml', 'output: a.lisp\nfiles: [a.h]\ndepfile: 3\n')
+        with self.assertRaises(util.BatchException):
+            util._load_documents([batch], util.build_default_options())
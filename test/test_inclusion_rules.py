@@ -1,6 +1,7 @@
 import unittest
 
 from cl_bindgen.inclusion_rules import process_inclusion_rules
+
 class PointerExpansionTest(unittest.TestCase):
 
     def test_include_and_empty_match_field(self):
@@ -76,3 +77,28 @@ class PointerExpansionTest(unittest.TestCase):
         self.assertTrue(all([ not result(i) for i in banned]))
         actual_allowed = ['cheese', 'curds']
         self.assertTrue(all([ result(i) for i in actual_allowed]))
+
+    def test_exclude_match_applies_with_include_list(self):
+        rules = {
+            'exclude': {
+                'match': '_state$'
+            },
+            'include': {
+                'names': ['wlr_box', 'wlr_output_state']
+            }
+        }
+        result = process_inclusion_rules(rules, 'names')
+        self.assertTrue(result('wlr_box'))
+        self.assertFalse(result('wlr_output_state'))
+        self.assertFalse(result('wlr_cursor'))
+
+    def test_regexes_with_backreferences_work(self):
+        rules = {
+            'include': {
+                'match': ['^(a)b\\1$', 'foo']
+            }
+        }
+        result = process_inclusion_rules(rules, 'names')
+        self.assertTrue(result('aba'))
+        self.assertTrue(result('foobar'))
+        self.assertFalse(result('abb'))
@@ -0,0 +1,70 @@
+""" Microbenchmark for the functions built by make_batch_determiner
+
+Run this file directly to print the timings.
+"""
+import random
+import re
+import time
+import unittest
+
+from cl_bindgen.inclusion_rules import make_batch_determiner
+
+_NUM_NAMES = 100000
+
+def _synthetic_names(count, seed=0):
+    rand = random.Random(seed)
+    prefixes = ['wlr', 'wl', 'xkb', 'pixman', 'drm', 'egl', 'gl']
+    parts = ['output', 'cursor', 'seat', 'surface', 'buffer', 'state', 'box',
+             'input', 'device', 'backend', 'renderer', 'allocator', 'scene']
+    names = []
+    for _ in range(count):
+        words = [rand.choice(prefixes)] + rand.sample(parts, rand.randint(1, 3))
+        names.append('_'.join(words))
+    return names
+
+def _synthetic_rules():
+    include_names = ['wlr_box', 'wl_display', 'xkb_state']
+    exclude_names = ['wlr_backend', 'wlr_output_state']
+    include_regexes = [f'^{p}_.*' for p in ['wlr_cursor', 'wlr_input', 'wlr_scene', 'wl_seat']]
+    include_regexes.extend(f'{part}$' for part in ['buffer', 'surface', 'device'])
+    exclude_regexes = ['_allocator', '^drm_', 'renderer_state']
+    return (include_names, exclude_names, include_regexes, exclude_regexes)
+
+def _reference_determiner(whitelist, blacklist, include_matcher, exclude_matcher):
+    """ Checks each regex one at a time and doesn't remember its results """
+    includer = [re.compile(r) for r in include_matcher]
+    excluder = [re.compile(r) for r in exclude_matcher]
+    def determiner(name):
+        if name in blacklist or any(r.search(name) for r in excluder):
+            return False
+        return name in whitelist or any(r.search(name) for r in includer)
+    return determiner
+
+def _time_determiner(determiner, names):
+    start = time.perf_counter()
+    results = [determiner(name) for name in names]
+    return (time.perf_counter() - start, results)
+
+class DeterminerBenchmark(unittest.TestCase):
+
+    def test_matches_reference_on_synthetic_names(self):
+        names = _synthetic_names(_NUM_NAMES)
+        rules = _synthetic_rules()
+        _, expected = _time_determiner(_reference_determiner(*rules), names)
+        _, actual = _time_determiner(make_batch_determiner(*rules), names)
+        self.assertEqual(expected, actual)
+
+def main():
+    names = _synthetic_names(_NUM_NAMES)
+    rules = _synthetic_rules()
+    reference_time, _ = _time_determiner(_reference_determiner(*rules), names)
+    determiner = make_batch_determiner(*rules)
+    first_time, _ = _time_determiner(determiner, names)
+    second_time, _ = _time_determiner(determiner, names)
+    print(f'{len(names)} names, {len(set(names))} unique')
+    print(f'  regex list:              {reference_time:.3f}s')
+    print(f'  make_batch_determiner:   {first_time:.3f}s')
+    print(f'  again, with memoization: {second_time:.3f}s')
+
+if __name__ == '__main__':
+    main()
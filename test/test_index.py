@@ -0,0 +1,106 @@
+import os
+
+import cl_bindgen.index as index
+import cl_bindgen.mangler as mangler
+import cl_bindgen.processfile as processfile
+from cl_bindgen.options import ProcessOptions
+from cl_bindgen.util import build_default_options
+
+from .helpers import TempDirTest
+
+_TYPES = '''
+#ifndef TYPES_H
+#define TYPES_H
+typedef struct { int x; int y; } point;
+struct unused { int z; };
+enum color { RED, GREEN };
+typedef unsigned long size;
+#endif
+'''
+
+_API = '''
+#include "types.h"
+#define API_VERSION 3
+point move(point p, size n);
+int paint(enum color c, point *p);
+extern const char *name;
+'''
+
+class SymbolIndexTest(TempDirTest):
+
+    def setUp(self):
+        super().setUp()
+        self.types = self._write('types.h', _TYPES)
+        self.api = self._write('api.h', _API)
+        self.database = os.path.join(self.dir.name, 'symbols.db')
+        self.options = build_default_options()
+
+    def _update(self, options=None):
+        with index.SymbolIndex(self.database) as symbol_index:
+            return symbol_index.update([self.api, self.types], options or self.options)
+
+    def _symbols(self, *args, **kwargs):
+        with index.SymbolIndex(self.database, read_only=True) as symbol_index:
+            return symbol_index.symbols(*args, **kwargs)
+
+    def test_symbols(self):
+        self._update()
+        [move] = self._symbols('move')
+        self.assertEqual(('function', 'c:@F@move', self.api, 4, 'move'),
+                         (move.kind, move.usr, move.file, move.line, move.lisp_name))
+        [version] = self._symbols('API_*')
+        self.assertEqual(('macro', '+api-version+'), (version.kind, version.lisp_name))
+        self.assertEqual(['point', 'size'], [s.name for s in self._symbols(kind='typedef')])
+        self.assertEqual(['move', 'paint'],
+                         [s.name for s in self._symbols(references='point', kind='function')])
+        self.assertEqual(['paint'], [s.name for s in self._symbols(references='color')])
+
+    def test_unchanged_files_are_not_parsed(self):
+        self.assertEqual([self.api, self.types], self._update())
+        self.assertEqual([], self._update())
+
+        self._write('types.h', _TYPES.replace('#endif', 'typedef int added;\n#endif'))
+        # api.h includes types.h, so both are parsed again:
+        self.assertEqual([self.api, self.types], self._update())
+        self.assertEqual(['added'], [s.name for s in self._symbols('add*')])
+
+    def test_changed_manglers_rename_without_parsing(self):
+        self._update()
+        options = build_default_options()
+        options.type_manglers.append(mangler.PrefixMangler('', 'c-'))
+        self.assertEqual([], self._update(options))
+        [move] = self._symbols('move')
+        self.assertEqual('c-move', move.lisp_name)
+
+    def test_missing_headers_are_removed(self):
+        self._update()
+        os.unlink(self.api)
+        with index.SymbolIndex(self.database) as symbol_index:
+            symbol_index.update([self.types], self.options)
+        self.assertEqual([], self._symbols('move'))
+
+    def test_generate_matches_files_command(self):
+        self._update()
+        generated = os.path.join(self.dir.name, 'generated.lisp')
+        options = build_default_options()
+        options.output = generated
+        with index.SymbolIndex(self.database, read_only=True) as symbol_index:
+            symbol_index.generate(['paint'], options)
+
+        expected = os.path.join(self.dir.name, 'expected.lisp')
+        options = build_default_options()
+        options.output = expected
+        options.root_p = lambda name: name == 'paint'
+        processfile.process_files([self.api, self.types], options)
+        with open(generated) as g, open(expected) as e:
+            self.assertEqual(e.read(), g.read())
+
+    def test_generate_unknown_symbol(self):
+        self._update()
+        with (index.SymbolIndex(self.database, read_only=True) as symbol_index,
+              self.assertRaises(index.SymbolIndexError)):
+            symbol_index.generate(['missing'], ProcessOptions())
+
+    def test_read_only_requires_index(self):
+        with self.assertRaises(index.SymbolIndexError):
+            index.SymbolIndex(os.path.join(self.dir.name, 'missing.db'), read_only=True)
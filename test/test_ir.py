@@ -0,0 +1,125 @@
+import os
+import re
+
+import cl_bindgen.ir as ir
+import cl_bindgen.mangler as mangler
+import cl_bindgen.processfile as processfile
+from cl_bindgen.processfile import ProcessOptions
+
+from .helpers import TempDirTest
+
+def _location(line):
+    return ir.Location('point.h', line, 1)
+
+def _header():
+    int_type = ir.BuiltinType(':int')
+    point = ir.Record(False, 'point_t', 1, False, True, None,
+                      [ir.Field('x_pos', False, int_type, None),
+                       ir.Field('y_pos', False, int_type, None)],
+                      _location(1))
+    point_ptr = ir.PointerType(ir.RecordType(False, 'point_t'), 'struct point_t')
+    move = ir.Function('move_point', int_type, False, None,
+                       [('point', point_ptr), ('delta_x', int_type)], _location(2))
+    return ir.Header('point.h', [point, move], ['point.h'])
+
+class IntermediateRepresentationTest(TempDirTest):
+
+    def _render(self, header, **kwargs):
+        output = os.path.join(self.dir.name, 'output.lisp')
+        processfile.render_headers([header], ProcessOptions(output=output, **kwargs))
+        with open(output) as f:
+            return f.read()
+
+    def test_round_trip_keeps_shared_nodes(self):
+        header = ir.loads(ir.dumps(_header()))
+        (point, move) = header.declarations
+        self.assertEqual('move_point', move.spelling)
+        self.assertIs(point.fields[0].type, move.arguments[1][1])
+        self.assertEqual(['point.h'], header.dependencies)
+
+    def test_other_version_is_rejected(self):
+        data = ir.dumps(_header())
+        old_version = ir.VERSION
+        ir.VERSION = old_version + 1
+        try:
+            with self.assertRaises(ValueError):
+                ir.loads(data)
+        finally:
+            ir.VERSION = old_version
+
+    def test_render_with_different_options(self):
+        header = _header()
+        plain = self._render(header)
+        self.assertIn('(cffi:defcstruct point_t\n  (x_pos :int)\n  (y_pos :int))', plain)
+        self.assertIn('(point (:pointer (:struct point_t)))', plain)
+
+        mangled = self._render(header,
+                               type_manglers=[mangler.UnderscoreMangler()],
+                               name_manglers=[mangler.UnderscoreMangler()],
+                               expand_pointer_p=lambda s: False)
+        self.assertIn('(cffi:defcstruct point-t\n  (x-pos :int)\n  (y-pos :int))', mangled)
+        self.assertIn('("move_point" move-point)', mangled)
+        self.assertIn('(point :pointer #| (:struct point-t) |#)', mangled)
+
+    def test_excluded_declarations_are_not_rendered(self):
+        rendered = self._render(_header(), declaration_p=lambda name: name != 'point_t')
+        self.assertNotIn('defcstruct', rendered)
+        self.assertIn('"move_point"', rendered)
+
+    def test_unsupported_type_raises_when_rendered(self):
+        error = processfile.ProcessingError('Unsupported', _location(3))
+        var = ir.Var('thing', ir.Unsupported(error), 2, False, None, _location(3))
+        header = ir.Header('point.h', [var], ['point.h'])
+        self.assertNotIn('thing', self._render(header, declaration_p=lambda name: False))
+        with self.assertRaises(processfile.ProcessingError):
+            self._render(header)
+
+_FILTERED_HEADER = '''
+typedef struct { int x; } point;
+struct hidden { int y; };
+enum { FIRST, SECOND };
+int kept(point p);
+int skipped(struct hidden *h);
+'''
+
+class ExtractionFilterTest(TempDirTest):
+
+    def _process(self, **kwargs):
+        header = self._write('filtered.h', _FILTERED_HEADER)
+        output = os.path.join(self.dir.name, 'output.lisp')
+        options = ProcessOptions(output=output,
+                                 declaration_p=lambda name: name not in ('hidden', 'skipped'),
+                                 **kwargs)
+        extracted = []
+        original = processfile._extract_declarations._extract_table
+        processfile._extract_declarations._extract_table = {
+            kind: (lambda cursor, extract=extract: extracted.append(cursor.spelling) or extract(cursor))
+            for (kind, extract) in original.items()
+        }
+        try:
+            processfile.process_files([header], options)
+        finally:
+            processfile._extract_declarations._extract_table = original
+        with open(output) as f:
+            # Anonymous enums are numbered across runs:
+            return (extracted, re.sub(r'anon-enum-\d+', 'anon-enum', f.read()))
+
+    def test_excluded_declarations_are_not_extracted(self):
+        (extracted, rendered) = self._process()
+        self.assertNotIn('hidden', extracted)
+        self.assertNotIn('skipped', extracted)
+        self.assertIn('point', extracted)
+        self.assertIn('"kept"', rendered)
+        self.assertIn('(FIRST 0)', rendered)
+        self.assertNotIn('hidden', rendered)
+
+    def test_cached_headers_are_filtered_when_rendered(self):
+        (_, uncached) = self._process()
+        cache_dir = os.path.join(self.dir.name, 'cache')
+        (extracted, cached) = self._process(cache_dir=cache_dir)
+        self.assertIn('skipped', extracted)
+        self.assertEqual(uncached, cached)
+        # The second run loads the header from the cache:
+        (extracted, cached) = self._process(cache_dir=cache_dir)
+        self.assertEqual([], extracted)
+        self.assertEqual(uncached, cached)
@@ -0,0 +1,58 @@
+import os
+import unittest
+
+import clang.cindex as clang
+
+import cl_bindgen.macro_eval as macro_eval
+import cl_bindgen.macro_util as macro_util
+import cl_bindgen.processfile as processfile
+from cl_bindgen.processfile import ProcessOptions
+
+from .helpers import TempDirTest
+
+_HEADER = '''
+#define SHIFTED (1 << 4)
+#define COMBINED (SHIFTED | 2)
+#define RATIO (1.5f * 2)
+#define ALL_BITS 0xffffffffffffffffULL
+#define NOT_AN_EXPRESSION int
+#define AFTER_ERROR (COMBINED + 1)
+'''
+
+class EvaluateMacrosTest(TempDirTest):
+
+    def setUp(self):
+        super().setUp()
+        self.header = self._write('macros.h', _HEADER)
+
+    def test_constant_expressions_are_evaluated(self):
+        names = ['SHIFTED', 'COMBINED', 'RATIO', 'ALL_BITS', 'NOT_AN_EXPRESSION', 'AFTER_ERROR']
+        values = macro_eval.evaluate_macros(clang.Index.create(), [self.header], names, [])
+        self.assertEqual([16, 18, 3.0, 2**64 - 1, None, 19], values)
+
+    def test_evaluated_macros_are_output(self):
+        output = os.path.join(self.dir.name, 'output.lisp')
+        options = ProcessOptions(output=output, evaluate_macros=True,
+                                 constant_manglers=[])
+        processfile.process_file(self.header, options)
+        with open(output) as f:
+            text = f.read()
+        self.assertIn('(defconstant COMBINED 18)', text)
+        self.assertIn('(defconstant RATIO 3.0d0)', text)
+        self.assertIn('(defconstant NOT_AN_EXPRESSION ACTUAL_VALUE_HERE)', text)
+
+    def test_function_like_macros_are_only_checked_when_evaluating(self):
+        path = self._write('function_like.h', '#define TWICE(x) ((x) * 2)\n#define TWO 2\n')
+        [header] = processfile.extract_files([path], ProcessOptions())
+        self.assertEqual([None, None], [node.is_function_like for node in header.declarations])
+        [header] = processfile.extract_files([path], ProcessOptions(evaluate_macros=True))
+        self.assertEqual([True, False], [node.is_function_like for node in header.declarations])
+
+class ConvertValueTest(unittest.TestCase):
+
+    def test_integers(self):
+        self.assertEqual('-3', macro_util.convert_value(-3))
+
+    def test_floats_are_doubles(self):
+        self.assertEqual('0.5d0', macro_util.convert_value(0.5))
+        self.assertEqual('1d+20', macro_util.convert_value(1e20))
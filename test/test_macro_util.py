@@ -0,0 +1,25 @@
+import unittest
+
+from cl_bindgen.macro_util import header_guard_p, macro_matches_file_path
+
+class MacroMatchesFilePathTest(unittest.TestCase):
+
+    def test_guard_matches(self):
+        self.assertTrue(macro_matches_file_path('/usr/include/lib/header.h', 'LIB_HEADER_H'))
+
+    def test_repeated_files_give_the_same_answers(self):
+        for _ in range(2):
+            self.assertTrue(macro_matches_file_path('/include/other.h', 'OTHER_H'))
+            self.assertTrue(macro_matches_file_path('/include/other.h', 'INCLUDE_OTHER_H'))
+
+class HeaderGuardTest(unittest.TestCase):
+
+    def _detector(self, file_name, macro_name):
+        return macro_name.endswith('_H')
+
+    def test_detector_answers(self):
+        self.assertTrue(header_guard_p('/include/a.h', 'A_H', self._detector))
+        self.assertFalse(header_guard_p('/include/a.h', 'HAVE_A', self._detector))
+
+    def test_missing_detector(self):
+        self.assertFalse(header_guard_p('/include/a.h', 'A_H', None))
@@ -0,0 +1,32 @@
+
+from cl_bindgen import manifest
+
+from .helpers import TempDirTest
+
+class ManifestTest(TempDirTest):
+
+    def setUp(self):
+        super().setUp()
+        self.header = self._write('header.h', 'int a;')
+        self.output = self._write('output.lisp', '(cffi:defcvar "a" :int)')
+
+    def test_missing_manifest_is_not_up_to_date(self):
+        self.assertFalse(manifest.is_up_to_date(self.output, 'key'))
+
+    def test_unchanged_output_is_up_to_date(self):
+        manifest.write_manifest(self.output, 'key', [self.header])
+        self.assertTrue(manifest.is_up_to_date(self.output, 'key'))
+
+    def test_different_fingerprint_is_not_up_to_date(self):
+        manifest.write_manifest(self.output, 'key', [self.header])
+        self.assertFalse(manifest.is_up_to_date(self.output, 'other-key'))
+
+    def test_changed_dependency_is_not_up_to_date(self):
+        manifest.write_manifest(self.output, 'key', [self.header])
+        self._write('header.h', 'int b;')
+        self.assertFalse(manifest.is_up_to_date(self.output, 'key'))
+
+    def test_modified_output_is_not_up_to_date(self):
+        manifest.write_manifest(self.output, 'key', [self.header])
+        self._write('output.lisp', '')
+        self.assertFalse(manifest.is_up_to_date(self.output, 'key'))
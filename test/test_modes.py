@@ -0,0 +1,122 @@
+import glob
+import os
+
+import cl_bindgen.processfile as processfile
+import cl_bindgen.util as util
+from cl_bindgen.processfile import ProcessOptions
+
+from .helpers import TempDirTest
+
+_INTEGRATED_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'integrated')
+
+# These define the same names as other inputs, so they can't be parsed together:
+_CONFLICTING_INPUTS = ['inputs/multiple_forward_decls.h', 'inputs/nested_struct.h',
+                       'inputs/simple_struct.h', 'inputs/typedef.h']
+
+class ModeEquivalenceTest(TempDirTest):
+    """ Checks that the ways of processing the integrated test inputs give the same output """
+
+    def setUp(self):
+        super().setUp()
+        self.cwd = os.getcwd()
+        os.chdir(_INTEGRATED_DIR)
+        self.arguments = []
+        self.inputs = sorted(glob.glob('inputs/*.h'))
+        if clang_dir := util.find_clang_resource_dir():
+            self.arguments.append('-I' + clang_dir)
+        else:
+            self.inputs.remove('inputs/standard_types.h')
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        super().tearDown()
+
+    def _process(self, inputs, **kwargs):
+        output = os.path.join(self.dir.name, 'out.lisp')
+        depfile_path = os.path.join(self.dir.name, 'out.d')
+        options = ProcessOptions(output=output, depfile=depfile_path, arguments=self.arguments,
+                                 **kwargs)
+        processfile._process_enum_decl.anon_count = 0
+        processfile.process_files(inputs, options)
+        with open(output) as f, open(depfile_path) as depfile:
+            return (f.read(), depfile.read())
+
+    def test_jobs(self):
+        self.assertEqual(self._process(self.inputs), self._process(self.inputs, jobs=4))
+
+    def test_stream_output(self):
+        self.assertEqual(self._process(self.inputs), self._process(self.inputs, stream_output=True))
+
+    def test_cache_dir(self):
+        serial = self._process(self.inputs)
+        cache_dir = os.path.join(self.dir.name, 'cache')
+        self.assertEqual(serial, self._process(self.inputs, cache_dir=cache_dir))
+        # Everything is loaded from the cache this time:
+        self.assertEqual(serial, self._process(self.inputs, cache_dir=cache_dir))
+
+    def test_umbrella_cache_dir(self):
+        inputs = [f for f in self.inputs if f not in _CONFLICTING_INPUTS]
+        serial = self._process(inputs)
+        cache_dir = os.path.join(self.dir.name, 'cache')
+        self.assertEqual(serial, self._process(inputs, umbrella=True, cache_dir=cache_dir))
+        self.assertEqual(serial, self._process(inputs, umbrella=True, cache_dir=cache_dir))
+
+    def test_umbrella(self):
+        inputs = [f for f in self.inputs if f not in _CONFLICTING_INPUTS]
+        self.assertEqual(self._process(inputs), self._process(inputs, umbrella=True))
+
+    def test_umbrella_with_conflicting_inputs(self):
+        # The files are parsed separately instead:
+        self.assertEqual(self._process(self.inputs), self._process(self.inputs, umbrella=True))
+
+    def test_umbrella_with_repeated_input(self):
+        inputs = ['inputs/enums.h', 'inputs/nested_anonymous_records.h', 'inputs/enums.h']
+        self.assertEqual(self._process(inputs), self._process(inputs, umbrella=True))
+
+class UmbrellaIncludesTest(TempDirTest):
+
+    def setUp(self):
+        super().setUp()
+        os.makedirs(os.path.join(self.dir.name, 'include', 'detail'))
+        self._write('include/first.h', '#ifndef FIRST_H\n#define FIRST_H\n'
+                    '#include "common.h"\nstruct first { struct common c; };\n#endif\n')
+        self._write('include/second.h', '#ifndef SECOND_H\n#define SECOND_H\n'
+                    '#include "common.h"\nstruct { int a; } second;\n#endif\n')
+        self._write('include/common.h', '#ifndef COMMON_H\n#define COMMON_H\n'
+                    '#include "detail/value.h"\nstruct common { value v; };\n#endif\n')
+        self._write('include/detail/value.h', '#ifndef VALUE_H\n#define VALUE_H\n'
+                    'typedef int value;\n#endif\n')
+        self.cwd = os.getcwd()
+        os.chdir(self.dir.name)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        super().tearDown()
+
+    def _extract(self, **kwargs):
+        processfile._process_enum_decl.anon_count = 0
+        return processfile.extract_files(['include/first.h', 'include/second.h'],
+                                         ProcessOptions(**kwargs))
+
+    def test_headers_only_depend_on_their_includes(self):
+        headers = self._extract(umbrella=True)
+        self.assertEqual(['include/first.h', 'include/common.h', 'include/detail/value.h'],
+                         headers[0].dependencies)
+        self.assertEqual(['include/second.h', 'include/common.h', 'include/detail/value.h'],
+                         headers[1].dependencies)
+        self.assertEqual(['FIRST_H', 'first'], [node.spelling for node in headers[0].declarations])
+
+    def _spellings(self, headers):
+        return [[node.spelling for node in header.declarations] for header in headers]
+
+    def test_unnamed_records_have_serial_names(self):
+        headers = self._extract(umbrella=True)
+        self.assertIn('struct (unnamed at include/second.h:4:1)', self._spellings(headers)[1])
+        self.assertEqual(self._spellings(self._extract()), self._spellings(headers))
+
+    def test_cached_translation_unit(self):
+        self._extract(umbrella=True, cache_dir='cache')
+        headers = self._extract(umbrella=True, cache_dir='cache')
+        self.assertEqual([h.dependencies for h in self._extract()],
+                         [h.dependencies for h in headers])
+        self.assertEqual(self._spellings(self._extract()), self._spellings(headers))
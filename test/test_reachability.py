@@ -0,0 +1,59 @@
+import os
+
+import cl_bindgen.processfile as processfile
+from cl_bindgen.options import ProcessOptions
+
+from .helpers import TempDirTest
+
+_TYPES = '''
+#ifndef TYPES_H
+#define TYPES_H
+typedef struct { int x; int y; } point;
+struct unused { int z; };
+enum color { RED, GREEN };
+typedef unsigned long size;
+struct node { struct node *next; enum color color; union { int i; float f; } value; };
+#endif
+'''
+
+_API = '''
+#include "types.h"
+#define API_VERSION 3
+#define OTHER 4
+point move(point p, size n);
+struct node *first(void);
+int unused_fn(struct unused *u);
+extern const char *name;
+'''
+
+class PruneTest(TempDirTest):
+
+    def setUp(self):
+        super().setUp()
+        self.types = self._write('types.h', _TYPES)
+        self.api = self._write('api.h', _API)
+
+    def _process(self, files, roots):
+        output = os.path.join(self.dir.name, 'out.lisp')
+        options = ProcessOptions(output=output, root_p=lambda name: name in roots)
+        dependencies = processfile.process_files(files, options)
+        with open(output) as f:
+            return (f.read(), dependencies)
+
+    def test_only_reachable_declarations_are_output(self):
+        (text, _) = self._process([self.api, self.types], {'move', 'first', 'API_VERSION'})
+        for name in ['"move"', '"first"', 'API_VERSION', 'defcstruct point', 'defctype point',
+                     'defctype size', 'defcenum color', 'defcstruct node', 'defcunion node-value']:
+            self.assertIn(name, text)
+        for name in ['unused', 'OTHER', '"name"']:
+            self.assertNotIn(name, text)
+
+    def test_headers_are_in_dependency_order(self):
+        (text, _) = self._process([self.api, self.types], {'first'})
+        self.assertLess(text.index(self.types), text.index(self.api))
+        self.assertLess(text.index('defcstruct node'), text.index('"first"'))
+
+    def test_headers_without_reachable_declarations_are_left_out(self):
+        (text, dependencies) = self._process([self.api, self.types], {'OTHER'})
+        self.assertNotIn(self.types, text)
+        self.assertIn(self.types, dependencies)
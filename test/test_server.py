@@ -0,0 +1,91 @@
+import os
+import socket
+import subprocess
+import sys
+import time
+
+from cl_bindgen import server
+
+from .helpers import TempDirTest
+
+class ServerTest(TempDirTest):
+
+    def setUp(self):
+        super().setUp()
+        self.path = os.path.join(self.dir.name, 'socket')
+
+    def test_exit_status(self):
+        self.assertEqual(0, server._exit_status(None))
+        self.assertEqual(2, server._exit_status(2))
+
+    def test_stale_socket_is_removed(self):
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.bind(self.path)
+        server._remove_stale_socket(self.path)
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_socket_in_use_is_kept(self):
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.bind(self.path)
+            sock.listen()
+            with self.assertRaises(FileExistsError):
+                server._remove_stale_socket(self.path)
+        self.assertTrue(os.path.exists(self.path))
+
+_HEADER = '''#define VALUE (1 + 2)
+struct point { int x; int y; };
+int move(struct point *p);
+'''
+
+def _header_messages(text):
+    return [line for line in text.splitlines() if 'point.h' in line]
+
+class ServeRequestTest(TempDirTest):
+
+    def setUp(self):
+        super().setUp()
+        self.path = os.path.join(self.dir.name, 'socket')
+        self._write('point.h', _HEADER)
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        self.env = dict(os.environ, PYTHONPATH=root)
+        self.server = subprocess.Popen([sys.executable, '-m', 'cl_bindgen', 'serve', self.path],
+                                       env=self.env, stdout=subprocess.DEVNULL,
+                                       stderr=subprocess.DEVNULL)
+        deadline = time.monotonic() + 30
+        while not os.path.exists(self.path):
+            if time.monotonic() > deadline or self.server.poll() is not None:
+                self.fail('The server did not start')
+            time.sleep(0.05)
+
+    def tearDown(self):
+        self.server.terminate()
+        self.server.wait()
+        self.dir.cleanup()
+
+    def _run(self, *argv):
+        return subprocess.run([sys.executable, '-m', 'cl_bindgen', *argv], cwd=self.dir.name,
+                              env=self.env, capture_output=True, text=True, check=False)
+
+    def test_files_request_matches_local_run(self):
+        arguments = ('files', '-MD', '-o', 'out.lisp', 'point.h')
+        local = self._run(*arguments)
+        with open(os.path.join(self.dir.name, 'out.lisp')) as f:
+            local_output = f.read()
+        with open(os.path.join(self.dir.name, 'out.lisp.d')) as f:
+            local_depfile = f.read()
+
+        served = self._run('client', self.path, *arguments)
+        self.assertEqual(local.returncode, served.returncode)
+        # Warnings printed when libclang is loaded are only printed by the server itself:
+        self.assertEqual(_header_messages(local.stderr), _header_messages(served.stderr))
+        self.assertIn('point.h:1:9', served.stderr)
+        with open(os.path.join(self.dir.name, 'out.lisp')) as f:
+            self.assertEqual(local_output, f.read())
+        with open(os.path.join(self.dir.name, 'out.lisp.d')) as f:
+            self.assertEqual(local_depfile, f.read())
+
+    def test_failing_request_status(self):
+        local = self._run('files', 'missing.h')
+        served = self._run('client', self.path, 'files', 'missing.h')
+        self.assertNotEqual(0, served.returncode)
+        self.assertEqual(local.returncode, served.returncode)
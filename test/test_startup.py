@@ -0,0 +1,29 @@
+import os
+import subprocess
+import sys
+import unittest
+
+_CHECK_MODULES = """
+import sys
+import cl_bindgen.util as util
+try:
+    util.dispatch_from_arguments(sys.argv[1:], util.build_default_options())
+except SystemExit:
+    pass
+print(' '.join(m for m in ('clang.cindex', 'yaml', 'cl_bindgen.processfile') if m in sys.modules))
+"""
+
+class StartupTest(unittest.TestCase):
+
+    def _loaded_modules(self, *arguments):
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        env = dict(os.environ, PYTHONPATH=root)
+        result = subprocess.run([sys.executable, '-c', _CHECK_MODULES, *arguments],
+                                env=env, capture_output=True, text=True, check=True)
+        return result.stdout.splitlines()[-1].split()
+
+    def test_version_does_not_load_libclang_or_yaml(self):
+        self.assertEqual([], self._loaded_modules('--version'))
+
+    def test_help_does_not_load_libclang_or_yaml(self):
+        self.assertEqual([], self._loaded_modules('batch', '--help'))
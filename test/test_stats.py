@@ -0,0 +1,87 @@
+import io
+import os
+import pstats
+
+import cl_bindgen.parallel as parallel
+import cl_bindgen.processfile as processfile
+import cl_bindgen.stats as stats
+from cl_bindgen.util import build_default_options
+
+from .helpers import TempDirTest
+
+_HEADER = '''
+#define FLAG 1
+struct point { int x; int y; };
+struct point move(struct point p, int dx, int dy);
+struct point *copy(struct point *p);
+enum color { RED, GREEN };
+'''
+
+class _HeaderTest(TempDirTest):
+
+    def setUp(self):
+        super().setUp()
+        self.header = self._write('point.h', _HEADER)
+        self.options = build_default_options()
+
+    def _process(self, name):
+        self.options.output = os.path.join(self.dir.name, name)
+        processfile.process_file(self.header, self.options)
+        with open(self.options.output) as f:
+            return f.read()
+
+class StatisticsTest(_HeaderTest):
+
+    def test_output_is_unchanged(self):
+        expected = self._process('plain.lisp')
+        with stats.Statistics():
+            actual = self._process('stats.lisp')
+        self.assertEqual(expected, actual)
+
+    def test_counts(self):
+        with stats.Statistics() as statistics:
+            text = self._process('stats.lisp')
+        self.assertEqual(2, statistics.cursors['FUNCTION_DECL'].count)
+        self.assertEqual(1, statistics.cursors['MACRO_DEFINITION'].count)
+        self.assertEqual(1, statistics.handlers['Enum'].count)
+        self.assertEqual(len(text.encode()), statistics.bytes_written)
+        self.assertEqual(0, statistics.diagnostics)
+        (hits, misses) = statistics.caches['type nodes']
+        self.assertGreater(hits, 0)
+        self.assertGreater(misses, 0)
+        self.assertGreater(statistics.phases['parse'], 0)
+
+        report = io.StringIO()
+        statistics.report(report)
+        self.assertIn('FUNCTION_DECL', report.getvalue())
+
+    def test_functions_are_restored(self):
+        originals = (processfile._extract_type, processfile._lisp_type_str,
+                     dict(processfile._extract_declarations._extract_table),
+                     dict(processfile._process_header._visit_table),
+                     parallel.should_fork)
+        with stats.Statistics():
+            self.assertIsNot(originals[0], processfile._extract_type)
+        self.assertEqual(originals, (processfile._extract_type, processfile._lisp_type_str,
+                                     processfile._extract_declarations._extract_table,
+                                     processfile._process_header._visit_table,
+                                     parallel.should_fork))
+
+class ProfileTest(_HeaderTest):
+
+    def test_cprofile(self):
+        path = os.path.join(self.dir.name, 'run.prof')
+        with stats.Profile(path):
+            self._process('profiled.lisp')
+        functions = [name for (_, _, name) in pstats.Stats(path).stats]
+        self.assertIn('_extract_file', functions)
+
+    def test_collapsed_stacks(self):
+        path = os.path.join(self.dir.name, 'run.folded')
+        with stats.Profile(path):
+            self._process('profiled.lisp')
+        with open(path) as f:
+            stacks = [line.rsplit(' ', 1) for line in f]
+        self.assertTrue(any('cl_bindgen.processfile._extract_file' in stack
+                            for (stack, _) in stacks))
+        self.assertTrue(all(int(microseconds) > 0 for (_, microseconds) in stacks))
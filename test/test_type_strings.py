@@ -0,0 +1,46 @@
+import os
+
+import cl_bindgen.processfile as processfile
+from cl_bindgen.util import build_default_options
+
+from .helpers import TempDirTest
+
+_HEADER = '''
+typedef struct point { int x; int y; } point_t;
+enum color { RED, GREEN };
+typedef point_t *point_ptr;
+struct line { point_t start; point_t *end; enum color color; point_ptr pts[4]; };
+point_t *move(point_t *p, struct point *q, enum color c, point_ptr r);
+point_t *copy(point_t *p, struct point *q, enum color c, point_ptr r);
+struct line *draw(const struct line *l, point_t points[3], unsigned int count);
+'''
+
+class _UncachedTypeStrings(dict):
+    """ Stands in for the type string cache, without keeping anything """
+
+    def __setitem__(self, key, value):
+        pass
+
+class TypeStringCacheTest(TempDirTest):
+
+    def setUp(self):
+        super().setUp()
+        self.header = self._write('line.h', _HEADER)
+
+    def _process(self, name):
+        options = build_default_options()
+        options.output = os.path.join(self.dir.name, name)
+        processfile.process_file(self.header, options)
+        with open(options.output) as f:
+            return f.read()
+
+    def test_cached_and_uncached_output_match(self):
+        cached = self._process('cached.lisp')
+        original = processfile._lisp_type_str._cache
+        processfile._lisp_type_str._cache = _UncachedTypeStrings()
+        try:
+            uncached = self._process('uncached.lisp')
+        finally:
+            processfile._lisp_type_str._cache = original
+        self.assertEqual(cached, uncached)
+        self.assertIn('(q (:pointer (:struct point)))', cached)
@@ -0,0 +1,45 @@
+import time
+
+from cl_bindgen.watch import TranslationUnitStore, _PollingWatcher
+
+from .helpers import FakeIndex, TempDirTest
+
+class _FilesTest(TempDirTest):
+
+    def setUp(self):
+        super().setUp()
+        self.header = self._write('header.h', 'int a;')
+        self.include = self._write('include.h', 'int b;')
+
+class TranslationUnitStoreTest(_FilesTest):
+
+    def test_unchanged_translation_unit_is_reused(self):
+        store = TranslationUnitStore()
+        index = FakeIndex([self.include])
+        tu = store.parse(index, self.header, [], 0)
+        self.assertIs(tu, store.parse(index, self.header, [], 0))
+        self.assertEqual(1, index.parse_count)
+        self.assertEqual(0, tu.reparse_count)
+
+    def test_changed_include_reparses(self):
+        store = TranslationUnitStore()
+        index = FakeIndex([self.include])
+        tu = store.parse(index, self.header, [], 0)
+        self._write('include.h', 'int changed;')
+        self.assertIs(tu, store.parse(index, self.header, [], 0))
+        self.assertEqual(1, tu.reparse_count)
+
+    def test_different_arguments_parse_again(self):
+        store = TranslationUnitStore()
+        index = FakeIndex([])
+        store.parse(index, self.header, ['-DA'], 0)
+        store.parse(index, self.header, ['-DB'], 0)
+        self.assertEqual(2, index.parse_count)
+
+class PollingWatcherTest(_FilesTest):
+
+    def test_changed_file_is_reported(self):
+        watcher = _PollingWatcher([self.header, self.include], interval=0.01)
+        time.sleep(0.01)
+        self._write('include.h', 'int changed;')
+        self.assertEqual({self.include}, watcher.wait())
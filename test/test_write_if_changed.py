@@ -0,0 +1,81 @@
+import os
+
+import cl_bindgen.processfile as processfile
+from cl_bindgen import util
+from cl_bindgen.options import ProcessOptions
+
+from .helpers import TempDirTest
+
+class WriteIfChangedTest(TempDirTest):
+
+    def setUp(self):
+        super().setUp()
+        self.output = os.path.join(self.dir.name, 'out.lisp')
+
+    def _process(self, header, **kwargs):
+        options = ProcessOptions(output=self.output, write_if_changed=True, **kwargs)
+        processfile.process_file(header, options)
+
+    def _age_output(self):
+        os.utime(self.output, (1000000, 1000000))
+
+    def test_unchanged_output_is_kept(self):
+        header = self._write('a.h', 'int f(void);\n')
+        self._process(header)
+        self._age_output()
+        self._process(header)
+        self.assertEqual(1000000, os.stat(self.output).st_mtime)
+        self.assertEqual(['a.h', 'out.lisp'], sorted(os.listdir(self.dir.name)))
+
+    def test_changed_output_is_replaced(self):
+        header = self._write('a.h', 'int f(void);\n')
+        self._process(header)
+        self._age_output()
+        self._write('a.h', 'int g(void);\n')
+        self._process(header, stream_output=True)
+        self.assertNotEqual(1000000, os.stat(self.output).st_mtime)
+        with open(self.output) as f:
+            self.assertIn('"g"', f.read())
+
+    def _process_batch(self, batch):
+        options = util.build_default_options()
+        options.write_if_changed = True
+        util.process_batch_files([batch], options, jobs=2)
+
+    def test_numbered_anonymous_enums_are_compared(self):
+        self._write('a.h', 'enum { A };\n')
+        self._write('b.h', 'enum { B };\n')
+        batch = self._write('batch.yaml',
+                            'output: a.lisp\nfiles: [a.h]\n---\noutput: b.lisp\nfiles: [b.h]\n')
+        cwd = os.getcwd()
+        os.chdir(self.dir.name)
+        try:
+            # Anonymous enums are numbered from the count left by previous runs:
+            processfile._process_enum_decl.anon_count = 0
+            self._process_batch(batch)
+            os.utime('b.lisp', (1000000, 1000000))
+            processfile._process_enum_decl.anon_count = 0
+            self._process_batch(batch)
+            self.assertEqual(1000000, os.stat('b.lisp').st_mtime)
+            with open('b.lisp') as f:
+                self.assertIn('anon-enum-1', f.read())
+            self.assertEqual(['a.h', 'a.lisp', 'b.h', 'b.lisp', 'batch.yaml'],
+                             sorted(os.listdir()))
+        finally:
+            os.chdir(cwd)
+
+    def test_unnumbered_output_is_removed_on_error(self):
+        self._write('a.h', 'enum { A };\n')
+        self._write('b.h', 'int f(void);\n')
+        # The output of a.lisp is written, then writing its depfile fails:
+        batch = self._write('batch.yaml',
+                            'output: a.lisp\nfiles: [a.h]\ndepfile: missing/a.d\n'
+                            '---\noutput: b.lisp\nfiles: [b.h]\n')
+        cwd = os.getcwd()
+        os.chdir(self.dir.name)
+        try:
+            with self.assertRaises(util.DocumentErrors):
+                self._process_batch(batch)
+            self.assertEqual(['a.h', 'b.h', 'b.lisp', 'batch.yaml'], sorted(os.listdir()))
+        finally:
+            os.chdir(cwd)